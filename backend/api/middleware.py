@@ -0,0 +1,42 @@
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from services.runtime_config import runtime_config
+
+# Still served in maintenance mode, so admins can sign in and switch it off
+MAINTENANCE_EXEMPT_PREFIXES = ("/health", "/api/auth/", "/api/admin/", "/api/docs", "/api/redoc", "/openapi.json")
+MAINTENANCE_RETRY_AFTER_SECONDS = 60
+
+class MaintenanceMiddleware:
+    """Turns requests away with 503 while the runtime config has maintenance mode on.
+
+    Plain ASGI rather than ``BaseHTTPMiddleware``, so it does not buffer
+    streamed responses; while maintenance mode is off the check is a
+    single attribute read.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            not runtime_config.maintenance_mode
+            or scope["type"] not in ("http", "websocket")
+            or scope["path"].startswith(MAINTENANCE_EXEMPT_PREFIXES)
+        ):
+            await self.app(scope, receive, send)
+            return
+        if scope["type"] == "websocket":
+            # Closing before the handshake would reach the client as a 403; accept, then close
+            # with 1013 (try again later) so it can tell maintenance from a refused connection
+            message = await receive()
+            if message["type"] == "websocket.connect":
+                await send({"type": "websocket.accept"})
+                await send({"type": "websocket.close", "code": 1013, "reason": "Under maintenance"})
+            return
+        response = JSONResponse(
+            {"detail": "The service is under maintenance, please retry later"},
+            status_code=503,
+            headers={"Retry-After": str(MAINTENANCE_RETRY_AFTER_SECONDS)}
+        )
+        await response(scope, receive, send)
@@ -1,13 +1,25 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from datetime import date, datetime, timezone
 import logging
 
 from core.database import get_db
-from core.security import get_current_admin_user
+from core.security import get_current_admin_user, user_cache, api_key_cache, password_hasher
 from models.user import User
-from models.api_usage import APIUsage
+from services.providers import providers
+from services.response_cache import response_cache
+from services.single_flight import single_flight
+from services.batcher import generation_batcher
+from services.model_registry import model_registry
+from services.rate_limiter import rate_limiter
+from services.runtime_config import RATE_LIMIT_SETTINGS, ConfigConflict, runtime_config
+from services.resilience import resilience_stats
+from services.scheduler import admission_scheduler
+from services.streaming import stream_stats
+from services.usage import usage_by_model, usage_recorder, sum_totals
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -17,6 +29,20 @@ class SystemConfig(BaseModel):
     default_model: str
     rate_limits: Dict[str, int]
     maintenance_mode: bool
+    version: Optional[int] = None  # the version this config is based on (a stale version is rejected)
+
+class UserAdminUpdate(BaseModel):
+    is_active: Optional[bool] = None
+    is_admin: Optional[bool] = None
+
+class AdminUserResponse(BaseModel):
+    id: int
+    email: str
+    username: str
+    full_name: Optional[str]
+    is_active: bool
+    is_admin: bool
+    created_at: Optional[datetime]
 
 class ContentUpdate(BaseModel):
     page: str
@@ -25,71 +51,108 @@ class ContentUpdate(BaseModel):
 
 @router.get("/stats")
 async def get_system_stats(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
     current_admin: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get system statistics"""
-    total_users = db.query(User).count()
-    active_users = db.query(User).filter(User.is_active == True).count()
-    total_api_calls = db.query(APIUsage).count()
+    """Get system statistics (API totals optionally for a UTC day range)"""
+    users = (await db.execute(select(
+        func.count(),
+        func.count().filter(User.is_active == True),
+        func.count().filter(User.is_admin == True)
+    ).select_from(User))).one()
+    
+    by_model = await usage_by_model(db, start=start, end=end)
+    totals = sum_totals(by_model)
+    today = datetime.now(timezone.utc).date()
+    calls_today = sum_totals(await usage_by_model(db, start=today, end=today))["requests"]
     
     return {
         "users": {
-            "total": total_users,
-            "active": active_users,
-            "admins": db.query(User).filter(User.is_admin == True).count()
+            "total": users[0],
+            "active": users[1],
+            "admins": users[2]
         },
         "api": {
-            "total_calls": total_api_calls,
-            "calls_today": 0,  # Implement date filter
-            "total_tokens": db.query(APIUsage).with_entities(
-                db.func.sum(APIUsage.tokens_used)
-            ).scalar() or 0
+            "total_calls": totals["requests"],
+            "calls_today": calls_today,
+            "total_tokens": totals["tokens_used"],
+            "total_cost": totals["cost"],
+            "errors": totals["errors"]
         },
         "models": {
-            "active": 4,
-            "total_requests": total_api_calls
+            "active": sum(1 for model in model_registry.get_all_models() if model.get("available")),
+            "total_requests": totals["requests"],
+            "requests_by_model": {model: t["requests"] for model, t in by_model.items()}
         }
     }
 
+@router.get("/metrics")
+async def get_runtime_metrics(current_admin: User = Depends(get_current_admin_user)):
+    """Get in-process runtime metrics for this worker"""
+    return {
+        "llm_http_pools": providers.stats(),
+        "user_cache": user_cache.stats(),
+        "api_key_cache": api_key_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "response_cache": response_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "batching": generation_batcher.stats(),
+        "resilience": {**resilience_stats(), "circuits": model_registry.circuit_states()},
+        "routing": model_registry.routing_stats(),
+        "streaming": stream_stats.stats(),
+        "rate_limits": rate_limiter.stats(),
+        "scheduler": admission_scheduler.stats(),
+        "runtime_config": runtime_config.stats(),
+        "usage_recording": usage_recorder.stats()
+    }
+
 @router.get("/config", response_model=SystemConfig)
 async def get_config(current_admin: User = Depends(get_current_admin_user)):
     """Get system configuration"""
-    # This would be stored in database/Redis in production
-    return SystemConfig(
-        feature_flags={
-            "chat_enabled": True,
-            "api_enabled": True,
-            "streaming_enabled": True,
-            "file_upload_enabled": True
-        },
-        default_model="llama-3.1-70b",
-        rate_limits={
-            "requests_per_minute": 60,
-            "tokens_per_day": 100000
-        },
-        maintenance_mode=False
-    )
+    return runtime_config.snapshot.as_dict()
 
 @router.post("/config")
 async def update_config(
     config: SystemConfig,
-    current_admin: User = Depends(get_current_admin_user)
+    current_admin: User = Depends(get_current_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Update system configuration"""
-    # Store in database/Redis
-    logger.info(f"Config updated by admin {current_admin.username}")
-    return {"status": "success", "message": "Configuration updated"}
+    """Update system configuration (applies to every worker within seconds)"""
+    unknown = set(config.rate_limits) - set(RATE_LIMIT_SETTINGS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown rate limit settings: {', '.join(sorted(unknown))}")
+    if any(value < 0 for value in config.rate_limits.values()):
+        raise HTTPException(status_code=400, detail="Rate limit settings cannot be negative")
+    if not model_registry.is_model_available(config.default_model):
+        raise HTTPException(status_code=400, detail=f"Unknown default model: {config.default_model}")
+    try:
+        snapshot = await runtime_config.update_config(
+            db, config.dict(exclude={"version"}), current_admin.username, expected_version=config.version
+        )
+    except ConfigConflict as e:
+        raise HTTPException(status_code=409, detail=f"{e}, reload it and try again")
+    logger.info(f"Config updated to version {snapshot.version} by admin {current_admin.username}")
+    return {"status": "success", "message": "Configuration updated", "version": snapshot.version}
+
+@router.get("/content")
+async def get_content(current_admin: User = Depends(get_current_admin_user)):
+    """Get all page content, by page and section"""
+    return {"version": runtime_config.snapshot.version, "pages": runtime_config.snapshot.content}
 
 @router.post("/content")
 async def update_content(
     update: ContentUpdate,
-    current_admin: User = Depends(get_current_admin_user)
+    current_admin: User = Depends(get_current_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Update page content (CMS functionality)"""
-    # Store content updates in database
+    snapshot = await runtime_config.update_content(
+        db, update.page, update.section, update.content, current_admin.username
+    )
     logger.info(f"Content updated: {update.page}/{update.section} by {current_admin.username}")
-    return {"status": "success", "message": "Content updated"}
+    return {"status": "success", "message": "Content updated", "version": snapshot.version}
 
 @router.post("/deploy")
 async def trigger_deployment(
@@ -109,11 +172,33 @@ async def trigger_deployment(
         "deployment_id": "deploy-123456"
     }
 
-@router.get("/users")
+@router.get("/users", response_model=List[AdminUserResponse])
 async def list_all_users(
     current_admin: User = Depends(get_current_admin_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """List all users (admin only)"""
-    users = db.query(User).all()
-    return users
\ No newline at end of file
+    result = await db.execute(select(User))
+    users = result.scalars().all()
+    return users
+
+@router.patch("/users/{user_id}", response_model=AdminUserResponse)
+async def update_user(
+    user_id: int,
+    update: UserAdminUpdate,
+    current_admin: User = Depends(get_current_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Activate/deactivate a user or change admin rights (admin only)"""
+    user = await db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    for field, value in update.dict(exclude_unset=True).items():
+        setattr(user, field, value)
+    await db.commit()
+    await db.refresh(user)
+    await user_cache.invalidate(user.id)
+    
+    logger.info(f"User {user.id} updated by admin {current_admin.username}")
+    return user
\ No newline at end of file
@@ -1,16 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, EmailStr
 from typing import Optional
-import secrets
 
 from core.database import get_db
 from core.security import (
-    verify_password,
-    get_password_hash,
+    password_hasher,
     create_access_token,
-    get_current_user
+    get_current_user,
+    generate_api_key,
+    hash_api_key,
+    user_cache,
+    api_key_cache
 )
 from models.user import User
 
@@ -35,16 +38,18 @@ class UserResponse(BaseModel):
     api_key: Optional[str]
 
 @router.post("/register", response_model=UserResponse)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     """Register new user"""
     # Check if user exists
-    if db.query(User).filter(User.email == user.email).first():
+    result = await db.execute(select(User).where(User.email == user.email))
+    if result.scalars().first():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    if db.query(User).filter(User.username == user.username).first():
+    result = await db.execute(select(User).where(User.username == user.username))
+    if result.scalars().first():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already taken"
@@ -54,22 +59,29 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
     db_user = User(
         email=user.email,
         username=user.username,
-        hashed_password=get_password_hash(user.password),
-        full_name=user.full_name,
-        api_key=f"raj_{secrets.token_urlsafe(32)}"
+        hashed_password=await password_hasher.hash(user.password),
+        full_name=user.full_name
     )
+    db_user.api_key = generate_api_key()
+    db_user.api_key_hash = hash_api_key(db_user.api_key)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     return db_user
 
 @router.post("/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """Login and get access token"""
-    user = db.query(User).filter(User.username == form_data.username).first()
+    result = await db.execute(select(User).where(User.username == form_data.username))
+    user = result.scalars().first()
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    valid, new_hash = False, None
+    if user:
+        valid, new_hash = await password_hasher.verify_and_update(
+            form_data.password, user.hashed_password
+        )
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -82,18 +94,29 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
             detail="Inactive user"
         )
     
+    # Transparently upgrade hashes made with an older bcrypt cost
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+    
     access_token = create_access_token(data={"sub": str(user.id)})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/me", response_model=UserResponse)
-async def get_me(current_user: User = Depends(get_current_user)):
+async def get_me(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """Get current user info"""
-    return current_user
+    # The cached principal only holds the API key's hash, the key itself comes from the row
+    return await db.get(User, current_user.id)
 
 @router.post("/refresh-api-key", response_model=UserResponse)
-async def refresh_api_key(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def refresh_api_key(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """Generate new API key for user"""
-    current_user.api_key = f"raj_{secrets.token_urlsafe(32)}"
-    db.commit()
-    db.refresh(current_user)
-    return current_user
\ No newline at end of file
+    user = await db.get(User, current_user.id)
+    if user.api_key_hash:
+        api_key_cache.delete(user.api_key_hash)
+    user.api_key = generate_api_key()
+    user.api_key_hash = hash_api_key(user.api_key)
+    await db.commit()
+    await db.refresh(user)
+    await user_cache.invalidate(user.id)
+    return user
\ No newline at end of file
@@ -0,0 +1,182 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel, Field
+from typing import Any, AsyncGenerator, Dict, List, Optional
+from datetime import datetime, timezone
+import logging
+
+from api.routes.chat import ChatMessage, ClosingStreamingResponse
+from core.config import settings
+from core.database import get_db, AsyncSessionLocal
+from core.security import get_current_user
+from core.serialization import dumps, loads
+from models.batch import BatchItem, BatchJob
+from models.user import User
+from services.batch import ACTIVE_STATUSES
+from services.runtime_config import runtime_config
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+# Rows inserted per statement while reading an upload
+_INSERT_CHUNK = 1000
+
+class BatchRequestLine(BaseModel):
+    custom_id: Optional[str] = Field(None, max_length=255)
+    messages: List[ChatMessage] = Field(min_length=1)
+    model: str = Field(default_factory=lambda: runtime_config.default_model)
+    temperature: float = 0.7
+    max_tokens: int = 2048
+    cache: Optional[bool] = None
+
+_JOB_COLUMNS = (
+    BatchJob.id, BatchJob.status, BatchJob.total, BatchJob.succeeded, BatchJob.failed,
+    BatchJob.tokens_used, BatchJob.created_at, BatchJob.started_at, BatchJob.finished_at
+)
+
+async def _read_lines(request: Request) -> AsyncGenerator[bytes, None]:
+    """Lines of the request body, read as it arrives"""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+async def _get_owned_job(job_id: int, user: User, db: AsyncSession) -> Dict[str, Any]:
+    result = await db.execute(select(*_JOB_COLUMNS).where(BatchJob.id == job_id, BatchJob.user_id == user.id))
+    row = result.first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return dict(row._mapping)
+
+@router.post("", status_code=202)
+async def create_batch_job(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Queue a JSONL file of chat requests (one per line) for offline processing"""
+    job = BatchJob(user_id=current_user.id, status="queued")
+    db.add(job)
+    await db.flush()
+
+    now = datetime.now(timezone.utc)
+    rows = []
+    total = 0
+    line_number = 0
+    async for text in _read_lines(request):
+        line_number += 1
+        if not text.strip():
+            continue
+        if total >= settings.BATCH_MAX_LINES:
+            raise HTTPException(status_code=413, detail=f"A batch can have at most {settings.BATCH_MAX_LINES} requests")
+        try:
+            line = BatchRequestLine(**loads(text))
+        except (ValueError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=f"Line {line_number}: invalid request: {e}")
+        rows.append({
+            "job_id": job.id,
+            "line": line_number,
+            "custom_id": line.custom_id,
+            "model_name": line.model,
+            "request": dumps({
+                "messages": [message.dict() for message in line.messages],
+                "temperature": line.temperature,
+                "max_tokens": line.max_tokens,
+                "cache": line.cache
+            }).decode(),
+            "status": "pending",
+            "attempts": 0,
+            "available_at": now
+        })
+        total += 1
+        if len(rows) >= _INSERT_CHUNK:
+            await db.execute(insert(BatchItem), rows)
+            rows = []
+    if not total:
+        raise HTTPException(status_code=400, detail="The batch has no requests")
+    if rows:
+        await db.execute(insert(BatchItem), rows)
+    job.total = total
+    await db.commit()
+
+    logger.info(f"Batch job {job.id} queued with {total} requests by user {current_user.id}")
+    return await _get_owned_job(job.id, current_user, db)
+
+@router.get("")
+async def list_batch_jobs(
+    before: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get user's batch jobs, newest first (pass the last id as ``before`` for the next page)"""
+    query = select(*_JOB_COLUMNS).where(BatchJob.user_id == current_user.id)
+    if before is not None:
+        query = query.where(BatchJob.id < before)
+    result = await db.execute(query.order_by(BatchJob.id.desc()).limit(limit))
+    return [dict(row._mapping) for row in result]
+
+@router.get("/{job_id}")
+async def get_batch_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get a batch job's status and progress"""
+    return await _get_owned_job(job_id, current_user, db)
+
+@router.post("/{job_id}/cancel")
+async def cancel_batch_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Stop processing a batch job (requests already running still finish)"""
+    await _get_owned_job(job_id, current_user, db)
+    await db.execute(
+        update(BatchJob)
+        .where(BatchJob.id == job_id, BatchJob.status.in_(ACTIVE_STATUSES))
+        .values(status="cancelled", finished_at=datetime.now(timezone.utc))
+    )
+    await db.commit()
+    return await _get_owned_job(job_id, current_user, db)
+
+@router.get("/{job_id}/results")
+async def download_batch_results(
+    job_id: int,
+    after: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Stream a batch job's results as JSONL, in the order they finished.
+
+    Each line carries its ``seq``; results can be downloaded while the job
+    runs and the download resumed with ``after`` set to the last ``seq`` seen.
+    """
+    job = await _get_owned_job(job_id, current_user, db)
+
+    async def lines() -> AsyncGenerator[bytes, None]:
+        # The request's session is closed before the body is sent, use our own
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(
+                select(BatchItem.output)
+                .where(BatchItem.job_id == job_id, BatchItem.seq > after)
+                .order_by(BatchItem.seq)
+                .execution_options(yield_per=settings.CHAT_EXPORT_BATCH_SIZE)
+            )
+            async for batch in result.partitions():
+                yield "".join(f"{output}\n" for (output,) in batch).encode()
+
+    return ClosingStreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="batch-{job_id}-results.jsonl"',
+            "X-Batch-Status": job["status"]
+        }
+    )
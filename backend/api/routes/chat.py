@@ -1,17 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Response, WebSocket, WebSocketDisconnect, status
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from typing import List, Optional, AsyncGenerator
-import json
+from starlette.background import BackgroundTask
+from sqlalchemy import func, literal, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, AsyncGenerator, Dict, Any
+import asyncio
+import base64
+import math
 import time
 import logging
 
-from core.database import get_db, get_redis
-from core.security import get_current_user
+from core.config import settings
+from core.database import get_db, AsyncSessionLocal
+from core.security import get_current_user, authenticate_token
+from core.serialization import dumps, loads
 from models.user import User
 from models.conversation import Conversation, Message
 from services.llm_service import LLMService
+from services.prompt import PromptTooLarge, assemble_prompt, token_counter
+from services.resilience import BackendRejectedRequest, LLMBackendError
+from services.rate_limiter import rate_limiter
+from services.runtime_config import runtime_config
+from services.scheduler import BATCH, INTERACTIVE, Overloaded, Ticket
+from services.streaming import StreamTee, sse_frame
+from services.usage import usage_recorder
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -22,11 +35,13 @@ class ChatMessage(BaseModel):
 
 class ChatRequest(BaseModel):
     messages: List[ChatMessage]
-    model: Optional[str] = "llama-3.1-70b"
+    model: Optional[str] = Field(default_factory=lambda: runtime_config.default_model)
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = 2048
     stream: Optional[bool] = False
     conversation_id: Optional[int] = None
+    cache: Optional[bool] = None  # opt in/out of the response cache (sampled requests are not cached by default)
+    include_history: Optional[bool] = None  # prepend stored history (default: when no assistant turns are sent)
 
 class ChatResponse(BaseModel):
     content: str
@@ -35,51 +50,168 @@ class ChatResponse(BaseModel):
     latency_ms: int
     conversation_id: int
 
+async def _get_or_create_conversation(
+    request: ChatRequest,
+    current_user: User,
+    db: AsyncSession
+) -> Conversation:
+    """Load the requested conversation or start a new one"""
+    if request.conversation_id:
+        result = await db.execute(select(Conversation).where(
+            Conversation.id == request.conversation_id,
+            Conversation.user_id == current_user.id
+        ))
+        conversation = result.scalars().first()
+        if not conversation:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        return conversation
+    
+    conversation = Conversation(
+        user_id=current_user.id,
+        model_name=request.model
+    )
+    db.add(conversation)
+    await db.commit()
+    await db.refresh(conversation)
+    return conversation
+
+async def _build_prompt(request: ChatRequest, db: AsyncSession) -> List[Dict[str, str]]:
+    """The request's messages with fitting conversation history, or 400 if they cannot fit"""
+    try:
+        return await assemble_prompt(
+            db,
+            request.model,
+            [msg.dict() for msg in request.messages],
+            request.max_tokens,
+            conversation_id=request.conversation_id,
+            include_history=request.include_history
+        )
+    except PromptTooLarge as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _require_features(*flags: str):
+    """Reject the request if an admin has switched any of these features off"""
+    feature_flags = runtime_config.snapshot.feature_flags
+    disabled = [flag for flag in flags if not feature_flags.get(flag, True)]
+    if disabled:
+        raise HTTPException(status_code=503, detail=f"Temporarily disabled: {', '.join(disabled)}")
+
+async def _enforce_rate_limit(request: ChatRequest, user: User) -> Dict[str, str]:
+    """Take one request from the user's rate limits, raising 429 when over them"""
+    limit = await rate_limiter.acquire(user.id, request.model)
+    if not settings.RATE_LIMIT_ENABLED:
+        return {}
+    if not limit.allowed:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit exceeded ({limit.reason.replace('_', ' ')})",
+            headers=limit.headers()
+        )
+    return limit.headers()
+
+async def _persist_stream(
+    tee: StreamTee,
+    request: ChatRequest,
+    conversation_id: int,
+    user_id: int,
+    endpoint: str = "/api/chat/stream"
+):
+    """Store a finished stream's messages and usage (runs after the response is sent)"""
+    # Failed and aborted generations still used tokens (499: client closed the request)
+    tokens_used = tee.tokens_used
+    status_code = 200 if tee.completed else 503 if tee.failed else 499
+    usage_recorder.record(user_id, endpoint, tee.model or request.model, tokens_used, tee.latency_ms, status_code)
+    await rate_limiter.debit(user_id, request.model, tokens_used)
+    if not tee.completed:
+        return
+    
+    try:
+        content = tee.content
+        user_tokens, assistant_tokens = await token_counter.count(request.model, [request.messages[-1].content, content])
+        tokenizer = await token_counter.tokenizer_id(request.model)
+        async with AsyncSessionLocal() as db:
+            db.add_all([
+                Message(
+                    conversation_id=conversation_id,
+                    role="user",
+                    content=request.messages[-1].content,
+                    tokens_used=tokens_used,
+                    content_tokens=user_tokens,
+                    content_tokenizer=tokenizer,
+                    latency_ms=tee.latency_ms
+                ),
+                Message(
+                    conversation_id=conversation_id,
+                    role="assistant",
+                    content=content,
+                    tokens_used=tokens_used,
+                    content_tokens=assistant_tokens,
+                    content_tokenizer=tokenizer,
+                    latency_ms=tee.latency_ms
+                )
+            ])
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Failed to persist stream for conversation {conversation_id}: {e}")
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that closes its body iterator as soon as it ends.
+
+    On client disconnect Starlette cancels the send loop but leaves the body
+    generator suspended until garbage collection. Closing it right away
+    unwinds the upstream stream, which aborts the generation on the
+    inference server and frees its slot.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+
 @router.post("/completions", response_model=ChatResponse)
 async def chat_completion(
     request: ChatRequest,
+    response: Response,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Generate chat completion (non-streaming)"""
+    _require_features("chat_enabled")
     start_time = time.time()
+    response.headers.update(await _enforce_rate_limit(request, current_user))
     
     # Get or create conversation
-    if request.conversation_id:
-        conversation = db.query(Conversation).filter(
-            Conversation.id == request.conversation_id,
-            Conversation.user_id == current_user.id
-        ).first()
-        if not conversation:
-            raise HTTPException(status_code=404, detail="Conversation not found")
-    else:
-        conversation = Conversation(
-            user_id=current_user.id,
-            model_name=request.model
-        )
-        db.add(conversation)
-        db.commit()
-        db.refresh(conversation)
+    conversation = await _get_or_create_conversation(request, current_user, db)
+    messages = await _build_prompt(request, db)
     
-    # Initialize LLM service
-    llm_service = LLMService(model_name=request.model)
+    # Initialize LLM service (non-streaming API calls queue behind interactive streams)
+    llm_service = LLMService(model_name=request.model, ticket=Ticket(current_user.id, BATCH))
     
     try:
         # Generate response
-        response = await llm_service.generate(
-            messages=[msg.dict() for msg in request.messages],
+        result = await llm_service.generate(
+            messages=messages,
             temperature=request.temperature,
-            max_tokens=request.max_tokens
+            max_tokens=request.max_tokens,
+            cache=request.cache
         )
         
         latency_ms = int((time.time() - start_time) * 1000)
+        user_tokens, assistant_tokens = await token_counter.count(
+            request.model, [request.messages[-1].content, result["content"]]
+        )
+        tokenizer = await token_counter.tokenizer_id(request.model)
         
         # Save user message
         user_message = Message(
             conversation_id=conversation.id,
             role="user",
             content=request.messages[-1].content,
-            tokens_used=response.get("tokens_used", 0),
+            tokens_used=result.get("tokens_used", 0),
+            content_tokens=user_tokens,
+            content_tokenizer=tokenizer,
             latency_ms=latency_ms
         )
         db.add(user_message)
@@ -88,77 +220,464 @@ async def chat_completion(
         assistant_message = Message(
             conversation_id=conversation.id,
             role="assistant",
-            content=response["content"],
-            tokens_used=response.get("tokens_used", 0),
+            content=result["content"],
+            tokens_used=result.get("tokens_used", 0),
+            content_tokens=assistant_tokens,
+            content_tokenizer=tokenizer,
             latency_ms=latency_ms
         )
         db.add(assistant_message)
-        db.commit()
+        await db.commit()
+        usage_recorder.record(
+            current_user.id, "/api/chat/completions", result.get("model", request.model),
+            result.get("tokens_used", 0), latency_ms, 200
+        )
+        background_tasks.add_task(rate_limiter.debit, current_user.id, request.model, result.get("tokens_used", 0))
         
         return ChatResponse(
-            content=response["content"],
-            model=request.model,
-            tokens_used=response.get("tokens_used", 0),
+            content=result["content"],
+            model=result.get("model", request.model),
+            tokens_used=result.get("tokens_used", 0),
             latency_ms=latency_ms,
             conversation_id=conversation.id
         )
     
+    except BackendRejectedRequest as e:
+        logger.warning(f"Chat completion rejected by backend: {e}")
+        status_code = 400 if e.client_fault else 502
+        usage_recorder.record(
+            current_user.id, "/api/chat/completions", request.model, 0, int((time.time() - start_time) * 1000), status_code
+        )
+        raise HTTPException(status_code=status_code, detail=str(e))
+    except LLMBackendError as e:
+        logger.error(f"Chat completion backend error: {e}")
+        usage_recorder.record(
+            current_user.id, "/api/chat/completions", request.model, 0, int((time.time() - start_time) * 1000), 503
+        )
+        if isinstance(e, Overloaded):
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+        raise HTTPException(
+            status_code=503,
+            detail="Model backend unavailable, please retry shortly",
+            headers={"Retry-After": str(int(settings.LLM_BREAKER_RESET_SECONDS))}
+        )
     except Exception as e:
         logger.error(f"Chat completion error: {e}")
+        usage_recorder.record(
+            current_user.id, "/api/chat/completions", request.model, 0, int((time.time() - start_time) * 1000), 500
+        )
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/stream")
 async def chat_stream(
     request: ChatRequest,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Generate chat completion (streaming)"""
-    async def generate() -> AsyncGenerator[str, None]:
-        llm_service = LLMService(model_name=request.model)
+    _require_features("chat_enabled", "streaming_enabled")
+    rate_limit_headers = await _enforce_rate_limit(request, current_user)
+    conversation = await _get_or_create_conversation(request, current_user, db)
+    messages = await _build_prompt(request, db)
+    tee = StreamTee()
+    
+    async def generate() -> AsyncGenerator[bytes, None]:
+        llm_service = LLMService(model_name=request.model, ticket=Ticket(current_user.id, INTERACTIVE))
+        stream = tee.tee(llm_service.stream_generate(
+            messages=messages,
+            temperature=request.temperature,
+            max_tokens=request.max_tokens,
+            cache=request.cache
+        ))
         
         try:
-            async for chunk in llm_service.stream_generate(
-                messages=[msg.dict() for msg in request.messages],
-                temperature=request.temperature,
-                max_tokens=request.max_tokens
-            ):
-                yield f"data: {json.dumps(chunk)}\n\n"
+            async for chunk in stream:
+                if chunk.get("done"):
+                    # Chunks may be shared with coalesced streams, copy before tagging
+                    chunk = {**chunk, "conversation_id": conversation.id}
+                # Shared chunks carry their encoded frame, so it is built only once
+                yield sse_frame(chunk)
         except Exception as e:
             logger.error(f"Streaming error: {e}")
-            yield f"data: {{\"error\": \"{str(e)}\"}}\n\n"
+            yield sse_frame({"error": str(e)})
+        finally:
+            # Closing this generator does not close the one it was reading
+            await stream.aclose()
     
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    # Messages and usage are written once the stream has been sent
+    return ClosingStreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers=rate_limit_headers,
+        background=BackgroundTask(_persist_stream, tee, request, conversation.id, current_user.id)
+    )
+
+_CONVERSATION_COLUMNS = (
+    Conversation.id, Conversation.title, Conversation.model_name, Conversation.created_at, Conversation.updated_at
+)
+_MESSAGE_COLUMNS = (
+    Message.id, Message.role, Message.tokens_used, Message.latency_ms, Message.created_at
+)
+
+def _encode_cursor(row_id: int) -> str:
+    """Opaque keyset cursor for the row a page ended on"""
+    return base64.urlsafe_b64encode(dumps(row_id)).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> int:
+    try:
+        return int(loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _cursor_position(timestamp_column, id_column, cursor: str, *scope):
+    """The (timestamp, id) key of the cursor's row, as stored.
+
+    The timestamp is read back from the row rather than carried in the
+    cursor, so the comparison sees the database's own value (SQLite keeps
+    timestamps as text and would compare a re-encoded one lexically).
+    """
+    row_id = _decode_cursor(cursor)
+    timestamp = select(timestamp_column).where(id_column == row_id, *scope).scalar_subquery()
+    return tuple_(timestamp, literal(row_id))
+
+def _page(rows: List[Any], limit: int) -> Dict[str, Any]:
+    """One page of rows (fetched with ``limit + 1``) and the cursor for the next"""
+    items = [dict(row._mapping) for row in rows[:limit]]
+    next_cursor = _encode_cursor(items[-1]["id"]) if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
 
 @router.get("/conversations")
 async def get_conversations(
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get user's conversations"""
-    conversations = db.query(Conversation).filter(
+    """Get user's conversations, most recently updated first (keyset paginated)"""
+    query = select(*_CONVERSATION_COLUMNS).where(
         Conversation.user_id == current_user.id,
         Conversation.is_deleted == False
-    ).order_by(Conversation.updated_at.desc()).all()
+    )
+    if cursor:
+        position = _cursor_position(
+            Conversation.updated_at, Conversation.id, cursor, Conversation.user_id == current_user.id
+        )
+        query = query.where(tuple_(Conversation.updated_at, Conversation.id) < position)
+    result = await db.execute(
+        query.order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(limit + 1)
+    )
     
-    return conversations
+    return _page(result.all(), limit)
+
+async def _get_owned_conversation(conversation_id: int, user: User, db: AsyncSession):
+    result = await db.execute(select(Conversation.id).where(
+        Conversation.id == conversation_id,
+        Conversation.user_id == user.id
+    ))
+    if result.first() is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
 
 @router.get("/conversations/{conversation_id}/messages")
 async def get_conversation_messages(
     conversation_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    include_content: bool = True,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get messages for a conversation"""
-    conversation = db.query(Conversation).filter(
-        Conversation.id == conversation_id,
-        Conversation.user_id == current_user.id
-    ).first()
+    """Get messages for a conversation (keyset paginated; ``include_content=false`` returns previews)"""
+    await _get_owned_conversation(conversation_id, current_user, db)
     
-    if not conversation:
-        raise HTTPException(status_code=404, detail="Conversation not found")
+    content = Message.content if include_content else func.substr(Message.content, 1, 120).label("preview")
+    query = select(*_MESSAGE_COLUMNS, content).where(Message.conversation_id == conversation_id)
+    key = tuple_(Message.created_at, Message.id)
+    if cursor:
+        position = _cursor_position(
+            Message.created_at, Message.id, cursor, Message.conversation_id == conversation_id
+        )
+        query = query.where(key > position if order == "asc" else key < position)
+    if order == "asc":
+        query = query.order_by(Message.created_at.asc(), Message.id.asc())
+    else:
+        query = query.order_by(Message.created_at.desc(), Message.id.desc())
+    result = await db.execute(query.limit(limit + 1))
+    
+    return _page(result.all(), limit)
+
+@router.get("/export")
+async def export_history(current_user: User = Depends(get_current_user)):
+    """Stream the user's full chat history as NDJSON.
+
+    Each conversation is a ``{"type": "conversation", ...}`` line followed by
+    its ``{"type": "message", ...}`` lines, read from one server-side cursor.
+    """
+    user_id = current_user.id
+    
+    async def lines() -> AsyncGenerator[bytes, None]:
+        # The request's session is closed before the body is sent, use our own
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(
+                select(*_CONVERSATION_COLUMNS, Message.id, Message.role, Message.content,
+                       Message.tokens_used, Message.created_at)
+                .select_from(Conversation)
+                .outerjoin(Message, Message.conversation_id == Conversation.id)
+                .where(Conversation.user_id == user_id, Conversation.is_deleted == False)
+                .order_by(Conversation.id, Message.created_at, Message.id)
+                .execution_options(yield_per=settings.CHAT_EXPORT_BATCH_SIZE)
+            )
+            current = None
+            async for batch in result.partitions():
+                buffer = bytearray()
+                for row in batch:
+                    conversation_id, title, model_name, created_at, updated_at = row[:5]
+                    if conversation_id != current:
+                        current = conversation_id
+                        buffer += dumps({
+                            "type": "conversation", "id": conversation_id, "title": title,
+                            "model_name": model_name, "created_at": created_at, "updated_at": updated_at
+                        }) + b"\n"
+                    message_id, role, content, tokens_used, message_created_at = row[5:]
+                    if message_id is not None:
+                        buffer += dumps({
+                            "type": "message", "id": message_id, "conversation_id": conversation_id,
+                            "role": role, "content": content, "tokens_used": tokens_used,
+                            "created_at": message_created_at
+                        }) + b"\n"
+                yield bytes(buffer)
+    
+    return ClosingStreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="chat-history.ndjson"'}
+    )
+
+class _SocketGeneration:
+    """One generation multiplexed over a chat socket, with its send credits"""
+    
+    def __init__(self, credits: int):
+        self.credits = credits
+        self.cancelled = False
+        self.task: Optional[asyncio.Task] = None
+        self._granted = asyncio.Event()
+    
+    def grant(self, credits: int):
+        self.credits += credits
+        self._granted.set()
+    
+    async def spend(self):
+        """Take one credit, waiting for the client to grant more if needed"""
+        while self.credits <= 0:
+            self._granted.clear()
+            await self._granted.wait()
+        self.credits -= 1
+
+class ChatSocket:
+    """Protocol state of one authenticated ``/ws`` connection.
+
+    Client messages (JSON):
+      ``{"type": "generate", "id": ..., "messages": [...], ...}`` starts a
+      generation (same fields as ``ChatRequest``, plus optional ``credits``);
+      ``{"type": "cancel", "id": ...}`` stops one; ``{"type": "credit", "id":
+      ..., "credits": n}`` lets it send ``n`` more chunks; ``ping``/``pong``.
+    Server messages: ``ready``, ``chunk`` (a stream chunk tagged with its
+    ``id``), ``cancelled``, ``error``, ``ping``/``pong``.
+    """
+    
+    def __init__(self, websocket: WebSocket, user: User):
+        self.websocket = websocket
+        self.user = user
+        self.generations: Dict[str, _SocketGeneration] = {}
+        self.last_seen = time.monotonic()
+        self._send_lock = asyncio.Lock()
     
-    messages = db.query(Message).filter(
-        Message.conversation_id == conversation_id
-    ).order_by(Message.created_at.asc()).all()
+    async def send(self, message: Dict[str, Any]):
+        async with self._send_lock:
+            await self.websocket.send_text(dumps(message).decode())
+    
+    async def run(self):
+        await self.send({"type": "ready", "user_id": self.user.id})
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while True:
+                text = await _receive_text(self.websocket)
+                self.last_seen = time.monotonic()
+                if text is None:
+                    await self.send({"type": "error", "detail": "Invalid message: expected a text frame"})
+                    continue
+                try:
+                    message = loads(text)
+                    if not isinstance(message, dict):
+                        raise ValueError("Expected a JSON object")
+                    await self._handle(message)
+                except (ValueError, TypeError) as e:
+                    await self.send({"type": "error", "detail": f"Invalid message: {e}"})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            heartbeat.cancel()
+            # Closing the streams aborts their upstream generations
+            tasks = [generation.task for generation in self.generations.values()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(heartbeat, *tasks, return_exceptions=True)
+    
+    async def _handle(self, message: Dict[str, Any]):
+        kind = message.get("type")
+        request_id = message.get("id")
+        if kind == "ping":
+            await self.send({"type": "pong"})
+        elif kind == "pong":
+            pass
+        elif kind == "generate":
+            await self._start(request_id, message)
+        elif kind == "cancel":
+            generation = self.generations.get(request_id)
+            if generation is not None:
+                generation.cancelled = True
+                generation.task.cancel()
+        elif kind == "credit":
+            generation = self.generations.get(request_id)
+            if generation is not None:
+                generation.grant(max(int(message.get("credits", 0)), 0))
+        else:
+            await self.send({"type": "error", "id": request_id, "detail": f"Unknown message type: {kind}"})
+    
+    async def _start(self, request_id: Any, message: Dict[str, Any]):
+        if not isinstance(request_id, str) or not request_id:
+            await self.send({"type": "error", "detail": "A generate message needs a string id"})
+            return
+        if request_id in self.generations:
+            await self.send({"type": "error", "id": request_id, "detail": "Request id already in use"})
+            return
+        if len(self.generations) >= settings.CHAT_WS_MAX_CONCURRENT:
+            await self.send({"type": "error", "id": request_id, "detail": "Too many concurrent generations"})
+            return
+        
+        credits = message.get("credits")
+        if credits is None:
+            credits = settings.CHAT_WS_INITIAL_CREDITS
+        if isinstance(credits, bool) or not isinstance(credits, int) or credits < 1:
+            await self.send({"type": "error", "id": request_id, "detail": "credits must be a positive integer"})
+            return
+        
+        fields = {key: value for key, value in message.items() if key not in ("type", "id", "credits")}
+        try:
+            request = ChatRequest(**fields)
+        except ValidationError as e:
+            await self.send({"type": "error", "id": request_id, "detail": e.errors(include_url=False)})
+            return
+        try:
+            _require_features("chat_enabled", "streaming_enabled")
+        except HTTPException as e:
+            await self.send({"type": "error", "id": request_id, "detail": e.detail})
+            return
+        
+        limit = await rate_limiter.acquire(self.user.id, request.model)
+        if not limit.allowed:
+            await self.send({
+                "type": "error",
+                "id": request_id,
+                "detail": f"Rate limit exceeded ({limit.reason.replace('_', ' ')})",
+                "retry_after": round(limit.retry_after, 3)
+            })
+            return
+        
+        generation = _SocketGeneration(credits)
+        self.generations[request_id] = generation
+        generation.task = asyncio.create_task(self._generate(request_id, request, generation))
+    
+    async def _generate(self, request_id: str, request: ChatRequest, generation: _SocketGeneration):
+        tee = StreamTee()
+        try:
+            async with AsyncSessionLocal() as db:
+                conversation = await _get_or_create_conversation(request, self.user, db)
+                messages = await _build_prompt(request, db)
+            
+            llm_service = LLMService(model_name=request.model, ticket=Ticket(self.user.id, INTERACTIVE))
+            stream = tee.tee(llm_service.stream_generate(
+                messages=messages,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens,
+                cache=request.cache
+            ))
+            try:
+                async for chunk in stream:
+                    if chunk.get("done"):
+                        chunk = {**chunk, "conversation_id": conversation.id}
+                    # Out of credits: stop pulling from upstream until the client catches up
+                    await generation.spend()
+                    await self.send({"type": "chunk", "id": request_id, **chunk})
+            finally:
+                await stream.aclose()
+            
+            await _persist_stream(tee, request, conversation.id, self.user.id, endpoint="/api/chat/ws")
+        except asyncio.CancelledError:
+            if generation.cancelled:
+                await self._send_quietly({"type": "cancelled", "id": request_id})
+            raise
+        except HTTPException as e:
+            await self._send_quietly({"type": "error", "id": request_id, "detail": e.detail})
+        except Exception as e:
+            logger.error(f"Socket generation {request_id} failed: {e}")
+            await self._send_quietly({"type": "error", "id": request_id, "detail": "Generation failed"})
+        finally:
+            self.generations.pop(request_id, None)
+    
+    async def _send_quietly(self, message: Dict[str, Any]):
+        """Send unless the socket is already gone"""
+        try:
+            await self.send(message)
+        except Exception:
+            pass
+    
+    async def _heartbeat(self):
+        """Ping the client and drop the socket when it stops answering"""
+        interval = settings.CHAT_WS_PING_INTERVAL
+        while True:
+            await asyncio.sleep(interval)
+            if time.monotonic() - self.last_seen > 2 * interval:
+                logger.info(f"Closing idle chat socket for user {self.user.id}")
+                await self.websocket.close(code=status.WS_1001_GOING_AWAY)
+                return
+            await self._send_quietly({"type": "ping"})
+
+async def _receive_text(websocket: WebSocket) -> Optional[str]:
+    """The next text frame (None for a binary frame)"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE), message.get("reason"))
+    return message.get("text")
+
+async def _authenticate_socket(websocket: WebSocket) -> User:
+    """Authenticate from the upgrade headers, else from a first ``auth`` message"""
+    token = websocket.headers.get("x-api-key")
+    authorization = websocket.headers.get("authorization", "")
+    if not token and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token:
+        text = await asyncio.wait_for(_receive_text(websocket), settings.CHAT_WS_AUTH_TIMEOUT)
+        if text is None:
+            raise ValueError("Expected a text frame")
+        message = loads(text)
+        if not isinstance(message, dict) or message.get("type") != "auth" or not isinstance(message.get("token"), str):
+            raise ValueError("Expected an auth message")
+        token = message["token"]
+    
+    async with AsyncSessionLocal() as db:
+        return await authenticate_token(token, db)
+
+@router.websocket("/ws")
+async def chat_socket(websocket: WebSocket):
+    """Many concurrent chat generations over one authenticated socket"""
+    await websocket.accept()
+    try:
+        user = await _authenticate_socket(websocket)
+    except WebSocketDisconnect:
+        return
+    except (HTTPException, ValueError, asyncio.TimeoutError):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Authentication failed")
+        return
     
-    return messages
\ No newline at end of file
+    await ChatSocket(websocket, user).run()
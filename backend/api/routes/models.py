@@ -5,7 +5,7 @@ import logging
 
 from core.security import get_current_user
 from models.user import User
-from services.model_registry import ModelRegistry
+from services.model_registry import model_registry
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -16,17 +16,15 @@ class ModelInfo(BaseModel):
     description: str
     context_length: int
     cost_per_1k_tokens: float
-    latency_p50_ms: int
-    latency_p99_ms: int
+    latency_p50_ms: Optional[int]  # measured; None until the model has served traffic
+    latency_p99_ms: Optional[int]
     available: bool
     provider: str
 
 @router.get("/list", response_model=List[ModelInfo])
 async def list_models(current_user: User = Depends(get_current_user)):
     """List all available models"""
-    registry = ModelRegistry()
-    models = registry.get_all_models()
-    return models
+    return model_registry.get_all_models()
 
 @router.get("/{model_id}", response_model=ModelInfo)
 async def get_model_info(
@@ -34,8 +32,7 @@ async def get_model_info(
     current_user: User = Depends(get_current_user)
 ):
     """Get detailed model information"""
-    registry = ModelRegistry()
-    model = registry.get_model(model_id)
+    model = model_registry.get_model(model_id)
     
     if not model:
         raise HTTPException(status_code=404, detail="Model not found")
@@ -48,22 +45,20 @@ async def get_model_benchmarks(
     current_user: User = Depends(get_current_user)
 ):
     """Get model benchmark data"""
-    # Mock benchmark data - replace with real metrics
+    if not model_registry.get_model(model_id):
+        raise HTTPException(status_code=404, detail="Model not found")
+    
     return {
         "model_id": model_id,
+        # Mock quality scores - replace with published eval results
         "benchmarks": {
             "mmlu": 0.87,
             "hellaswag": 0.92,
             "truthfulqa": 0.78,
             "humaneval": 0.65
         },
-        "performance": {
-            "avg_latency_ms": 45,
-            "p50_latency_ms": 38,
-            "p95_latency_ms": 89,
-            "p99_latency_ms": 156,
-            "tokens_per_second": 120
-        }
+        # Measured on this worker over the recent latency window
+        "performance": model_registry.get_performance(model_id)
     }
 
 @router.post("/switch")
@@ -1,30 +1,64 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import date, datetime, timedelta, timezone
 
 from core.database import get_db
 from core.security import get_current_user
 from models.user import User
 from models.api_usage import APIUsage
+from services.usage import usage_by_model, usage_series, sum_totals
 
 router = APIRouter()
 
+def _as_utc(value: datetime) -> datetime:
+    """Times without an offset are taken as UTC"""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
 @router.get("/usage")
 async def get_usage_stats(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get user's API usage statistics"""
-    usage = db.query(APIUsage).filter(
-        APIUsage.user_id == current_user.id
-    ).all()
-    
-    total_tokens = sum(u.tokens_used for u in usage)
-    total_cost = sum(u.cost for u in usage)
-    
+    """Get user's API usage statistics (optionally for a UTC day range)"""
+    by_model = await usage_by_model(db, current_user.id, start, end)
+    totals = sum_totals(by_model)
+
+    result = await db.execute(
+        select(
+            APIUsage.id, APIUsage.endpoint, APIUsage.model_name, APIUsage.tokens_used,
+            APIUsage.latency_ms, APIUsage.status_code, APIUsage.cost, APIUsage.created_at
+        ).where(
+            APIUsage.user_id == current_user.id
+        ).order_by(APIUsage.created_at.desc(), APIUsage.id.desc()).limit(10)
+    )
+
     return {
-        "total_requests": len(usage),
-        "total_tokens": total_tokens,
-        "total_cost": total_cost,
-        "recent_usage": usage[:10]
-    }
\ No newline at end of file
+        "total_requests": totals["requests"],
+        "total_tokens": totals["tokens_used"],
+        "total_cost": totals["cost"],
+        "by_model": {
+            model: {"requests": t["requests"], "tokens_used": t["tokens_used"], "cost": t["cost"]}
+            for model, t in by_model.items()
+        },
+        "recent_usage": [dict(row._mapping) for row in result]
+    }
+
+@router.get("/usage/timeseries")
+async def get_usage_timeseries(
+    granularity: str = Query("day", pattern="^(hour|day)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get user's API usage per hour (default: last 24 hours) or per day (default: last 30 days), in UTC"""
+    end = _as_utc(end) if end else datetime.now(timezone.utc)
+    start = _as_utc(start) if start else end - (timedelta(hours=24) if granularity == "hour" else timedelta(days=30))
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    return await usage_series(db, current_user.id, granularity, start, end)
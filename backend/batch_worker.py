@@ -0,0 +1,39 @@
+"""Batch job worker: processes /api/batch uploads (run with ``python batch_worker.py``)"""
+import asyncio
+import logging
+import signal
+
+from core.database import async_engine, close_async_redis
+from services.batch import BatchWorker
+from services.batcher import generation_batcher
+from services.model_registry import model_registry
+from services.providers import providers
+from services.runtime_config import runtime_config
+from services.usage import usage_recorder
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+async def main():
+    # Tables are created and migrated by the API on startup
+    await runtime_config.start()
+    await providers.start(model_registry.all_replicas())
+    usage_recorder.start()
+    
+    worker = BatchWorker()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.stop)
+    try:
+        await worker.run()
+    finally:
+        await runtime_config.close()
+        await generation_batcher.close()
+        await providers.close()
+        await usage_recorder.close()
+        await close_async_redis()
+        await async_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+"""Simulated replica routing: prefix reuse and load skew per routing strategy.
+
+Replays a synthetic chat workload through ``model_registry.select_replica``
+in virtual time: Poisson arrivals of turns from conversations of skewed
+popularity (Zipf), each held on its replica for an exponential service
+time. Every replica keeps an LRU of the conversation prefixes it has
+seen, standing in for vLLM's prefix cache. Rows compare power-of-two
+choices and least-outstanding with consistent-hash affinity at a few
+bounded-load factors; no requests are sent.
+
+    python -m benchmarks.affinity_routing --replicas 8 --conversations 2000 --requests 50000
+"""
+from benchmarks.common import report
+from collections import OrderedDict
+import argparse
+import heapq
+import random
+
+from core.config import settings
+from services.model_registry import Replica, model_registry
+
+MODEL = "bench-affinity"
+
+class PrefixCache:
+    """LRU of prefix keys, like a replica's KV prefix cache"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._keys: "OrderedDict[str, None]" = OrderedDict()
+
+    def hit(self, key: str) -> bool:
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return True
+        self._keys[key] = None
+        if len(self._keys) > self.capacity:
+            self._keys.popitem(last=False)
+        return False
+
+def simulate(args, strategy: str, affinity: bool, load_factor: float) -> dict:
+    settings.LLM_ROUTING_STRATEGY = strategy
+    settings.LLM_AFFINITY_ROUTING = affinity
+    settings.LLM_AFFINITY_LOAD_FACTOR = load_factor
+    replicas = [Replica("vllm", f"http://replica-{index}.sim") for index in range(args.replicas)]
+    model_registry._replicas[MODEL] = replicas
+    model_registry.affinity_routed = model_registry.affinity_spilled = 0
+    caches = {id(replica): PrefixCache(args.cache_prefixes) for replica in replicas}
+    routed = {id(replica): 0 for replica in replicas}
+    peak = {id(replica): 0 for replica in replicas}
+
+    rng = random.Random(args.seed)
+    weights = [1 / (rank + 1) ** args.zipf for rank in range(args.conversations)]
+    conversations = rng.choices(range(args.conversations), weights, k=args.requests)
+    arrival_rate = args.utilization * args.replicas * args.slots / args.service_s
+    now, hits = 0.0, 0
+    finishing = []
+    for conversation in conversations:
+        now += rng.expovariate(arrival_rate)
+        while finishing and finishing[0][0] <= now:
+            _, _, replica = heapq.heappop(finishing)
+            replica.outstanding -= 1
+            replica.breaker.release()
+        key = f"conversation-{conversation}"
+        replica = model_registry.select_replica(MODEL, affinity=key)
+        hits += caches[id(replica)].hit(key)
+        routed[id(replica)] += 1
+        replica.outstanding += 1
+        peak[id(replica)] = max(peak[id(replica)], replica.outstanding)
+        heapq.heappush(finishing, (now + rng.expovariate(1 / args.service_s), id(replica), replica))
+
+    mean = args.requests / args.replicas
+    spilled = model_registry.affinity_spilled
+    return {
+        "routing": f"affinity x{load_factor:g}" if affinity else strategy,
+        "prefix hit %": hits / args.requests * 100,
+        "spilled %": spilled / args.requests * 100 if affinity else "-",
+        "max/mean requests": max(routed.values()) / mean,
+        "peak outstanding": max(peak.values())
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--replicas", type=int, default=8)
+    parser.add_argument("--conversations", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=50000)
+    parser.add_argument("--zipf", type=float, default=1.0, help="conversation popularity skew")
+    parser.add_argument("--cache-prefixes", type=int, default=200, help="prefixes each replica keeps cached")
+    parser.add_argument("--slots", type=int, default=8, help="requests a replica serves at full utilization")
+    parser.add_argument("--utilization", type=float, default=0.7)
+    parser.add_argument("--service-s", type=float, default=2.0, help="mean request duration")
+    parser.add_argument("--load-factors", default="1.25,2", help="affinity bounded-load factors, comma separated")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rows = [
+        simulate(args, "p2c", False, settings.LLM_AFFINITY_LOAD_FACTOR),
+        simulate(args, "least_outstanding", False, settings.LLM_AFFINITY_LOAD_FACTOR)
+    ]
+    rows += [simulate(args, "p2c", True, float(factor)) for factor in args.load_factors.split(",")]
+    report(
+        f"{args.requests} turns from {args.conversations} conversations (zipf {args.zipf:g}) on "
+        f"{args.replicas} replicas at {args.utilization:.0%} utilization, {args.cache_prefixes} cached prefixes each",
+        rows
+    )
+
+if __name__ == "__main__":
+    main()
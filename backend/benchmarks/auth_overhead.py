@@ -0,0 +1,72 @@
+"""Authentication overhead per request: JWT vs API key, cached vs cold, and bcrypt for scale.
+
+Times the authentication step on its own (``authenticate_token`` with a
+database session) and a whole ``GET /api/auth/me`` through the app, so
+the share of a request spent on auth is visible.
+
+    python -m benchmarks.auth_overhead --iterations 2000
+"""
+from benchmarks.common import Timer, app_client, register_user, report
+import argparse
+import asyncio
+
+from passlib.hash import bcrypt
+
+from core.database import AsyncSessionLocal
+from core.security import api_key_cache, authenticate_token, user_cache
+
+async def per_call(fn, iterations: int, reset=None) -> float:
+    """Mean microseconds per call"""
+    total = 0.0
+    for _ in range(iterations):
+        if reset is not None:
+            reset()
+        with Timer() as timer:
+            await fn()
+        total += timer.wall
+    return total / iterations * 1e6
+
+def _cold():
+    api_key_cache.clear()
+    user_cache.local.clear()
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12, help="cost of the login comparison row")
+    args = parser.parse_args()
+
+    async with app_client() as client:
+        headers = await register_user(client)
+        jwt = headers["Authorization"][7:]
+        api_key = (await client.get("/api/auth/me", headers=headers)).json()["api_key"]
+
+        rows = []
+        async with AsyncSessionLocal() as db:
+            for name, token, reset in (
+                ("JWT, user cached", jwt, None),
+                ("JWT, cold", jwt, _cold),
+                ("API key, cached", api_key, None),
+                ("API key, cold", api_key, _cold)
+            ):
+                auth_us = await per_call(lambda: authenticate_token(token, db), args.iterations, reset)
+                request_us = await per_call(
+                    lambda: client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"}),
+                    args.iterations, reset
+                )
+                rows.append({"credential": name, "auth us": auth_us, "GET /me us": request_us})
+
+        hashed = bcrypt.using(rounds=args.bcrypt_rounds).hash("bench-password")
+        iterations = max(args.iterations // 200, 3)
+        with Timer() as timer:
+            for _ in range(iterations):
+                bcrypt.verify("bench-password", hashed)
+        rows.append({
+            "credential": f"password (bcrypt cost {args.bcrypt_rounds})",
+            "auth us": timer.wall / iterations * 1e6,
+            "GET /me us": "-"
+        })
+    report(f"Mean time per request over {args.iterations} requests", rows)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""Completion throughput and latency with the micro-batcher off and at a few windows.
+
+Concurrent callers send non-streaming completions through ``LLMService``
+to a local stub backend over HTTP. With batching on, calls that arrive
+within the window go out together; the table shows what that costs in
+latency and what it saves in event-loop CPU per request. ``--slots`` caps
+how many requests the stub serves at once, like a GPU's batch size. The
+stub runs in the same process, so its CPU is part of the figure.
+
+    python -m benchmarks.batching --requests 2000 --concurrency 128 --windows 2,5,10
+"""
+from benchmarks.common import Timer, percentile, report, use_replicas
+import argparse
+import asyncio
+import time
+
+import services.llm_service as llm_service
+from benchmarks.stub_server import StubBackend, serve
+from core.config import settings
+from services.batcher import MicroBatcher
+from services.llm_service import LLMService
+
+MODEL = "bench-batching"
+
+async def run(requests: int, concurrency: int, window_ms: float) -> dict:
+    batcher = MicroBatcher(window_ms=window_ms, max_batch=settings.LLM_BATCH_MAX_SIZE)
+    llm_service.generation_batcher = batcher
+    settings.LLM_BATCHING_ENABLED = window_ms > 0
+    latencies = []
+    remaining = iter(range(requests))
+
+    async def worker(worker_id: int):
+        service = LLMService(model_name=MODEL)
+        for index in remaining:
+            started = time.perf_counter()
+            await service.generate(
+                [{"role": "user", "content": f"request {worker_id}-{index}"}], max_tokens=32, cache=False
+            )
+            latencies.append(time.perf_counter() - started)
+
+    with Timer() as timer:
+        await asyncio.gather(*[worker(worker_id) for worker_id in range(concurrency)])
+    stats = batcher.stats()
+    return {
+        "window ms": f"{window_ms:g}" if window_ms > 0 else "off",
+        "req/s": requests / timer.wall,
+        "p50 ms": percentile(latencies, 0.5) * 1000,
+        "p99 ms": percentile(latencies, 0.99) * 1000,
+        "avg batch": stats["avg_batch_size"] if window_ms > 0 else "-",
+        "cpu us/req": timer.cpu / requests * 1e6
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--windows", default="2,5,10", help="batch windows in ms, comma separated")
+    parser.add_argument("--latency-ms", type=float, default=20, help="stub time per completion")
+    parser.add_argument("--slots", type=int, default=None, help="requests the stub serves at once")
+    args = parser.parse_args()
+
+    windows = [0.0, *(float(window) for window in args.windows.split(","))]
+    async with serve(StubBackend(latency_ms=args.latency_ms, slots=args.slots)) as base_url:
+        use_replicas(MODEL, [base_url])
+        await run(args.concurrency, args.concurrency, 0)  # warm up the connection pool
+        rows = [await run(args.requests, args.concurrency, window) for window in windows]
+    report(
+        f"{args.requests} completions, {args.concurrency} concurrent callers, {args.latency_ms:g} ms stub, "
+        f"max batch {settings.LLM_BATCH_MAX_SIZE}",
+        rows
+    )
+
+if __name__ == "__main__":
+    asyncio.run(main())
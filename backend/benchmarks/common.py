@@ -0,0 +1,127 @@
+"""Shared setup for the benchmark scripts.
+
+Run a benchmark from ``backend/`` with ``python -m benchmarks.<name>``.
+Importing this module (before any app module) points the app at a
+throwaway SQLite database and an in-process fakeredis server, so the
+benchmarks need no services; set ``BENCH_DATABASE_URL`` or
+``BENCH_REDIS_URL`` to measure against real ones. Inference backends are
+always stubbed.
+"""
+import os
+import tempfile
+
+os.environ["DATABASE_URL"] = os.getenv(
+    "BENCH_DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='rajora-bench-')}/bench.db"
+)
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["DEBUG"] = "False"
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+if os.getenv("BENCH_REDIS_URL"):
+    os.environ["REDIS_URL"] = os.environ["BENCH_REDIS_URL"]
+
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Sequence
+import logging
+import math
+import time
+import uuid
+
+import httpx
+
+import core.database as database
+
+if not os.getenv("BENCH_REDIS_URL"):
+    import fakeredis
+
+    database.async_redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    database.redis_client = fakeredis.FakeRedis(decode_responses=True)
+
+from core.config import settings
+
+logging.basicConfig(level=logging.WARNING)
+settings.RATE_LIMIT_ENABLED = False
+
+def percentile(samples: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile (``q`` in 0..1)"""
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+def report(title: str, rows: List[Dict[str, object]]):
+    """Print rows of results as an aligned table"""
+    print(f"\n{title}")
+    if not rows:
+        return
+    columns = list(rows[0])
+    cells = [[_format(row[column]) for column in columns] for row in rows]
+    widths = [max(len(column), *(len(line[i]) for line in cells)) for i, column in enumerate(columns)]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for line in cells:
+        print("  ".join(cell.rjust(width) for cell, width in zip(line, widths)))
+
+def _format(value: object) -> str:
+    if isinstance(value, float):
+        return f"{value:.3f}" if abs(value) < 100 else f"{value:.0f}"
+    return str(value)
+
+class Timer:
+    """Wall and CPU time of a block"""
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.started
+        self.cpu = time.process_time() - self.cpu_started
+
+@asynccontextmanager
+async def started_app() -> AsyncIterator[object]:
+    """The API app with its startup done (tables created, background tasks running)"""
+    import main
+
+    async with main.lifespan(main.app):
+        yield main.app
+
+@asynccontextmanager
+async def app_client() -> AsyncIterator[httpx.AsyncClient]:
+    """The API app, started, behind an in-process HTTP client"""
+    async with started_app() as app:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            yield client
+
+async def register_user(client: httpx.AsyncClient) -> Dict[str, str]:
+    """Register and log in a fresh user; returns auth headers"""
+    name = f"bench-{uuid.uuid4().hex[:12]}"
+    response = await client.post(
+        "/api/auth/register", json={"email": f"{name}@example.com", "username": name, "password": "bench-password"}
+    )
+    response.raise_for_status()
+    response = await client.post("/api/auth/login", data={"username": name, "password": "bench-password"})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+def stub_backend(model: str, handler: Callable, replicas: int = 1, provider: str = "vllm"):
+    """Serve ``model`` from in-process replicas answering with ``handler`` (an ``httpx.MockTransport`` handler)"""
+    from services.model_registry import Replica, model_registry
+    from services.providers import providers
+
+    installed = []
+    for index in range(replicas):
+        url = f"http://{model}-{index}.bench"
+        providers.get(provider)._clients[url] = httpx.AsyncClient(
+            base_url=url, transport=httpx.MockTransport(handler)
+        )
+        installed.append(Replica(provider, url))
+    model_registry._replicas[model] = installed
+    return installed
+
+def use_replicas(model: str, base_urls: Sequence[str], provider: str = "vllm"):
+    """Serve ``model`` from the given endpoints (e.g. ``stub_server`` instances), over the provider's real clients"""
+    from services.model_registry import Replica, model_registry
+
+    model_registry._replicas[model] = [Replica(provider, url) for url in base_urls]
+    return model_registry._replicas[model]
@@ -0,0 +1,123 @@
+"""Throughput of request handlers on the sync vs the async database path.
+
+Each request does the database work of a chat turn (load the user, then
+the latest history of their conversation) and then waits on a stubbed
+LLM call. The sync handler runs its queries with ``SessionLocal`` inside
+``async def``, as the routes used to, which blocks the event loop for
+every query; the async handler uses ``AsyncSessionLocal``.
+
+A local SQLite file answers in microseconds, so ``--db-latency-ms`` adds
+the network round trip a database server would have to every query
+(blocking in the sync path, awaited in the async one). Point
+``BENCH_DATABASE_URL`` at Postgres to measure the real thing instead.
+
+    python -m benchmarks.db_sessions --requests 2000 --concurrency 64 --llm-ms 20 --db-latency-ms 1
+"""
+from benchmarks.common import Timer, percentile, report, started_app
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import select
+
+from core.database import AsyncSessionLocal, SessionLocal
+from models.conversation import Conversation, Message
+from models.user import User
+
+def _history_query(conversation_id: int):
+    return (
+        select(Message.role, Message.content)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(50)
+    )
+
+def build_app(user_id: int, conversation_id: int, llm_seconds: float, db_latency: float) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/sync")
+    async def sync_turn():
+        with SessionLocal() as db:
+            time.sleep(db_latency)
+            db.execute(select(User).where(User.id == user_id)).scalar_one()
+            time.sleep(db_latency)
+            history = db.execute(_history_query(conversation_id)).all()
+        await asyncio.sleep(llm_seconds)
+        return {"messages": len(history)}
+
+    @app.get("/async")
+    async def async_turn():
+        async with AsyncSessionLocal() as db:
+            await asyncio.sleep(db_latency)
+            (await db.execute(select(User).where(User.id == user_id))).scalar_one()
+            await asyncio.sleep(db_latency)
+            history = (await db.execute(_history_query(conversation_id))).all()
+        await asyncio.sleep(llm_seconds)
+        return {"messages": len(history)}
+
+    return app
+
+async def seed(messages: int):
+    async with AsyncSessionLocal() as db:
+        user = User(email="bench@example.com", username="bench", hashed_password="x")
+        db.add(user)
+        await db.flush()
+        conversation = Conversation(user_id=user.id, model_name="llama-3.1-8b", title="bench")
+        db.add(conversation)
+        await db.flush()
+        db.add_all([
+            Message(conversation_id=conversation.id, role="user", content=f"message {i} " * 20)
+            for i in range(messages)
+        ])
+        await db.commit()
+        return user.id, conversation.id
+
+async def run(client: httpx.AsyncClient, path: str, requests: int, concurrency: int):
+    latencies = []
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            started = time.perf_counter()
+            response = await client.get(path)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    with Timer() as timer:
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return {
+        "path": path,
+        "requests": requests,
+        "req/s": requests / timer.wall,
+        "p50 ms": percentile(latencies, 0.5) * 1000,
+        "p99 ms": percentile(latencies, 0.99) * 1000,
+        "cpu s": timer.cpu
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--llm-ms", type=float, default=20, help="stubbed LLM call duration")
+    parser.add_argument("--db-latency-ms", type=float, default=1, help="added round trip per query")
+    parser.add_argument("--messages", type=int, default=2000, help="messages in the seeded conversation")
+    args = parser.parse_args()
+
+    async with started_app():
+        user_id, conversation_id = await seed(args.messages)
+        app = build_app(user_id, conversation_id, args.llm_ms / 1000, args.db_latency_ms / 1000)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            await client.get("/sync")
+            await client.get("/async")
+            rows = [await run(client, path, args.requests, args.concurrency) for path in ("/sync", "/async")]
+    report(
+        f"{args.concurrency} concurrent clients, {args.llm_ms:g} ms stubbed LLM call, "
+        f"{args.db_latency_ms:g} ms per query",
+        rows
+    )
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""Stream latency during a login storm, with bcrypt on the worker pool vs inline.
+
+A few streams read tokens from a stub backend that emits one every
+``--token-ms`` while many clients log in at once at a real bcrypt cost.
+The gaps between stream chunks show how long the event loop was held:
+``inline`` runs bcrypt on the loop as the login route used to, ``pool``
+uses the bounded ``password_hasher``. Logins turned away with a 503 once
+the pool's queue is full are counted, not retried.
+
+    python -m benchmarks.login_storm --streams 8 --logins 200 --bcrypt-rounds 12
+"""
+from benchmarks.common import app_client, percentile, register_user, report, stub_backend
+import argparse
+import asyncio
+import time
+
+import httpx
+
+import core.security as security
+from core.security import password_hasher
+from core.serialization import dumps
+from services.llm_service import LLMService
+from services.scheduler import INTERACTIVE, Ticket
+
+MODEL = "bench-stream"
+
+def token_stream(tokens: int, interval: float):
+    async def handler(request: httpx.Request) -> httpx.Response:
+        async def body():
+            for index in range(tokens):
+                await asyncio.sleep(interval)
+                yield b"data: " + dumps({"choices": [{"delta": {"content": f"t{index} "}}]}) + b"\n\n"
+            yield b"data: [DONE]\n\n"
+        return httpx.Response(200, content=body(), headers={"content-type": "text/event-stream"})
+    return handler
+
+async def read_stream(user_id: int, gaps: list):
+    llm_service = LLMService(model_name=MODEL, ticket=Ticket(user_id, INTERACTIVE))
+    last = time.perf_counter()
+    async for _ in llm_service.stream_generate([{"role": "user", "content": "hi"}], max_tokens=64, cache=False):
+        now = time.perf_counter()
+        gaps.append(now - last)
+        last = now
+
+async def storm(client: httpx.AsyncClient, username: str, logins: int) -> int:
+    async def login():
+        response = await client.post("/api/auth/login", data={"username": username, "password": "bench-password"})
+        return response.status_code
+
+    statuses = await asyncio.gather(*[login() for _ in range(logins)])
+    return sum(status == 503 for status in statuses)
+
+async def _inline(fn, *args):
+    return fn(*args)
+
+async def run(client: httpx.AsyncClient, mode: str, username: str, args) -> dict:
+    gaps = []
+    rejected = 0
+    original = password_hasher._run
+    if mode == "inline":
+        password_hasher._run = _inline
+    try:
+        streams = [asyncio.create_task(read_stream(index, gaps)) for index in range(args.streams)]
+        if mode != "no storm":
+            rejected = await storm(client, username, args.logins)
+        await asyncio.gather(*streams)
+    finally:
+        password_hasher._run = original
+    return {
+        "mode": mode,
+        "logins": 0 if mode == "no storm" else args.logins,
+        "503s": rejected,
+        "gap p50 ms": percentile(gaps, 0.5) * 1000,
+        "gap p99 ms": percentile(gaps, 0.99) * 1000,
+        "gap max ms": max(gaps) * 1000
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=200, help="tokens per stream")
+    parser.add_argument("--token-ms", type=float, default=10, help="stub backend delay per token")
+    parser.add_argument("--logins", type=int, default=100, help="concurrent logins in the storm")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    args = parser.parse_args()
+
+    cost = args.bcrypt_rounds
+    security.pwd_context = security.pwd_context.copy(
+        bcrypt__rounds=cost, bcrypt__min_rounds=cost, bcrypt__max_rounds=cost
+    )
+    async with app_client() as client:
+        stub_backend(MODEL, token_stream(args.tokens, args.token_ms / 1000))
+        username = (await client.get("/api/auth/me", headers=await register_user(client))).json()["username"]
+        rows = [await run(client, mode, username, args) for mode in ("no storm", "inline", "pool")]
+    report(
+        f"{args.streams} streams of {args.tokens} tokens every {args.token_ms:g} ms, "
+        f"bcrypt cost {cost}, {password_hasher.workers} hash workers",
+        rows
+    )
+
+if __name__ == "__main__":
+    asyncio.run(main())
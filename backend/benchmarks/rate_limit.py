@@ -0,0 +1,89 @@
+"""Rate limiter throughput: allowed checks, and denials with and without the local cache.
+
+Concurrent callers run ``RateLimiter.acquire`` for many users. Allowed
+checks are one GCRA script call each (two scopes when the model has an
+override); a client hammering past its limit is turned away by the
+worker's own memory of its counts and denials, which the last row
+clears before every call to show what each rejection would cost in
+Redis. fakeredis runs the Lua scripts in process and is far slower than
+a server, so set ``BENCH_REDIS_URL`` for numbers that mean anything in
+absolute terms; keys get a per-run prefix and are deleted afterwards.
+
+    BENCH_REDIS_URL=redis://localhost:6379/15 python -m benchmarks.rate_limit --calls 20000
+"""
+from benchmarks.common import Timer, percentile, report
+import argparse
+import asyncio
+import time
+import uuid
+
+from core.config import settings
+from core.database import get_async_redis
+from services.rate_limiter import RateLimiter
+
+MODEL = "bench-model"
+
+async def run(name: str, limiter: RateLimiter, users: range, calls: int, concurrency: int, reset=None) -> dict:
+    latencies = []
+    outcomes = {True: 0, False: 0}
+    remaining = iter(range(calls))
+
+    async def worker():
+        for index in remaining:
+            if reset is not None:
+                reset()
+            started = time.perf_counter()
+            result = await limiter.acquire(users[index % len(users)], MODEL)
+            latencies.append(time.perf_counter() - started)
+            outcomes[result.allowed] += 1
+
+    with Timer() as timer:
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return {
+        "case": name,
+        "calls/s": calls / timer.wall,
+        "p50 us": percentile(latencies, 0.5) * 1e6,
+        "p99 us": percentile(latencies, 0.99) * 1e6,
+        "allowed": outcomes[True],
+        "denied": outcomes[False]
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    settings.RATE_LIMIT_ENABLED = True
+    generous = {"requests_per_minute": 10**6, "burst": 10**6, "tokens_per_day": 0}
+    allowed_users = range(args.users)
+    blocked_users = range(10**6, 10**6 + args.users)
+    for user in allowed_users:
+        settings.RATE_LIMIT_USER_OVERRIDES[str(user)] = generous
+    for user in blocked_users:
+        settings.RATE_LIMIT_USER_OVERRIDES[str(user)] = {"requests_per_minute": 1, "burst": 1, "tokens_per_day": 0}
+
+    limiter = RateLimiter()
+    limiter.prefix = f"bench-ratelimit-{uuid.uuid4().hex[:8]}"
+    rows = [await run("allowed, user scope", limiter, allowed_users, args.calls, args.concurrency)]
+    settings.RATE_LIMIT_MODEL_OVERRIDES[MODEL] = generous
+    rows.append(await run("allowed, user + model scope", limiter, allowed_users, args.calls, args.concurrency))
+    del settings.RATE_LIMIT_MODEL_OVERRIDES[MODEL]
+
+    # Use up every blocked user's single request first
+    await run("warm up", limiter, blocked_users, args.users, args.concurrency)
+    rows.append(await run("denied, local cache", limiter, blocked_users, args.calls, args.concurrency))
+
+    def forget():
+        limiter._denied.clear()
+        limiter._local_tats.clear()
+
+    rows.append(await run("denied, Redis every time", limiter, blocked_users, args.calls, args.concurrency, forget))
+    redis = get_async_redis()
+    async for key in redis.scan_iter(match=f"{limiter.prefix}:*", count=1000):
+        await redis.delete(key)
+    report(f"{args.calls} checks from {args.concurrency} concurrent callers across {args.users} users", rows)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""CPU per streamed token through ``POST /api/chat/stream``.
+
+Concurrent chat streams read paced tokens from a stubbed backend and the
+app's whole stream path runs for each one: provider decoding, fallback
+and scheduling, the tee, SSE framing and the response. Rows compare
+forwarding every delta with coalescing them (``LLM_STREAM_COALESCE_MS``),
+on orjson and on the stdlib json fallback. The in-process transport does
+no socket writes, so the rows show coalescing's own per-delta cost but
+not what fewer, larger frames save on a real connection.
+
+    python -m benchmarks.stream_cpu --streams 32 --tokens 500 --token-ms 2
+"""
+from benchmarks.common import Timer, app_client, register_user, report, stub_backend
+import argparse
+import asyncio
+
+import httpx
+
+import core.serialization as serialization
+from core.config import settings
+from core.serialization import dumps
+
+MODEL = "bench-stream-cpu"
+
+def paced_stream(tokens: int, interval: float):
+    events = [
+        b"data: " + dumps({"choices": [{"delta": {"content": f"tok{index} "}}]}) + b"\n\n" for index in range(tokens)
+    ]
+    events.append(b"data: " + dumps({"choices": [], "usage": {"total_tokens": tokens}}) + b"\n\n")
+    events.append(b"data: [DONE]\n\n")
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        async def body():
+            for event in events:
+                await asyncio.sleep(interval)
+                yield event
+        return httpx.Response(200, content=body(), headers={"content-type": "text/event-stream"})
+    return handler
+
+async def run(client: httpx.AsyncClient, headers, args, coalesce_ms: float, json_name: str) -> dict:
+    settings.LLM_STREAM_COALESCE_MS = coalesce_ms
+    request = {"messages": [{"role": "user", "content": "hi"}], "model": MODEL, "cache": False}
+
+    async def stream() -> int:
+        response = await client.post("/api/chat/stream", headers=headers, json=request)
+        response.raise_for_status()
+        return response.content.count(b"\n\n")
+
+    with Timer() as timer:
+        frames = await asyncio.gather(*[stream() for _ in range(args.streams)])
+    tokens = args.streams * args.tokens
+    return {
+        "coalesce ms": f"{coalesce_ms:g}" if coalesce_ms else "off",
+        "json": json_name,
+        "frames/stream": sum(frames) / len(frames),
+        "cpu us/token": timer.cpu / tokens * 1e6,
+        "wall s": timer.wall
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=32)
+    parser.add_argument("--tokens", type=int, default=500, help="tokens per stream")
+    parser.add_argument("--token-ms", type=float, default=2, help="stub backend delay per token")
+    parser.add_argument("--coalesce-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    fast = serialization.orjson
+    libraries = {"orjson": fast, "json": None} if fast else {"json": None}
+    async with app_client() as client:
+        stub_backend(MODEL, paced_stream(args.tokens, args.token_ms / 1000))
+        headers = await register_user(client)
+        rows = []
+        for json_name, library in libraries.items():
+            serialization.orjson = library
+            for coalesce_ms in (0, args.coalesce_ms):
+                rows.append(await run(client, headers, args, coalesce_ms, json_name))
+        serialization.orjson = fast
+    report(
+        f"{args.streams} concurrent streams of {args.tokens} tokens every {args.token_ms:g} ms "
+        f"(the stub's CPU is included)",
+        rows
+    )
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+"""Parse overhead per token of the provider stream decoders.
+
+Feeds a recorded token stream through each provider's ``decode_stream``
+with no network in the way, read one event per chunk (a backend flushing
+every token) and in 16 KiB reads (a busy connection), with orjson and
+with the stdlib json fallback. The last rows stream the same tokens from
+the local stub server over HTTP, for the decoder's share of a real read.
+
+    python -m benchmarks.stream_decoding --tokens 50000
+"""
+from benchmarks.common import Timer, report
+import argparse
+import asyncio
+
+import core.serialization as serialization
+from benchmarks.stub_server import StubBackend, serve
+from core.serialization import dumps
+from services.model_registry import Replica
+from services.providers import providers
+
+READ_SIZE = 16 * 1024
+
+def sse_events(tokens: int):
+    events = [b"data: " + dumps({"choices": [{"delta": {"content": f"tok{index} "}}]}) + b"\n\n" for index in range(tokens)]
+    events.append(b"data: " + dumps({"choices": [], "usage": {"total_tokens": tokens}}) + b"\n\n")
+    events.append(b"data: [DONE]\n\n")
+    return events
+
+def ndjson_events(tokens: int):
+    events = [
+        dumps({"message": {"role": "assistant", "content": f"tok{index} "}, "done": False}) + b"\n"
+        for index in range(tokens)
+    ]
+    events.append(dumps({"done": True, "prompt_eval_count": 0, "eval_count": tokens}) + b"\n")
+    return events
+
+def reads(events, chunking: str):
+    if chunking == "per event":
+        return events
+    body = b"".join(events)
+    return [body[start:start + READ_SIZE] for start in range(0, len(body), READ_SIZE)]
+
+async def replay(chunks):
+    for chunk in chunks:
+        yield chunk
+
+async def decode(name: str, chunks) -> int:
+    count = 0
+    async for chunk in providers.get(name).decode_stream(replay(chunks)):
+        count += bool(chunk["content"])
+    return count
+
+async def over_http(name: str, model: str, tokens: int) -> dict:
+    provider = providers.get(name)
+    async with serve(StubBackend(latency_ms=0, tokens=tokens)) as base_url:
+        replica = Replica(name, base_url)
+        messages = [{"role": "user", "content": "hi"}]
+        with Timer() as timer:
+            count = 0
+            async for chunk in provider.stream(model, replica, messages, 0.7, tokens):
+                count += bool(chunk["content"])
+        await provider._clients.pop(base_url).aclose()
+    # The stub shares the process, so CPU is not reported for these rows
+    return {
+        "decoder": name, "reads": "HTTP (stub)", "json": "orjson" if serialization.orjson else "json",
+        "us/token": timer.wall / count * 1e6, "cpu us/token": "-"
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=20000)
+    args = parser.parse_args()
+
+    bodies = {"vllm": sse_events(args.tokens), "ollama": ndjson_events(args.tokens)}
+    fast = serialization.orjson
+    libraries = {"orjson": fast, "json": None} if fast else {"json": None}
+    rows = []
+    for json_name, library in libraries.items():
+        serialization.orjson = library
+        for name, events in bodies.items():
+            for chunking in ("per event", "16 KiB"):
+                chunks = reads(events, chunking)
+                with Timer() as timer:
+                    count = await decode(name, chunks)
+                rows.append({
+                    "decoder": name, "reads": chunking, "json": json_name,
+                    "us/token": timer.wall / count * 1e6, "cpu us/token": timer.cpu / count * 1e6
+                })
+    serialization.orjson = fast
+    rows.append(await over_http("vllm", "bench", args.tokens))
+    rows.append(await over_http("ollama", "ollama/bench", args.tokens))
+    report(f"{args.tokens} tokens per stream", rows)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+"""A local stand-in for an inference backend, served over real HTTP.
+
+Answers the OpenAI-compatible chat API (``/v1/chat/completions``, JSON or
+SSE) that vLLM and OpenAI speak, and Ollama's ``/api/chat`` (JSON or
+NDJSON), with a fixed time to first token and delay per token, so the
+client side of the app can be measured over real sockets. Benchmarks
+start it in-process with ``serve()``; run it on its own to point a dev
+server at it:
+
+    python -m benchmarks.stub_server --port 8001 --latency-ms 50 --token-ms 5
+    VLLM_ENDPOINT=http://127.0.0.1:8001 uvicorn main:app
+"""
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+import argparse
+import asyncio
+import socket
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+
+from core.serialization import dumps, loads
+
+class StubBackend:
+    """Behaviour of the stub: answer timing, length and how many requests it serves at once"""
+
+    def __init__(self, latency_ms: float = 20, token_ms: float = 0, tokens: int = 32, slots: Optional[int] = None):
+        self.latency = latency_ms / 1000
+        self.token_interval = token_ms / 1000
+        self.tokens = tokens
+        self._slots = asyncio.Semaphore(slots) if slots else None
+        self.requests = 0
+
+    def token(self, index: int) -> str:
+        return f"tok{index} "
+
+    async def _wait_for_slot(self):
+        if self._slots is not None:
+            await self._slots.acquire()
+
+    def _free_slot(self):
+        if self._slots is not None:
+            self._slots.release()
+
+    async def complete(self) -> str:
+        """Wait as long as a whole generation takes and return its text"""
+        await self._wait_for_slot()
+        try:
+            await asyncio.sleep(self.latency + self.token_interval * self.tokens)
+        finally:
+            self._free_slot()
+        return "".join(self.token(index) for index in range(self.tokens))
+
+    async def stream(self) -> AsyncIterator[str]:
+        """Yield the tokens as they are generated"""
+        await self._wait_for_slot()
+        try:
+            await asyncio.sleep(self.latency)
+            for index in range(self.tokens):
+                if self.token_interval:
+                    await asyncio.sleep(self.token_interval)
+                yield self.token(index)
+        finally:
+            self._free_slot()
+
+def build_app(backend: StubBackend) -> FastAPI:
+    app = FastAPI()
+    usage = {"prompt_tokens": 10, "completion_tokens": backend.tokens, "total_tokens": 10 + backend.tokens}
+
+    @app.post("/v1/chat/completions")
+    async def openai_chat(request: Request):
+        body = loads(await request.body())
+        backend.requests += 1
+        if not body.get("stream"):
+            content = await backend.complete()
+            return Response(dumps({
+                "choices": [{"message": {"role": "assistant", "content": content}}], "usage": usage
+            }), media_type="application/json")
+
+        async def events():
+            async for token in backend.stream():
+                yield b"data: " + dumps({"choices": [{"delta": {"content": token}}]}) + b"\n\n"
+            yield b"data: " + dumps({"choices": [], "usage": usage}) + b"\n\n"
+            yield b"data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/api/chat")
+    async def ollama_chat(request: Request):
+        body = loads(await request.body())
+        backend.requests += 1
+        final = {"done": True, "prompt_eval_count": 10, "eval_count": backend.tokens}
+        if not body.get("stream", True):
+            content = await backend.complete()
+            return Response(dumps({"message": {"role": "assistant", "content": content}, **final}),
+                            media_type="application/json")
+
+        async def lines():
+            async for token in backend.stream():
+                yield dumps({"message": {"role": "assistant", "content": token}, "done": False}) + b"\n"
+            yield dumps({"message": {"role": "assistant", "content": ""}, **final}) + b"\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    return app
+
+@asynccontextmanager
+async def serve(backend: StubBackend) -> AsyncIterator[str]:
+    """Run the stub on a free local port for the duration; yields its base URL"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(build_app(backend), log_level="warning", access_log=False))
+    task = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{sock.getsockname()[1]}"
+    finally:
+        server.should_exit = True
+        await task
+        sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=20, help="time to first token")
+    parser.add_argument("--token-ms", type=float, default=0, help="delay per token")
+    parser.add_argument("--tokens", type=int, default=32, help="tokens per answer")
+    parser.add_argument("--slots", type=int, default=None, help="requests served at once (default unbounded)")
+    args = parser.parse_args()
+
+    backend = StubBackend(args.latency_ms, args.token_ms, args.tokens, args.slots)
+    uvicorn.run(build_app(backend), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
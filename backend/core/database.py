@@ -1,7 +1,8 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
-from typing import Generator
+from sqlalchemy.orm import sessionmaker
+from typing import AsyncGenerator
 import logging
 
 from core.config import settings
@@ -17,22 +18,50 @@ engine = create_engine(
     echo=settings.DEBUG
 )
 
-# Session factory
+# Session factory (sync, for scripts and offline jobs)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def _async_database_url(url: str) -> str:
+    """Map a sync DATABASE_URL onto its async driver"""
+    if url.startswith(("postgresql://", "postgresql+psycopg2://")):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+ASYNC_DATABASE_URL = settings.ASYNC_DATABASE_URL or _async_database_url(settings.DATABASE_URL)
+
+# aiosqlite (local tests) does not use a sized connection pool
+_async_pool_options = {} if ASYNC_DATABASE_URL.startswith("sqlite") else {
+    "pool_size": 10,
+    "max_overflow": 20
+}
+
+# Async engine and session factory used by request handlers
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_pre_ping=True,
+    echo=settings.DEBUG,
+    **_async_pool_options
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # Base class for models
 Base = declarative_base()
 
-def get_db() -> Generator[Session, None, None]:
-    """Dependency for database sessions"""
-    db = SessionLocal()
-    try:
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    """Dependency for async database sessions"""
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 # Redis connection
 import redis
+import redis.asyncio as aioredis
 from redis import Redis
 
 redis_client: Redis = redis.from_url(
@@ -43,4 +72,25 @@ redis_client: Redis = redis.from_url(
 
 def get_redis() -> Redis:
     """Get Redis client"""
-    return redis_client
\ No newline at end of file
+    return redis_client
+
+# Async Redis connection pool for request handlers (uses hiredis parser when installed)
+async_redis_pool = aioredis.ConnectionPool.from_url(
+    settings.REDIS_URL,
+    encoding="utf-8",
+    decode_responses=True,
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT
+)
+
+async_redis_client: aioredis.Redis = aioredis.Redis(connection_pool=async_redis_pool)
+
+def get_async_redis() -> aioredis.Redis:
+    """Get async Redis client (use this on the request path)"""
+    return async_redis_client
+
+async def close_async_redis():
+    """Close async Redis connections on shutdown"""
+    await async_redis_client.aclose()
+    await async_redis_pool.disconnect()
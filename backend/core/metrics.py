@@ -0,0 +1,98 @@
+from typing import Dict, Optional
+import math
+import time
+
+class QuantileSketch:
+    """Streaming quantile sketch with bounded relative error.
+
+    Values are counted in logarithmic buckets (DDSketch style), so any
+    quantile is accurate to within ``relative_accuracy`` using a few hundred
+    integers regardless of how many samples were added.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float):
+        """Record a sample"""
+        self.count += 1
+        self.total += value
+        if value <= 0:
+            self.zero_count += 1
+            return
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            # Collapse the two lowest buckets; only the smallest values lose accuracy
+            low, second = sorted(self.buckets)[:2]
+            self.buckets[second] += self.buckets.pop(low)
+
+    def merge(self, other: "QuantileSketch"):
+        """Fold another sketch (with the same accuracy) into this one"""
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimated value at quantile ``q`` (0..1), None when empty"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+class WindowedSketch:
+    """Quantiles over roughly the last one to two ``window`` seconds.
+
+    Two sketches are kept and rotated every window so old samples age out
+    and the measurements follow current load.
+    """
+
+    def __init__(self, window: float = 300.0, relative_accuracy: float = 0.01):
+        self.window = window
+        self.relative_accuracy = relative_accuracy
+        self._current = QuantileSketch(relative_accuracy)
+        self._previous = QuantileSketch(relative_accuracy)
+        self._rotated_at = time.monotonic()
+
+    def _rotate(self):
+        now = time.monotonic()
+        if now - self._rotated_at >= self.window:
+            # After a long idle period both windows are stale
+            stale = now - self._rotated_at >= 2 * self.window
+            self._previous = QuantileSketch(self.relative_accuracy) if stale else self._current
+            self._current = QuantileSketch(self.relative_accuracy)
+            self._rotated_at = now
+
+    def add(self, value: float):
+        self._rotate()
+        self._current.add(value)
+
+    def snapshot(self) -> QuantileSketch:
+        """Merged sketch of both windows"""
+        self._rotate()
+        merged = QuantileSketch(self.relative_accuracy)
+        merged.merge(self._previous)
+        merged.merge(self._current)
+        return merged
+
+    def quantile(self, q: float) -> Optional[float]:
+        return self.snapshot().quantile(q)
@@ -0,0 +1,113 @@
+from sqlalchemy import insert, inspect, select, update
+from sqlalchemy.engine import Connection
+import logging
+
+from core.database import Base
+
+logger = logging.getLogger(__name__)
+
+# Postgres advisory lock key held while a worker sets up the schema
+MIGRATION_LOCK_ID = 7_245_104
+
+def _add_missing_columns(conn: Connection):
+    """Add model columns that are missing from existing tables (additive only)"""
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+            logger.info(f"Added column {table.name}.{column.name}")
+
+def _create_missing_indexes(conn: Connection):
+    """Create model indexes that are missing from existing tables"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+def _backfill_api_key_hashes(conn: Connection):
+    """Store the keyed hash of API keys created before hashes existed"""
+    from core.security import hash_api_key
+    from models.user import User
+
+    users = User.__table__
+    rows = conn.execute(
+        select(users.c.id, users.c.api_key).where(
+            users.c.api_key_hash.is_(None),
+            users.c.api_key.is_not(None)
+        )
+    ).all()
+    for user_id, api_key in rows:
+        conn.execute(
+            update(users).where(users.c.id == user_id).values(api_key_hash=hash_api_key(api_key))
+        )
+    if rows:
+        logger.info(f"Backfilled API key hashes for {len(rows)} users")
+
+def _backfill_conversation_updated_at(conn: Connection):
+    """Give conversations that were never updated an ``updated_at`` so they can be paged"""
+    from models.conversation import Conversation
+
+    conversations = Conversation.__table__
+    result = conn.execute(
+        update(conversations)
+        .where(conversations.c.updated_at.is_(None))
+        .values(updated_at=conversations.c.created_at)
+    )
+    if result.rowcount:
+        logger.info(f"Backfilled updated_at for {result.rowcount} conversations")
+
+def _backfill_usage_rollups(conn: Connection):
+    """Build the usage rollups from usage rows written before rollups existed"""
+    from models.api_usage import APIUsage, UsageDaily, UsageHourly
+    from services.usage import rollup_rows
+
+    if conn.execute(select(UsageDaily.id).limit(1)).first() is not None:
+        return
+    usage = APIUsage.__table__
+    rows = conn.execute(
+        select(
+            usage.c.user_id, usage.c.model_name, usage.c.tokens_used, usage.c.latency_ms,
+            usage.c.status_code, usage.c.cost, usage.c.created_at
+        ).where(usage.c.created_at.is_not(None)).execution_options(yield_per=10000)
+    ).mappings()
+    hourly, daily = rollup_rows(rows)
+    if daily:
+        conn.execute(insert(UsageHourly.__table__), hourly)
+        conn.execute(insert(UsageDaily.__table__), daily)
+        logger.info(f"Backfilled usage rollups: {len(daily)} daily and {len(hourly)} hourly buckets")
+
+def _seed_runtime_config(conn: Connection):
+    """Create the runtime config row (version 0 means the built-in defaults)"""
+    from models.runtime_config import RuntimeConfig
+
+    config = RuntimeConfig.__table__
+    if conn.execute(select(config.c.id).where(config.c.id == 1)).first() is None:
+        conn.execute(insert(config).values(id=1, version=0))
+
+def initialize_database(conn: Connection):
+    """Create missing tables and run the migrations, one worker at a time.
+
+    Every worker runs this on startup. On Postgres the first one takes a
+    transaction-level advisory lock; the others wait for it to commit and
+    then find nothing left to do, instead of racing on the same DDL and
+    backfills.
+    """
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock({MIGRATION_LOCK_ID})")
+    Base.metadata.create_all(conn)
+    run_migrations(conn)
+
+def run_migrations(conn: Connection):
+    """Bring an existing database up to the current models (run after create_all)"""
+    _add_missing_columns(conn)
+    _create_missing_indexes(conn)
+    _backfill_api_key_hashes(conn)
+    _backfill_conversation_updated_at(conn)
+    _backfill_usage_rollups(conn)
+    _seed_runtime_config(conn)
@@ -1,17 +1,115 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Dict, Any, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from fastapi.security import OAuth2PasswordBearer, APIKeyHeader
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from redis.exceptions import RedisError
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import secrets
 
+from core.cache import TTLCache
 from core.config import settings
-from core.database import get_db
+from core.database import get_db, get_async_redis
 from models.user import User
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
+logger = logging.getLogger(__name__)
+
+# Hashes with any other cost are flagged for rehash on the next login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS
+)
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login", auto_error=False)
+api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
+
+API_KEY_PREFIX = "raj_"
+
+# Columns kept in the cached user principal (the API key only as its hash, never in plaintext)
+USER_PRINCIPAL_FIELDS = ("id", "email", "username", "full_name", "is_active", "is_admin", "api_key_hash")
+
+class UserPrincipalCache:
+    """Two-tier cache of authenticated users keyed by user id.
+
+    The first tier is a per-worker TTL/LRU cache, the optional second tier is
+    Redis so a user loaded by one worker is shared with the others. Entries
+    hold plain column values; callers get a detached ``User`` built from them.
+    """
+
+    def __init__(self):
+        self.local = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+        self.redis_hits = 0
+        self.db_loads = 0
+
+    def _redis_key(self, user_id: int) -> str:
+        # Versioned with the cached fields, so workers on another release never read these entries
+        return f"user_principal:v2:{user_id}"
+
+    async def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Look up a principal in the local tier, then Redis"""
+        principal = self.local.get(user_id)
+        if principal is not None or not settings.USER_CACHE_REDIS_ENABLED:
+            return principal
+        try:
+            cached = await get_async_redis().get(self._redis_key(user_id))
+        except RedisError as e:
+            logger.warning(f"User cache read failed: {e}")
+            return None
+        if cached:
+            principal = json.loads(cached)
+            self.local.set(user_id, principal)
+            self.redis_hits += 1
+        return principal
+
+    async def set(self, user: User) -> Dict[str, Any]:
+        """Cache the principal for a freshly loaded user"""
+        principal = {field: getattr(user, field) for field in USER_PRINCIPAL_FIELDS}
+        self.db_loads += 1
+        self.local.set(user.id, principal)
+        if settings.USER_CACHE_REDIS_ENABLED:
+            try:
+                await get_async_redis().setex(
+                    self._redis_key(user.id), settings.USER_CACHE_REDIS_TTL, json.dumps(principal)
+                )
+            except RedisError as e:
+                logger.warning(f"User cache write failed: {e}")
+        return principal
+
+    async def invalidate(self, user_id: int):
+        """Drop a user from both tiers after it changed"""
+        self.local.delete(user_id)
+        if settings.USER_CACHE_REDIS_ENABLED:
+            try:
+                await get_async_redis().delete(self._redis_key(user_id))
+            except RedisError as e:
+                logger.warning(f"User cache invalidation failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rate and database queries saved"""
+        stats = self.local.stats()
+        lookups = stats["hits"] + self.redis_hits + self.db_loads
+        stats.update({
+            "redis_hits": self.redis_hits,
+            "db_loads": self.db_loads,
+            "db_queries_saved": stats["hits"] + self.redis_hits,
+            "hit_rate": round((stats["hits"] + self.redis_hits) / lookups, 4) if lookups else 0.0
+        })
+        return stats
+
+user_cache = UserPrincipalCache()
+
+# Recently seen API key hashes -> user id
+api_key_cache = TTLCache(maxsize=settings.API_KEY_CACHE_SIZE, ttl=settings.API_KEY_CACHE_TTL)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify password hash"""
@@ -21,6 +119,61 @@ def get_password_hash(password: str) -> str:
     """Hash password"""
     return pwd_context.hash(password)
 
+class PasswordHasher:
+    """Runs bcrypt on a bounded worker pool instead of the event loop.
+
+    At most ``workers`` hashes run at once and ``max_queue`` more may wait;
+    beyond that callers get a 503 so a login storm cannot pile up unbounded
+    work or stall streaming on the worker.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication is busy, please retry",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        """Hash a password with the configured bcrypt cost"""
+        return await self._run(pwd_context.hash, password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password; also returns a new hash when the stored cost is outdated"""
+        return await self._run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+    def shutdown(self):
+        """Stop the worker threads"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, int]:
+        """Pool occupancy and rejections"""
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_QUEUE)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create JWT access token"""
     to_encode = data.copy()
@@ -32,25 +185,103 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
-    """Get current authenticated user"""
-    credentials_exception = HTTPException(
+def hash_api_key(api_key: str) -> str:
+    """Keyed hash of an API key, stored in the indexed ``api_key_hash`` column"""
+    return hmac.new(
+        settings.API_KEY_HASH_SECRET.encode(), api_key.encode(), hashlib.sha256
+    ).hexdigest()
+
+def generate_api_key() -> str:
+    """Create a new API key"""
+    return f"{API_KEY_PREFIX}{secrets.token_urlsafe(32)}"
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+async def _load_principal(user_id: int, db: AsyncSession) -> Optional[Dict[str, Any]]:
+    """Resolve a user id to an active principal, via the user cache"""
+    principal = await user_cache.get(user_id)
+    if principal is None:
+        user = await db.get(User, user_id)
+        if user is None:
+            return None
+        principal = await user_cache.set(user)
+    
+    if not principal["is_active"]:
+        return None
+    return principal
+
+async def authenticate_api_key(api_key: str, db: AsyncSession) -> User:
+    """Authenticate an API key without bcrypt or JWT decoding.
+
+    The key is looked up by its HMAC through a unique index, so lookup time
+    does not depend on how much of a guessed key matches. Recently seen keys
+    map straight to a user id in memory.
+    """
+    key_hash = hash_api_key(api_key)
+    user_id = api_key_cache.get(key_hash)
+    if user_id is None:
+        result = await db.execute(select(User.id).where(User.api_key_hash == key_hash))
+        user_id = result.scalar()
+        if user_id is None:
+            raise _credentials_exception()
+        api_key_cache.set(key_hash, user_id)
+    
+    principal = await _load_principal(user_id, db)
+    # Guard against a key rotated on another worker while still cached here
+    if principal is None or not hmac.compare_digest(principal["api_key_hash"] or "", key_hash):
+        api_key_cache.delete(key_hash)
+        raise _credentials_exception()
+    return User(**principal)
+
+async def get_api_key_user(
+    api_key: Optional[str] = Depends(api_key_header),
+    token: Optional[str] = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_db)
+) -> User:
+    """Get user authenticated by ``X-API-Key`` or ``Authorization: Bearer raj_...``"""
+    if not api_key and token and token.startswith(API_KEY_PREFIX):
+        api_key = token
+    if not api_key:
+        raise _credentials_exception()
+    return await authenticate_api_key(api_key, db)
+
+async def get_current_user(
+    token: Optional[str] = Depends(oauth2_scheme),
+    api_key: Optional[str] = Depends(api_key_header),
+    db: AsyncSession = Depends(get_db)
+) -> User:
+    """Get current authenticated user (JWT or API key)"""
+    if api_key:
+        return await authenticate_api_key(api_key, db)
+    if not token:
+        raise _credentials_exception()
+    return await authenticate_token(token, db)
+
+async def authenticate_token(token: str, db: AsyncSession) -> User:
+    """Authenticate a bearer token: an API key (``raj_...``) or a JWT"""
+    if token.startswith(API_KEY_PREFIX):
+        return await authenticate_api_key(token, db)
+    
+    credentials_exception = _credentials_exception()
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
-    except JWTError:
+        user_id = int(user_id)
+    except (JWTError, ValueError):
         raise credentials_exception
     
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
+    principal = await _load_principal(user_id, db)
+    if principal is None:
         raise credentials_exception
-    return user
+    # Detached instance; load the row into the session before modifying it
+    return User(**principal)
 
 async def get_current_admin_user(current_user: User = Depends(get_current_user)) -> User:
     """Get current admin user"""
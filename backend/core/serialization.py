@@ -0,0 +1,26 @@
+from datetime import date
+from typing import Any
+import json
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+def _default(obj: Any) -> Any:
+    # Same ISO 8601 output orjson gives dates and datetimes
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dumps(obj: Any) -> bytes:
+    """Compact JSON as UTF-8 bytes (orjson when installed)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=_default).encode()
+
+def loads(data: Any) -> Any:
+    """Parse JSON from bytes or str (orjson when installed)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -5,10 +5,18 @@ import uvicorn
 import logging
 from contextlib import asynccontextmanager
 
-from api.routes import chat, models, admin, auth, users
+from api.middleware import MaintenanceMiddleware
+from api.routes import chat, models, admin, auth, users, batch
 from core.config import settings
-from core.database import engine, Base
-from core.security import get_current_user
+from core.database import async_engine, close_async_redis
+from core.migrations import initialize_database
+from core.security import get_current_user, password_hasher
+from services.model_registry import model_registry
+from services.providers import providers
+from services.batcher import generation_batcher
+from services.runtime_config import runtime_config
+from services.single_flight import single_flight
+from services.usage import usage_recorder
 
 # Configure logging
 logging.basicConfig(
@@ -22,11 +30,23 @@ async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
     # Startup
     logger.info("Starting Rajora AI Platform...")
-    Base.metadata.create_all(bind=engine)
+    async with async_engine.begin() as conn:
+        await conn.run_sync(initialize_database)
     logger.info("Database initialized")
+    await runtime_config.start()
+    await providers.start(model_registry.all_replicas())
+    usage_recorder.start()
     yield
     # Shutdown
     logger.info("Shutting down Rajora AI Platform...")
+    await runtime_config.close()
+    await single_flight.close()
+    await generation_batcher.close()
+    await providers.close()
+    await usage_recorder.close()
+    await close_async_redis()
+    await async_engine.dispose()
+    password_hasher.shutdown()
 
 app = FastAPI(
     title="Rajora AI Platform API",
@@ -37,7 +57,8 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# CORS middleware
+# Maintenance mode sits inside CORS so its 503s carry the CORS headers
+app.add_middleware(MaintenanceMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.ALLOWED_ORIGINS,
@@ -61,6 +82,7 @@ app.include_router(chat.router, prefix="/api/chat", tags=["Chat"])
 app.include_router(models.router, prefix="/api/models", tags=["Models"])
 app.include_router(users.router, prefix="/api/users", tags=["Users"])
 app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
+app.include_router(batch.router, prefix="/api/batch", tags=["Batch"])
 
 if __name__ == "__main__":
     uvicorn.run(
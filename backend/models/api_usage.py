@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Float, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from core.database import Base
 
@@ -15,5 +15,47 @@ class APIUsage(Base):
     cost = Column(Float, default=0.0)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_api_usage_user_created", "user_id", "created_at"),
+    )
+
     def __repr__(self):
-        return f"<APIUsage(id={self.id}, user_id={self.user_id}, endpoint={self.endpoint})>"
\ No newline at end of file
+        return f"<APIUsage(id={self.id}, user_id={self.user_id}, endpoint={self.endpoint})>"
+
+class UsageHourly(Base):
+    """API usage totals per user, model and hour (maintained as usage is written)"""
+    __tablename__ = "usage_hourly"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    model_name = Column(String(100), nullable=False, default="")
+    hour = Column(DateTime(timezone=True), nullable=False)
+    requests = Column(Integer, nullable=False, default=0)
+    errors = Column(Integer, nullable=False, default=0)
+    tokens_used = Column(Integer, nullable=False, default=0)
+    cost = Column(Float, nullable=False, default=0.0)
+    latency_ms_total = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "model_name", "hour", name="uq_usage_hourly_bucket"),
+        Index("ix_usage_hourly_hour", "hour"),
+    )
+
+class UsageDaily(Base):
+    """API usage totals per user, model and day (maintained as usage is written)"""
+    __tablename__ = "usage_daily"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    model_name = Column(String(100), nullable=False, default="")
+    day = Column(Date, nullable=False)
+    requests = Column(Integer, nullable=False, default=0)
+    errors = Column(Integer, nullable=False, default=0)
+    tokens_used = Column(Integer, nullable=False, default=0)
+    cost = Column(Float, nullable=False, default=0.0)
+    latency_ms_total = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "model_name", "day", name="uq_usage_daily_bucket"),
+        Index("ix_usage_daily_day", "day"),
+    )
@@ -0,0 +1,49 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.sql import func
+from core.database import Base
+
+class BatchJob(Base):
+    __tablename__ = "batch_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, completed, cancelled
+    total = Column(Integer, nullable=False, default=0)
+    succeeded = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    tokens_used = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        Index("ix_batch_jobs_user_created", "user_id", "created_at"),
+    )
+
+    def __repr__(self):
+        return f"<BatchJob(id={self.id}, user_id={self.user_id}, status={self.status})>"
+
+class BatchItem(Base):
+    """One request of a batch job; the table doubles as the workers' durable queue"""
+    __tablename__ = "batch_items"
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("batch_jobs.id"), nullable=False)
+    line = Column(Integer, nullable=False)  # position in the uploaded file
+    custom_id = Column(String(255))
+    model_name = Column(String(100), nullable=False)
+    request = Column(Text, nullable=False)  # JSON chat request
+    status = Column(String(20), nullable=False, default="pending")  # pending, succeeded, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    # Not claimable before this: leased to a worker, or backing off after a failure
+    available_at = Column(DateTime(timezone=True), nullable=False)
+    lease = Column(String(64))  # claim token of the worker holding the item
+    seq = Column(Integer)  # order the item finished in within its job
+    output = Column(Text)  # result line for the job's JSONL output
+    finished_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        UniqueConstraint("job_id", "line", name="uq_batch_items_job_line"),
+        Index("ix_batch_items_queue", "status", "model_name", "available_at"),
+        Index("ix_batch_items_job_seq", "job_id", "seq"),
+    )
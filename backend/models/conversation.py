@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from core.database import Base
@@ -11,12 +11,17 @@ class Conversation(Base):
     title = Column(String(255), default="New Conversation")
     model_name = Column(String(100), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Set on insert too, so the sidebar can page by (updated_at, id)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     is_deleted = Column(Boolean, default=False)
 
     # Relationships
     messages = relationship("Message", back_populates="conversation")
 
+    __table_args__ = (
+        Index("ix_conversations_user_listing", "user_id", "is_deleted", "updated_at", "id"),
+    )
+
 class Message(Base):
     __tablename__ = "messages"
 
@@ -25,8 +30,14 @@ class Message(Base):
     role = Column(String(20), nullable=False)  # 'user' or 'assistant'
     content = Column(Text, nullable=False)
     tokens_used = Column(Integer, default=0)
+    content_tokens = Column(Integer)  # tokens in content, filled in when first counted
+    content_tokenizer = Column(String(200))  # tokenizer content_tokens was counted with
     latency_ms = Column(Integer)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relationships
-    conversation = relationship("Conversation", back_populates="messages")
\ No newline at end of file
+    conversation = relationship("Conversation", back_populates="messages")
+
+    __table_args__ = (
+        Index("ix_messages_conversation_created", "conversation_id", "created_at", "id"),
+    )
@@ -0,0 +1,32 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, UniqueConstraint
+from sqlalchemy.sql import func
+from core.database import Base
+
+class RuntimeConfig(Base):
+    """The admin-editable system configuration (a single row, id 1).
+
+    ``version`` goes up with every config or content change, so workers
+    can tell whether their snapshot is current from this one value.
+    """
+    __tablename__ = "runtime_config"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    data = Column(Text)  # JSON SystemConfig, NULL until first saved (defaults apply)
+    updated_by = Column(String(100))
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class PageContent(Base):
+    __tablename__ = "page_content"
+
+    id = Column(Integer, primary_key=True)
+    page = Column(String(100), nullable=False)
+    section = Column(String(100), nullable=False)
+    content = Column(Text, nullable=False)  # JSON
+    version = Column(Integer, nullable=False)  # config version of the last change
+    updated_by = Column(String(100))
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("page", "section", name="uq_page_content_page_section"),
+    )
@@ -13,6 +13,7 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     is_admin = Column(Boolean, default=False)
     api_key = Column(String(255), unique=True, index=True)
+    api_key_hash = Column(String(64), unique=True, index=True)  # HMAC-SHA256 of api_key
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -0,0 +1,286 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+from core.serialization import dumps, loads
+from models.batch import BatchItem, BatchJob
+from services.llm_service import LLMService
+from services.rate_limiter import rate_limiter
+from services.resilience import LLMBackendError, is_retryable
+from services.scheduler import BATCH, Ticket
+from services.usage import usage_recorder
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running")
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def should_retry(error: BaseException) -> bool:
+    """Whether a failed request may succeed later (backend down or busy, not a bad request)"""
+    if isinstance(error, LLMBackendError):
+        cause = error.__cause__
+        return cause is None or isinstance(cause, LLMBackendError) or is_retryable(cause)
+    return is_retryable(error)
+
+class ClaimedItem(NamedTuple):
+    id: int
+    job_id: int
+    user_id: int
+    line: int
+    custom_id: Optional[str]
+    model_name: str
+    request: str
+    attempts: int
+    lease: str
+
+class BatchWorker:
+    """Processes batch job requests from the ``batch_items`` table.
+
+    The table is the durable queue: a worker claims pending requests by
+    leasing them (``available_at`` moves ``BATCH_LEASE_SECONDS`` ahead under
+    its claim token), so workers never share a request and a crashed
+    worker's requests become claimable again once the lease runs out. Each
+    finished request is committed with its result line, which checkpoints
+    the job; failures the backend may recover from are retried with
+    exponential backoff up to ``BATCH_MAX_ATTEMPTS``. Up to
+    ``BATCH_WORKER_CONCURRENCY`` requests per model run at once, through
+    ``LLMService`` (response cache included) at batch priority.
+    """
+
+    def __init__(self, name: Optional[str] = None):
+        self.name = (name or f"{socket.gethostname()}-{os.getpid()}")[:30]
+        self._tasks: Dict[str, Set[asyncio.Task]] = defaultdict(set)
+        self._claimed: Dict[asyncio.Task, ClaimedItem] = {}
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+
+    def concurrency(self, model: str) -> int:
+        return settings.BATCH_MODEL_CONCURRENCY.get(model, settings.BATCH_WORKER_CONCURRENCY)
+
+    def stop(self):
+        """Stop claiming work (in-flight requests get the shutdown grace period)"""
+        self._stopping.set()
+        self._wakeup.set()
+
+    async def run(self):
+        logger.info(f"Batch worker {self.name} started")
+        while not self._stopping.is_set():
+            try:
+                claimed = await self._fill()
+            except SQLAlchemyError as e:
+                logger.error(f"Batch worker failed to claim requests: {e}")
+                claimed = 0
+            if not claimed:
+                # Sleep until a request finishes (a slot frees up) or the next poll
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), settings.BATCH_POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+        await self._drain()
+        logger.info(
+            f"Batch worker {self.name} stopped: {self.succeeded} succeeded, "
+            f"{self.failed} failed, {self.retried} retried"
+        )
+
+    async def _fill(self) -> int:
+        """Claim requests for every model with free slots and start them"""
+        claimed = 0
+        async with AsyncSessionLocal() as db:
+            now = _now()
+            models = (await db.execute(
+                select(BatchItem.model_name).distinct().where(
+                    BatchItem.status == "pending",
+                    BatchItem.available_at <= now,
+                    BatchItem.job_id.in_(select(BatchJob.id).where(BatchJob.status.in_(ACTIVE_STATUSES)))
+                )
+            )).scalars().all()
+            for model in models:
+                free = self.concurrency(model) - len(self._tasks[model])
+                if free <= 0:
+                    continue
+                for item in await self._claim(db, model, free):
+                    task = asyncio.create_task(self._process(item))
+                    self._tasks[model].add(task)
+                    self._claimed[task] = item
+                    task.add_done_callback(partial(self._done, model))
+                    claimed += 1
+        return claimed
+
+    async def _claim(self, db: AsyncSession, model: str, limit: int) -> List[ClaimedItem]:
+        now = _now()
+        lease = f"{self.name}:{uuid.uuid4().hex}"
+        candidates = (
+            select(BatchItem.id)
+            .where(
+                BatchItem.status == "pending",
+                BatchItem.model_name == model,
+                BatchItem.available_at <= now,
+                BatchItem.job_id.in_(select(BatchJob.id).where(BatchJob.status.in_(ACTIVE_STATUSES)))
+            )
+            .order_by(BatchItem.id)
+            .limit(limit)
+            # Workers claiming at once take different rows instead of queuing on the same ones
+            # (dialects without row locks, such as SQLite, leave this out)
+            .with_for_update(skip_locked=True)
+        )
+        # The conditions are checked again on update, so a request another worker just took is skipped
+        await db.execute(
+            update(BatchItem)
+            .where(
+                BatchItem.id.in_(candidates.scalar_subquery()),
+                BatchItem.status == "pending",
+                BatchItem.available_at <= now
+            )
+            .values(
+                available_at=now + timedelta(seconds=settings.BATCH_LEASE_SECONDS),
+                lease=lease,
+                attempts=BatchItem.attempts + 1
+            )
+            .execution_options(synchronize_session=False)
+        )
+        rows = (await db.execute(
+            select(
+                BatchItem.id, BatchItem.job_id, BatchJob.user_id, BatchItem.line, BatchItem.custom_id,
+                BatchItem.model_name, BatchItem.request, BatchItem.attempts, BatchItem.lease
+            )
+            .join(BatchJob, BatchJob.id == BatchItem.job_id)
+            .where(BatchItem.lease == lease)
+        )).all()
+        if rows:
+            await db.execute(
+                update(BatchJob)
+                .where(BatchJob.id.in_({row.job_id for row in rows}), BatchJob.status == "queued")
+                .values(status="running", started_at=now)
+            )
+        await db.commit()
+        return [ClaimedItem(*row) for row in rows]
+
+    def _done(self, model: str, task: asyncio.Task):
+        self._tasks[model].discard(task)
+        self._claimed.pop(task, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Batch request failed unexpectedly: {task.exception()!r}")
+        self._wakeup.set()
+
+    async def _process(self, item: ClaimedItem):
+        request = loads(item.request)
+        service = LLMService(model_name=item.model_name, ticket=Ticket(item.user_id, BATCH))
+        started = time.monotonic()
+        try:
+            response = await service.generate(
+                messages=request["messages"],
+                temperature=request["temperature"],
+                max_tokens=request["max_tokens"],
+                cache=request.get("cache")
+            )
+        except Exception as e:
+            latency_ms = int((time.monotonic() - started) * 1000)
+            if should_retry(e) and item.attempts < settings.BATCH_MAX_ATTEMPTS:
+                await self._retry(item, e)
+                return
+            logger.warning(f"Batch job {item.job_id} line {item.line} failed: {e!r}")
+            usage_recorder.record(item.user_id, "/api/batch", item.model_name, 0, latency_ms, 503 if should_retry(e) else 500)
+            await self._finish(item, "failed", {"error": f"{e}: {e.__cause__}" if e.__cause__ else str(e)}, 0)
+            return
+
+        latency_ms = int((time.monotonic() - started) * 1000)
+        tokens_used = response.get("tokens_used", 0)
+        usage_recorder.record(
+            item.user_id, "/api/batch", response.get("model", item.model_name), tokens_used, latency_ms, 200
+        )
+        await rate_limiter.debit(item.user_id, item.model_name, tokens_used)
+        await self._finish(item, "succeeded", {"response": response}, tokens_used)
+
+    async def _finish(self, item: ClaimedItem, status: str, body: Dict[str, Any], tokens_used: int):
+        """Store a request's result line and count it in its job, in one transaction"""
+        now = _now()
+        counter = BatchJob.succeeded if status == "succeeded" else BatchJob.failed
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(BatchItem)
+                .where(BatchItem.id == item.id, BatchItem.lease == item.lease)
+                .values(status=status, lease=None, finished_at=now)
+            )
+            if result.rowcount == 0:
+                logger.warning(f"Batch job {item.job_id} line {item.line}: lease lost, result discarded")
+                return
+            # The job row stays locked until commit, so result sequence numbers are unique
+            await db.execute(
+                update(BatchJob)
+                .where(BatchJob.id == item.job_id)
+                .values({counter: counter + 1, BatchJob.tokens_used: BatchJob.tokens_used + tokens_used})
+            )
+            seq = (await db.execute(
+                select(BatchJob.succeeded + BatchJob.failed).where(BatchJob.id == item.job_id)
+            )).scalar_one()
+            output = dumps({"seq": seq, "line": item.line, "custom_id": item.custom_id, "status": status, **body})
+            await db.execute(
+                update(BatchItem).where(BatchItem.id == item.id).values(seq=seq, output=output.decode())
+            )
+            await db.execute(
+                update(BatchJob)
+                .where(
+                    BatchJob.id == item.job_id,
+                    BatchJob.status == "running",
+                    BatchJob.succeeded + BatchJob.failed >= BatchJob.total
+                )
+                .values(status="completed", finished_at=now)
+            )
+            await db.commit()
+        if status == "succeeded":
+            self.succeeded += 1
+        else:
+            self.failed += 1
+
+    async def _retry(self, item: ClaimedItem, error: BaseException):
+        delay = settings.BATCH_RETRY_BACKOFF_SECONDS * 2 ** (item.attempts - 1)
+        logger.warning(f"Batch job {item.job_id} line {item.line} will be retried in {delay:.0f}s: {error!r}")
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(BatchItem)
+                .where(BatchItem.id == item.id, BatchItem.lease == item.lease)
+                .values(available_at=_now() + timedelta(seconds=delay), lease=None)
+            )
+            await db.commit()
+        self.retried += 1
+
+    async def _drain(self):
+        """Let in-flight requests finish, then hand the rest back to the queue"""
+        tasks = set(self._claimed)
+        if tasks:
+            await asyncio.wait(tasks, timeout=settings.BATCH_SHUTDOWN_GRACE_SECONDS)
+        unfinished = {task: item for task, item in self._claimed.items() if not task.done()}
+        for task in unfinished:
+            task.cancel()
+        await asyncio.gather(*unfinished, return_exceptions=True)
+        if not unfinished:
+            return
+        async with AsyncSessionLocal() as db:
+            for item in unfinished.values():
+                # An interrupted attempt does not count against the request
+                await db.execute(
+                    update(BatchItem)
+                    .where(BatchItem.id == item.id, BatchItem.lease == item.lease)
+                    .values(available_at=_now(), lease=None, attempts=BatchItem.attempts - 1)
+                )
+            await db.commit()
+        logger.info(f"Released {len(unfinished)} unfinished batch requests")
@@ -0,0 +1,98 @@
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+import asyncio
+import logging
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+BatchExecutor = Callable[[List[Any]], Awaitable[List[Any]]]
+
+class _PendingBatch:
+    def __init__(self, execute: BatchExecutor):
+        self.execute = execute
+        self.items: List[Tuple[Any, asyncio.Future]] = []
+        self.flush_handle: asyncio.TimerHandle = None
+
+class MicroBatcher:
+    """Gathers concurrent calls per key into micro-batches.
+
+    The first call for a key opens a batch that is flushed after
+    ``window_ms`` or as soon as it holds ``max_batch`` items. The executor
+    receives all items at once and returns one result (or exception) per
+    item, which is fanned back out to the waiting callers.
+    """
+
+    def __init__(self, window_ms: float, max_batch: int):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending: Dict[str, _PendingBatch] = {}
+        self._running: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+    async def submit(self, key: str, item: Any, execute: BatchExecutor) -> Any:
+        """Add an item to the open batch for ``key`` and wait for its result"""
+        loop = asyncio.get_running_loop()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = _PendingBatch(execute)
+            batch.flush_handle = loop.call_later(self.window, self._flush, key)
+            self._pending[key] = batch
+
+        future = loop.create_future()
+        batch.items.append((item, future))
+        if len(batch.items) >= self.max_batch:
+            self._flush(key)
+        return await future
+
+    def _flush(self, key: str):
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        batch.flush_handle.cancel()
+        task = asyncio.create_task(self._run(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: _PendingBatch):
+        self.batches += 1
+        self.items += len(batch.items)
+        self.largest_batch = max(self.largest_batch, len(batch.items))
+        try:
+            results = await batch.execute([item for item, _ in batch.items])
+        except Exception as e:
+            logger.error(f"Batch execution failed: {e}")
+            results = [e] * len(batch.items)
+
+        for (_, future), result in zip(batch.items, results):
+            if future.done():  # caller went away
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def close(self):
+        """Flush open batches and wait for running ones (called on shutdown)"""
+        for key in list(self._pending):
+            self._flush(key)
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Batch size counters"""
+        return {
+            "enabled": settings.LLM_BATCHING_ENABLED,
+            "open_batches": len(self._pending),
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch
+        }
+
+generation_batcher = MicroBatcher(
+    window_ms=settings.LLM_BATCH_WINDOW_MS,
+    max_batch=settings.LLM_BATCH_MAX_SIZE
+)
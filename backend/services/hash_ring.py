@@ -0,0 +1,41 @@
+from bisect import bisect
+from hashlib import blake2b
+from typing import Callable, Generic, Iterator, List, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+def hash64(value: str) -> int:
+    """Stable 64-bit hash (unlike ``hash()``, the same in every process)"""
+    return int.from_bytes(blake2b(value.encode(), digest_size=8).digest(), "big")
+
+class HashRing(Generic[T]):
+    """Consistent hash ring with virtual nodes.
+
+    Each node is placed at ``vnodes`` points on the ring, so keys spread
+    evenly and adding or removing a node only moves the keys that node
+    gains or loses (about 1/n of them).
+    """
+
+    def __init__(self, nodes: Sequence[T], name: Callable[[T], str], vnodes: int = 100):
+        points: List[Tuple[int, int]] = []
+        for index, node in enumerate(nodes):
+            node_name = name(node)
+            points.extend((hash64(f"{node_name}#{i}"), index) for i in range(vnodes))
+        points.sort()
+        self.nodes = list(nodes)
+        self._hashes = [point for point, _ in points]
+        self._owners = [index for _, index in points]
+
+    def walk(self, key: str) -> Iterator[T]:
+        """Distinct nodes in ring order starting at the key's position"""
+        if not self._hashes:
+            return
+        start = bisect(self._hashes, hash64(key))
+        seen = set()
+        for offset in range(len(self._hashes)):
+            index = self._owners[(start + offset) % len(self._hashes)]
+            if index not in seen:
+                seen.add(index)
+                yield self.nodes[index]
+                if len(seen) == len(self.nodes):
+                    return
@@ -1,165 +1,339 @@
-import httpx
 import asyncio
+import hashlib
 import logging
-from typing import List, Dict, Any, AsyncGenerator, Optional
-import json
+from typing import List, Dict, Any, AsyncGenerator, Awaitable, Optional, Tuple
 
 from core.config import settings
-from core.database import get_redis
+from core.serialization import dumps
+from services.response_cache import response_cache
+from services.single_flight import single_flight
+from services.batcher import generation_batcher
+from services.model_registry import model_registry, Replica
+from services.providers import providers
+from services.resilience import LLMBackendError, hedger, is_retryable, rejection, retry_budget
+from services.scheduler import Overloaded, Ticket, admission_scheduler, request_cost
+from services.streaming import StreamChunk, StreamTee, coalesce_deltas, replay_stream
 
 logger = logging.getLogger(__name__)
 
+def prefix_key(messages: List[Dict[str, str]]) -> Optional[str]:
+    """Routing key shared by every turn of a conversation: its messages up to the first user turn"""
+    for index, message in enumerate(messages):
+        if message["role"] == "user":
+            return hashlib.blake2b(dumps(messages[:index + 1]), digest_size=16).hexdigest()
+    return None
+
 class LLMService:
     """Unified LLM service supporting multiple inference backends"""
     
-    def __init__(self, model_name: str = None):
+    def __init__(self, model_name: str = None, ticket: Optional[Ticket] = None):
         self.model_name = model_name or settings.DEFAULT_MODEL
-        self.redis = get_redis()
+        self.ticket = ticket  # who the requests are for, used to schedule them on the backends
+        self.cache = response_cache
         
     async def generate(
         self,
         messages: List[Dict[str, str]],
         temperature: float = 0.7,
         max_tokens: int = 2048,
+        cache: Optional[bool] = None,
         **kwargs
     ) -> Dict[str, Any]:
         """Generate completion from LLM"""
         # Check cache first
-        cache_key = self._get_cache_key(messages, temperature)
-        cached = self.redis.get(cache_key)
+        params = {"temperature": temperature, "max_tokens": max_tokens, **kwargs}
+        cached = await self.cache.get(self.model_name, messages, params, cache=cache)
         if cached:
             logger.info(f"Cache hit for model {self.model_name}")
-            return json.loads(cached)
+            return cached
         
-        # Route to appropriate backend
-        if self._is_vllm_model():
-            response = await self._generate_vllm(messages, temperature, max_tokens, **kwargs)
-        elif self._is_ollama_model():
-            response = await self._generate_ollama(messages, temperature, max_tokens, **kwargs)
-        else:
-            response = await self._generate_openai(messages, temperature, max_tokens, **kwargs)
+        if not self.cache.is_cacheable(params, cache):
+            return await self._dispatch(messages, temperature, max_tokens, **kwargs)
         
-        # Cache response
-        self.redis.setex(cache_key, 3600, json.dumps(response))
+        async def generate_and_cache() -> Dict[str, Any]:
+            response = await self._dispatch(messages, temperature, max_tokens, **kwargs)
+            # Answers from a fallback model are not cached under this model's key
+            if response["model"] == self.model_name:
+                await self.cache.set(self.model_name, messages, params, response, cache=cache)
+            return response
         
-        return response
+        # Identical in-flight requests wait on a single upstream generation
+        cache_key = self.cache.key_for(self.model_name, messages, params)
+        return await single_flight.do(
+            cache_key,
+            generate_and_cache,
+            recheck=lambda: self.cache.peek(cache_key)
+        )
     
     async def stream_generate(
         self,
         messages: List[Dict[str, str]],
         temperature: float = 0.7,
         max_tokens: int = 2048,
+        cache: Optional[bool] = None,
         **kwargs
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """Stream completion from LLM"""
-        if self._is_vllm_model():
-            async for chunk in self._stream_vllm(messages, temperature, max_tokens, **kwargs):
-                yield chunk
-        elif self._is_ollama_model():
-            async for chunk in self._stream_ollama(messages, temperature, max_tokens, **kwargs):
-                yield chunk
+        params = {"temperature": temperature, "max_tokens": max_tokens, **kwargs}
+        if not self.cache.is_cacheable(params, cache):
+            stream = self._stream_upstream(messages, temperature, max_tokens, **kwargs)
+        elif cached := await self.cache.get(self.model_name, messages, params, cache=cache):
+            # Serve a cached completion as a synthetic stream
+            logger.info(f"Cache hit for model {self.model_name} (stream)")
+            stream = replay_stream(cached)
         else:
-            async for chunk in self._stream_openai(messages, temperature, max_tokens, **kwargs):
+            async def stream_and_cache() -> AsyncGenerator[Dict[str, Any], None]:
+                tee = StreamTee()
+                upstream = tee.tee(self._stream_upstream(messages, temperature, max_tokens, **kwargs))
+                try:
+                    async for chunk in upstream:
+                        yield chunk
+                finally:
+                    await upstream.aclose()
+                if tee.completed and tee.model in (None, self.model_name):
+                    await self.cache.set(self.model_name, messages, params, tee.as_response(self.model_name), cache=cache)
+            
+            # Followers attach to an identical stream that is already being generated
+            stream = single_flight.stream(self.cache.key_for(self.model_name, messages, params), stream_and_cache)
+        
+        # Closing this generator (the client went away) must close the stream it reads, down to the backend
+        try:
+            async for chunk in stream:
                 yield chunk
+        finally:
+            await stream.aclose()
     
-    def _is_vllm_model(self) -> bool:
-        """Check if model uses vLLM backend"""
-        return self.model_name in ["llama-3.1-70b", "llama-3.1-8b", "mistral-7b"]
+    def _stream_upstream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        **kwargs
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Backend stream, with small deltas coalesced into frames when configured"""
+        stream = self._stream_backend(messages, temperature, max_tokens, **kwargs)
+        if settings.LLM_STREAM_COALESCE_MS <= 0:
+            return stream
+        return coalesce_deltas(
+            stream,
+            settings.LLM_STREAM_COALESCE_MS / 1000,
+            settings.LLM_STREAM_COALESCE_MAX_CHARS
+        )
     
-    def _is_ollama_model(self) -> bool:
-        """Check if model uses Ollama backend"""
-        return self.model_name.startswith("ollama/")
+    async def _dispatch(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Send a completion upstream, through the micro-batcher when enabled"""
+        if not settings.LLM_BATCHING_ENABLED:
+            return await self._generate_backend(messages, temperature, max_tokens, ticket=self.ticket, **kwargs)
+        
+        # Batches run on the first caller's service, so each request carries its own ticket
+        request = {
+            "messages": messages, "temperature": temperature, "max_tokens": max_tokens, "ticket": self.ticket, **kwargs
+        }
+        return await generation_batcher.submit(self.model_name, request, self._generate_batch)
     
-    async def _generate_vllm(
+    async def _generate_batch(self, requests: List[Dict[str, Any]]) -> List[Any]:
+        """Run a micro-batch for this model.
+
+        The OpenAI-compatible chat endpoints served by vLLM and Ollama take one
+        conversation per request, so the batch is pipelined concurrently over
+        the backend's shared keep-alive (or HTTP/2) connection pool.
+        """
+        return await asyncio.gather(
+            *[self._generate_backend(**request) for request in requests],
+            return_exceptions=True
+        )
+    
+    async def _generate_backend(
         self,
         messages: List[Dict[str, str]],
         temperature: float,
         max_tokens: int,
+        ticket: Optional[Ticket] = None,
         **kwargs
     ) -> Dict[str, Any]:
-        """Generate using vLLM inference server"""
-        async with httpx.AsyncClient(timeout=120.0) as client:
+        """Serve a completion from the model, else from its fallback chain.
+
+        Only backend faults fall back; a request the backend rejects raises
+        ``BackendRejectedRequest``, and unexpected errors propagate as is.
+        """
+        retry_budget.record_request()
+        last_error = None
+        for model in [self.model_name, *model_registry.get_fallbacks(self.model_name)]:
             try:
-                response = await client.post(
-                    f"{settings.VLLM_ENDPOINT}/v1/completions",
-                    json={
-                        "model": self.model_name,
-                        "messages": messages,
-                        "temperature": temperature,
-                        "max_tokens": max_tokens,
-                        **kwargs
-                    }
-                )
-                response.raise_for_status()
-                data = response.json()
-                
-                return {
-                    "content": data["choices"][0]["message"]["content"],
-                    "tokens_used": data.get("usage", {}).get("total_tokens", 0),
-                    "model": self.model_name
-                }
+                async with admission_scheduler.slot(model, ticket, request_cost(messages, max_tokens)):
+                    return await self._generate_model(model, messages, temperature, max_tokens, **kwargs)
             except Exception as e:
-                logger.error(f"vLLM generation error: {e}")
-                # Fallback to mock response for demo
-                return {
-                    "content": "This is a demo response. Connect vLLM server for real inference.",
-                    "tokens_used": 50,
-                    "model": self.model_name
-                }
+                rejected = rejection(e)
+                if rejected is not None:
+                    raise rejected from e
+                if not isinstance(e, LLMBackendError) and not is_retryable(e):
+                    raise
+                last_error = e
+                logger.warning(f"Model {model} failed for {self.model_name} request: {e!r}")
+        if isinstance(last_error, Overloaded):
+            raise last_error
+        raise LLMBackendError(f"No backend available for model {self.model_name}") from last_error
     
-    async def _stream_vllm(
+    async def _generate_model(
         self,
+        model: str,
         messages: List[Dict[str, str]],
         temperature: float,
         max_tokens: int,
         **kwargs
-    ) -> AsyncGenerator[Dict[str, Any], None]:
-        """Stream from vLLM"""
-        async with httpx.AsyncClient(timeout=120.0) as client:
+    ) -> Dict[str, Any]:
+        """Call one model's replicas, retrying within the budget and hedging slow calls"""
+        tried: List[Replica] = []
+        attempt = 0
+        last_error = None
+        affinity = prefix_key(messages)
+        while True:
+            # Off the affinity replica only if it cannot be reserved, never back to one that failed
+            replica = (
+                model_registry.select_replica(model, exclude=tried, affinity=affinity)
+                or model_registry.select_replica(model, exclude=tried)
+            )
+            if replica is None:
+                if last_error is not None:
+                    # Every replica has been tried
+                    raise last_error
+                raise LLMBackendError(f"All replicas of {model} have open circuits")
+            tried.append(replica)
+            
+            def hedge() -> Optional[Awaitable[Dict[str, Any]]]:
+                target = self._hedge_target(model, tried)
+                if target is None:
+                    return None
+                if not retry_budget.try_spend():
+                    target[1].breaker.release()
+                    return None
+                return self._call_replica(*target, messages, temperature, max_tokens, **kwargs)
+            
+            delay = model_registry.hedge_delay(model)
             try:
-                async with client.stream(
-                    "POST",
-                    f"{settings.VLLM_ENDPOINT}/v1/completions",
-                    json={
-                        "model": self.model_name,
-                        "messages": messages,
-                        "temperature": temperature,
-                        "max_tokens": max_tokens,
-                        "stream": True,
-                        **kwargs
-                    }
-                ) as response:
-                    async for line in response.aiter_lines():
-                        if line.startswith("data: "):
-                            data = json.loads(line[6:])
-                            if data.get("choices"):
-                                yield {
-                                    "content": data["choices"][0].get("delta", {}).get("content", ""),
-                                    "done": data.get("done", False)
-                                }
+                return await hedger.run(
+                    lambda: self._call_replica(model, replica, messages, temperature, max_tokens, **kwargs),
+                    hedge if settings.LLM_HEDGING_ENABLED and delay is not None else None,
+                    delay
+                )
             except Exception as e:
-                logger.error(f"vLLM streaming error: {e}")
-                yield {"content": "Error: vLLM server not available", "done": True}
+                if not is_retryable(e) or attempt >= settings.LLM_MAX_RETRIES or not retry_budget.try_spend():
+                    raise
+                attempt += 1
+                last_error = e
+                logger.warning(f"Retrying {model} after error from {replica.endpoint}: {e!r}")
     
-    async def _generate_ollama(self, messages, temperature, max_tokens, **kwargs):
-        """Generate using Ollama"""
-        # Implementation for Ollama
-        pass
+    def _hedge_target(self, model: str, tried: List[Replica]) -> Optional[Tuple[str, Replica]]:
+        """Another replica of the model, else a replica of its first fallback"""
+        replica = model_registry.select_replica(model, exclude=tried)
+        if replica is not None:
+            return model, replica
+        for fallback in model_registry.get_fallbacks(model)[:1]:
+            replica = model_registry.select_replica(fallback)
+            if replica is not None:
+                return fallback, replica
+        return None
     
-    async def _stream_ollama(self, messages, temperature, max_tokens, **kwargs):
-        """Stream from Ollama"""
-        pass
+    async def _stream_backend(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        **kwargs
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Stream from the model, else from its fallback chain.
+
+        Attempts are retried or failed over only until the first chunk
+        arrives; after that a backend failure ends the stream with an error chunk.
+        """
+        retry_budget.record_request()
+        affinity = prefix_key(messages)
+        cost = request_cost(messages, max_tokens)
+        for model in [self.model_name, *model_registry.get_fallbacks(self.model_name)]:
+            shed = False
+            try:
+                async with admission_scheduler.slot(model, self.ticket, cost):
+                    tried: List[Replica] = []
+                    attempt = 0
+                    while True:
+                        replica = (
+                            model_registry.select_replica(model, exclude=tried, affinity=affinity)
+                            or model_registry.select_replica(model, exclude=tried)
+                        )
+                        if replica is None:
+                            break
+                        tried.append(replica)
+                        stream = self._stream_replica(model, replica, messages, temperature, max_tokens, **kwargs)
+                        try:
+                            try:
+                                first = await stream.__anext__()
+                            except StopAsyncIteration:
+                                return
+                            except Exception as e:
+                                logger.warning(f"Stream from {model} at {replica.endpoint} failed: {e!r}")
+                                rejected = rejection(e)
+                                if rejected is not None:
+                                    # Another replica or model would refuse it too
+                                    yield StreamChunk(content=f"Error: {rejected}", done=True, error=True)
+                                    return
+                                if is_retryable(e) and attempt < settings.LLM_MAX_RETRIES and retry_budget.try_spend():
+                                    attempt += 1
+                                    continue
+                                break
+                            
+                            yield self._tag_fallback(first, model)
+                            try:
+                                async for chunk in stream:
+                                    yield self._tag_fallback(chunk, model)
+                            except Exception as e:
+                                logger.error(f"Stream from {model} at {replica.endpoint} broke off: {e!r}")
+                                yield StreamChunk(content="Error: model backend failed mid-stream", done=True, error=True)
+                            return
+                        finally:
+                            await stream.aclose()
+            except Overloaded:
+                shed = True
+        
+        # The last model in the chain was busy rather than down
+        if shed:
+            yield StreamChunk(content="Error: model backend overloaded, please retry shortly", done=True, error=True)
+            return
+        yield StreamChunk(content="Error: model backend unavailable", done=True, error=True)
     
-    async def _generate_openai(self, messages, temperature, max_tokens, **kwargs):
-        """Generate using OpenAI API (fallback)"""
-        pass
+    def _tag_fallback(self, chunk: Dict[str, Any], model: str) -> Dict[str, Any]:
+        """Mark the final chunk of a stream served by a fallback model"""
+        if chunk.get("done") and model != self.model_name:
+            return StreamChunk(chunk, model=model)
+        return chunk
     
-    async def _stream_openai(self, messages, temperature, max_tokens, **kwargs):
-        """Stream from OpenAI API"""
-        pass
+    async def _call_replica(
+        self,
+        model: str,
+        replica: Replica,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Send one completion to a replica through its provider"""
+        provider = providers.get(replica.provider)
+        return await provider.generate(model, replica, messages, temperature, max_tokens, **kwargs)
     
-    def _get_cache_key(self, messages: List[Dict], temperature: float) -> str:
-        """Generate cache key for request"""
-        import hashlib
-        key_str = json.dumps({"messages": messages, "temp": temperature, "model": self.model_name})
-        return f"llm_cache:{hashlib.md5(key_str.encode()).hexdigest()}"
\ No newline at end of file
+    def _stream_replica(
+        self,
+        model: str,
+        replica: Replica,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        **kwargs
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Open one stream from a replica through its provider"""
+        provider = providers.get(replica.provider)
+        return provider.stream(model, replica, messages, temperature, max_tokens, **kwargs)
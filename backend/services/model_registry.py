@@ -1,10 +1,21 @@
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional, Sequence, Tuple
+from contextlib import asynccontextmanager
 import logging
+import math
+import random
+import time
+
+from core.config import settings
+from core.metrics import QuantileSketch, WindowedSketch
+from services.hash_ring import HashRing
+from services.providers import providers
+from services.resilience import CircuitBreaker, is_retryable
+from services.runtime_config import runtime_config
 
 logger = logging.getLogger(__name__)
 
 class ModelRegistry:
-    """Central registry for available LLM models"""
+    """Central registry for available LLM models and their live routing table"""
     
     MODELS = {
         "llama-3.1-70b": {
@@ -13,8 +24,6 @@ class ModelRegistry:
             "description": "Meta's flagship open-source model with 70B parameters",
             "context_length": 128000,
             "cost_per_1k_tokens": 0.0008,
-            "latency_p50_ms": 45,
-            "latency_p99_ms": 156,
             "available": True,
             "provider": "vllm"
         },
@@ -24,8 +33,6 @@ class ModelRegistry:
             "description": "Compact and fast Llama model",
             "context_length": 128000,
             "cost_per_1k_tokens": 0.0001,
-            "latency_p50_ms": 12,
-            "latency_p99_ms": 45,
             "available": True,
             "provider": "vllm"
         },
@@ -35,8 +42,6 @@ class ModelRegistry:
             "description": "Efficient and powerful 7B parameter model",
             "context_length": 32768,
             "cost_per_1k_tokens": 0.0002,
-            "latency_p50_ms": 18,
-            "latency_p99_ms": 67,
             "available": True,
             "provider": "vllm"
         },
@@ -46,22 +51,284 @@ class ModelRegistry:
             "description": "Alibaba's powerful multilingual model",
             "context_length": 131072,
             "cost_per_1k_tokens": 0.0009,
-            "latency_p50_ms": 52,
-            "latency_p99_ms": 178,
             "available": True,
             "provider": "vllm"
         }
     }
     
+    def __init__(self):
+        self._replicas: Dict[str, List[Replica]] = {}
+        self._rings: Dict[str, Tuple[Tuple["Replica", ...], HashRing]] = {}
+        self.affinity_routed = 0
+        self.affinity_spilled = 0
+    
+    def get_provider(self, model_id: str) -> str:
+        """Backend provider serving a model"""
+        model = self.MODELS.get(model_id)
+        if model:
+            return model["provider"]
+        if model_id.startswith("ollama/"):
+            return "ollama"
+        return "openai"
+    
+    def get_replicas(self, model_id: str) -> List["Replica"]:
+        """Inference replicas serving a model (MODEL_ENDPOINTS, else the provider default)"""
+        replicas = self._replicas.get(model_id)
+        if replicas is None:
+            provider = self.get_provider(model_id)
+            endpoints = settings.MODEL_ENDPOINTS.get(model_id) or [providers.get(provider).default_endpoint]
+            replicas = [Replica(provider, endpoint) for endpoint in endpoints]
+            self._replicas[model_id] = replicas
+        return replicas
+    
+    def all_replicas(self) -> List["Replica"]:
+        """Replicas of every catalog model"""
+        return [replica for model_id in self.MODELS for replica in self.get_replicas(model_id)]
+    
+    def get_fallbacks(self, model_id: str) -> List[str]:
+        """Ordered models to fall back to when a model's replicas all fail"""
+        return [model for model in settings.MODEL_FALLBACKS.get(model_id, []) if model != model_id]
+    
+    def select_replica(
+        self,
+        model_id: str,
+        exclude: Sequence["Replica"] = (),
+        affinity: Optional[str] = None
+    ) -> Optional["Replica"]:
+        """Pick a replica by power-of-two-choices or least outstanding requests.
+
+        With an ``affinity`` key (a conversation's prompt prefix) the replica
+        comes from a consistent hash ring instead, so follow-up turns reuse
+        the replica that holds the prefix in its KV cache. Replicas with an
+        open circuit breaker or listed in ``exclude`` are skipped; None
+        means no replica can take the request.
+
+        The returned replica is reserved on its circuit breaker (a probe
+        slot while it is recovering). Send the request through
+        ``Replica.track``, which settles the reservation, or call
+        ``replica.breaker.release()`` if it is not sent after all.
+        """
+        replica = self._pick_replica(model_id, exclude, affinity)
+        # Selection and reservation happen in one step, with no await in between
+        if replica is None or not replica.breaker.acquire():
+            return None
+        return replica
+
+    def _pick_replica(
+        self,
+        model_id: str,
+        exclude: Sequence["Replica"],
+        affinity: Optional[str]
+    ) -> Optional["Replica"]:
+        replicas = [
+            replica for replica in self.get_replicas(model_id)
+            if replica not in exclude and replica.breaker.available()
+        ]
+        concurrency = runtime_config.snapshot.rate_limits["backend_concurrency"]
+        if concurrency > 0:
+            # Prefer replicas below the per-replica concurrency limit (hedges can push one over)
+            replicas = [replica for replica in replicas if replica.outstanding < concurrency] or replicas
+        if len(replicas) <= 1:
+            return replicas[0] if replicas else None
+        if affinity is not None and settings.LLM_AFFINITY_ROUTING:
+            replica = self._select_by_affinity(model_id, replicas, affinity)
+            if replica is not None:
+                return replica
+        if settings.LLM_ROUTING_STRATEGY == "least_outstanding":
+            candidates = replicas
+        else:
+            candidates = random.sample(replicas, 2)
+        return min(candidates, key=lambda replica: replica.load_score())
+    
+    def _ring(self, model_id: str) -> HashRing:
+        # Keyed on the replica objects, which the ring hands back, not just their endpoints
+        replicas = tuple(self.get_replicas(model_id))
+        cached = self._rings.get(model_id)
+        if cached is None or cached[0] != replicas:
+            cached = (replicas, HashRing(replicas, lambda replica: replica.endpoint, settings.LLM_AFFINITY_VNODES))
+            self._rings[model_id] = cached
+        return cached[1]
+
+    def _select_by_affinity(self, model_id: str, candidates: List["Replica"], key: str) -> Optional["Replica"]:
+        """First usable replica on the ring from the key that is not over its fair share.
+
+        Consistent hashing with bounded loads: a replica may carry at most
+        ``LLM_AFFINITY_LOAD_FACTOR`` times the average outstanding requests,
+        so a hot prefix spills to the next replica on the ring instead of
+        piling onto one.
+        """
+        outstanding = sum(replica.outstanding for replica in candidates)
+        capacity = math.ceil(settings.LLM_AFFINITY_LOAD_FACTOR * (outstanding + 1) / len(candidates))
+        usable = set(map(id, candidates))
+        for position, replica in enumerate(self._ring(model_id).walk(key)):
+            if id(replica) in usable and replica.outstanding < capacity:
+                if position == 0:
+                    self.affinity_routed += 1
+                else:
+                    self.affinity_spilled += 1
+                return replica
+        return None
+
+    def routing_stats(self) -> Dict[str, Any]:
+        """How often affinity routing kept a prefix on its replica"""
+        total = self.affinity_routed + self.affinity_spilled
+        return {
+            "strategy": settings.LLM_ROUTING_STRATEGY,
+            "affinity_routing": settings.LLM_AFFINITY_ROUTING,
+            "affinity_routed": self.affinity_routed,
+            "affinity_spilled": self.affinity_spilled,
+            "affinity_hit_rate": round(self.affinity_routed / total, 4) if total else 0.0
+        }
+
+    def hedge_delay(self, model_id: str) -> Optional[float]:
+        """Seconds to wait before hedging a request (the model's latency
+        quantile), None until latencies have been measured"""
+        latency = self._merged(model_id, "latency").quantile(settings.LLM_HEDGE_QUANTILE)
+        if latency is None:
+            return None
+        return max(latency, settings.LLM_HEDGE_MIN_DELAY_MS / 1000)
+    
+    def circuit_states(self) -> Dict[str, Dict[str, str]]:
+        """Circuit breaker state of every replica that has been used"""
+        return {
+            model_id: {replica.endpoint: replica.breaker.state for replica in replicas}
+            for model_id, replicas in self._replicas.items()
+        }
+    
+    def _with_live_stats(self, model: Dict) -> Dict:
+        """Catalog entry with latencies measured across the model's replicas"""
+        latency = self._merged(model["id"], "latency")
+        return {
+            **model,
+            "latency_p50_ms": _ms(latency.quantile(0.5)),
+            "latency_p99_ms": _ms(latency.quantile(0.99))
+        }
+    
+    def _merged(self, model_id: str, metric: str) -> QuantileSketch:
+        merged = QuantileSketch()
+        for replica in self._replicas.get(model_id, []):
+            merged.merge(getattr(replica, metric).snapshot())
+        return merged
+    
     def get_all_models(self) -> List[Dict]:
         """Get all registered models"""
-        return list(self.MODELS.values())
+        return [self._with_live_stats(model) for model in self.MODELS.values()]
     
     def get_model(self, model_id: str) -> Optional[Dict]:
         """Get specific model by ID"""
-        return self.MODELS.get(model_id)
+        model = self.MODELS.get(model_id)
+        return self._with_live_stats(model) if model else None
     
     def is_model_available(self, model_id: str) -> bool:
         """Check if model is available"""
-        model = self.get_model(model_id)
-        return model and model.get("available", False)
\ No newline at end of file
+        model = self.MODELS.get(model_id)
+        return bool(model and model.get("available", False))
+    
+    def get_performance(self, model_id: str) -> Dict:
+        """Measured latency, time-to-first-token and throughput for a model"""
+        latency = self._merged(model_id, "latency")
+        ttft = self._merged(model_id, "ttft")
+        replicas = self._replicas.get(model_id, [])
+        tokens = sum(replica.tokens for replica in replicas)
+        busy_seconds = sum(replica.busy_seconds for replica in replicas)
+        return {
+            "samples": latency.count,
+            "avg_latency_ms": _ms(latency.mean),
+            "p50_latency_ms": _ms(latency.quantile(0.5)),
+            "p95_latency_ms": _ms(latency.quantile(0.95)),
+            "p99_latency_ms": _ms(latency.quantile(0.99)),
+            "p50_ttft_ms": _ms(ttft.quantile(0.5)),
+            "p99_ttft_ms": _ms(ttft.quantile(0.99)),
+            "tokens_per_second": round(tokens / busy_seconds, 1) if busy_seconds else None,
+            "replicas": [replica.stats() for replica in replicas]
+        }
+
+def _ms(seconds: Optional[float]) -> Optional[int]:
+    return int(seconds * 1000) if seconds is not None else None
+
+class Replica:
+    """One inference endpoint serving a model, with live load and latency"""
+    
+    def __init__(self, provider: str, endpoint: str):
+        self.provider = provider
+        self.endpoint = endpoint
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.tokens = 0
+        self.busy_seconds = 0.0
+        self.latency = WindowedSketch(settings.LLM_LATENCY_WINDOW_SECONDS)
+        self.ttft = WindowedSketch(settings.LLM_LATENCY_WINDOW_SECONDS)
+        self.breaker = CircuitBreaker(
+            settings.LLM_BREAKER_FAILURE_THRESHOLD,
+            settings.LLM_BREAKER_RESET_SECONDS,
+            settings.LLM_BREAKER_HALF_OPEN_PROBES
+        )
+    
+    def load_score(self):
+        """Lower is better: outstanding requests, then median latency"""
+        p50 = self.latency.quantile(0.5)
+        return (self.outstanding, p50 if p50 is not None else 0.0)
+    
+    @asynccontextmanager
+    async def track(self):
+        """Count an in-flight request, record its latency and feed the breaker.
+
+        Only backend faults (see ``is_retryable``) count as breaker failures;
+        rejected requests and cancelled hedges leave the circuit as it was.
+        The breaker reservation is taken by ``ModelRegistry.select_replica``.
+        """
+        request = TrackedRequest(self)
+        self.outstanding += 1
+        self.requests += 1
+        settled = False
+        try:
+            yield request
+        except Exception as e:
+            if is_retryable(e):
+                self.errors += 1
+                self.breaker.record_failure()
+                settled = True
+            raise
+        else:
+            elapsed = time.monotonic() - request.started
+            self.latency.add(elapsed)
+            self.busy_seconds += elapsed
+            self.tokens += request.tokens
+            self.breaker.record_success()
+            settled = True
+        finally:
+            self.outstanding -= 1
+            if not settled:
+                self.breaker.release()
+    
+    def stats(self) -> Dict:
+        return {
+            "endpoint": self.endpoint,
+            "provider": self.provider,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "circuit": self.breaker.state,
+            "circuit_opened": self.breaker.times_opened,
+            "p50_latency_ms": _ms(self.latency.quantile(0.5)),
+            "p99_latency_ms": _ms(self.latency.quantile(0.99)),
+            "p50_ttft_ms": _ms(self.ttft.quantile(0.5))
+        }
+
+class TrackedRequest:
+    """Per-request measurement handle returned by ``Replica.track``"""
+    
+    def __init__(self, replica: Replica):
+        self.replica = replica
+        self.started = time.monotonic()
+        self.tokens = 0
+        self._first_token_seen = False
+    
+    def first_token(self):
+        """Record time-to-first-token (only the first call counts)"""
+        if not self._first_token_seen:
+            self._first_token_seen = True
+            self.replica.ttft.add(time.monotonic() - self.started)
+
+model_registry = ModelRegistry()
@@ -0,0 +1,170 @@
+from typing import Any, Dict, List, Optional, Sequence
+import asyncio
+import logging
+import math
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+from models.conversation import Message
+from services.model_registry import model_registry
+
+logger = logging.getLogger(__name__)
+
+# Chat template tokens around each message (role header, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+class PromptTooLarge(Exception):
+    """The prompt cannot fit the model's context window even with no history"""
+
+class TokenCounter:
+    """Counts tokens with each model's tokenizer, loaded once per model.
+
+    Tokenizers come from ``MODEL_TOKENIZERS`` (Hugging Face names or paths)
+    and load in a thread on first use. Models without one, or whose
+    tokenizer fails to load, are estimated at ``CHARS_PER_TOKEN`` characters
+    per token.
+    """
+
+    CHARS_PER_TOKEN = 4
+    ESTIMATE = f"estimate:{CHARS_PER_TOKEN}"
+
+    def __init__(self):
+        self._tokenizers: Dict[str, Any] = {}
+        self._loading: Dict[str, asyncio.Task] = {}
+
+    async def _tokenizer(self, model: str):
+        if model in self._tokenizers:
+            return self._tokenizers[model]
+        name = settings.MODEL_TOKENIZERS.get(model)
+        if not name:
+            self._tokenizers[model] = None
+            return None
+        task = self._loading.get(model)
+        if task is None:
+            task = self._loading[model] = asyncio.create_task(asyncio.to_thread(self._load, name))
+            # Settled by the load itself, so a cancelled caller cannot make the next one start another
+            task.add_done_callback(lambda done: self._loaded(model, done))
+        return await asyncio.shield(task)
+
+    def _loaded(self, model: str, task: asyncio.Task):
+        self._loading.pop(model, None)
+        if not task.cancelled():
+            self._tokenizers[model] = task.result()
+
+    @staticmethod
+    def _load(name: str):
+        try:
+            from transformers import AutoTokenizer
+            return AutoTokenizer.from_pretrained(name)
+        except Exception as e:  # not installed, offline, unknown name
+            logger.warning(f"Tokenizer {name} unavailable, estimating token counts: {e}")
+            return None
+
+    async def tokenizer_id(self, model: str) -> str:
+        """Name of the tokenizer ``count`` uses for a model, stored alongside saved counts"""
+        if await self._tokenizer(model) is None:
+            return self.ESTIMATE
+        return settings.MODEL_TOKENIZERS[model]
+
+    async def count(self, model: str, texts: Sequence[str]) -> List[int]:
+        """Token count of each text"""
+        tokenizer = await self._tokenizer(model)
+        if tokenizer is None:
+            return [math.ceil(len(text) / self.CHARS_PER_TOKEN) for text in texts]
+        if sum(len(text) for text in texts) > settings.TOKENIZE_INLINE_MAX_CHARS:
+            # Large batches would stall the event loop
+            encoded = await asyncio.to_thread(tokenizer, list(texts), add_special_tokens=False)
+        else:
+            encoded = tokenizer(list(texts), add_special_tokens=False)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+token_counter = TokenCounter()
+
+async def _load_history(db: AsyncSession, conversation_id: int, model: str) -> List[Dict[str, Any]]:
+    """Latest stored messages, oldest first, with token counts for ``model``'s tokenizer.
+
+    Counts are saved with the tokenizer that made them; ones that are
+    missing or were made by another model's tokenizer are recounted and
+    saved again.
+    """
+    result = await db.execute(
+        select(Message.id, Message.role, Message.content, Message.content_tokens, Message.content_tokenizer)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(settings.CHAT_HISTORY_MAX_MESSAGES)
+    )
+    history = [dict(row._mapping) for row in reversed(result.all())]
+
+    tokenizer = await token_counter.tokenizer_id(model)
+    missing = [
+        message for message in history
+        if message["content_tokens"] is None or message["content_tokenizer"] != tokenizer
+    ]
+    if missing:
+        counts = await token_counter.count(model, [message["content"] for message in missing])
+        for message, count in zip(missing, counts):
+            message["content_tokens"] = count
+        await db.execute(update(Message), [
+            {"id": message["id"], "content_tokens": message["content_tokens"], "content_tokenizer": tokenizer}
+            for message in missing
+        ])
+        await db.commit()
+    return history
+
+async def assemble_prompt(
+    db: AsyncSession,
+    model: str,
+    messages: List[Dict[str, str]],
+    max_tokens: int,
+    conversation_id: Optional[int] = None,
+    include_history: Optional[bool] = None
+) -> List[Dict[str, str]]:
+    """Build the prompt for a turn and fit it into the model's context window.
+
+    Stored conversation history goes between the request's system messages
+    and its other messages. History is used when ``include_history`` is
+    true, or by default when the client did not send prior assistant turns
+    itself. The oldest history is dropped until the prompt plus
+    ``max_tokens`` fits ``context_length``; if even the request alone does
+    not fit, ``PromptTooLarge`` is raised before anything is sent upstream.
+    """
+    context_length = (model_registry.get_model(model) or {}).get("context_length")
+    if include_history is None:
+        include_history = not any(message["role"] == "assistant" for message in messages)
+
+    history = []
+    if conversation_id and include_history:
+        history = await _load_history(db, conversation_id, model)
+    if not context_length:
+        return _join(messages, history)
+
+    counts = await token_counter.count(model, [message["content"] for message in messages])
+    required = sum(counts) + MESSAGE_OVERHEAD_TOKENS * len(messages) + max_tokens
+    if required > context_length:
+        raise PromptTooLarge(
+            f"Prompt needs {required - max_tokens} tokens plus max_tokens={max_tokens}, "
+            f"but {model} has a {context_length} token context window"
+        )
+
+    # Keep the newest history that fits, dropping from the oldest
+    budget = context_length - required
+    start = len(history)
+    for message in reversed(history):
+        cost = message["content_tokens"] + MESSAGE_OVERHEAD_TOKENS
+        if cost > budget:
+            break
+        budget -= cost
+        start -= 1
+    # Chat templates expect history to open with a user turn
+    while start < len(history) and history[start]["role"] == "assistant":
+        start += 1
+    if start:
+        logger.info(f"Dropped {start} of {len(history)} history messages of conversation {conversation_id} to fit {model}")
+    return _join(messages, history[start:])
+
+def _join(messages: List[Dict[str, str]], history: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    system = [message for message in messages if message["role"] == "system"]
+    turns = [message for message in messages if message["role"] != "system"]
+    return system + [{"role": message["role"], "content": message["content"]} for message in history] + turns
@@ -0,0 +1,4 @@
+from services.providers.base import LLMProvider
+from services.providers.registry import ProviderRegistry, providers
+
+__all__ = ["LLMProvider", "ProviderRegistry", "providers"]
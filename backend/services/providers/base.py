@@ -0,0 +1,221 @@
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import logging
+
+import httpx
+
+from core.config import settings
+from services.streaming import stream_stats
+
+logger = logging.getLogger(__name__)
+
+class LLMProvider:
+    """Base class for an inference backend API.
+
+    Subclasses encode requests and decode responses and token streams for
+    their API. The base class owns the provider's pooled HTTP clients (one
+    keep-alive pool per endpoint) and records each call on its replica.
+    """
+
+    name: str = ""
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._waiting: Dict[str, int] = {}
+
+    @property
+    def default_endpoint(self) -> str:
+        raise NotImplementedError
+
+    @property
+    def timeouts(self) -> Tuple[float, float]:
+        """Connect and read timeouts"""
+        raise NotImplementedError
+
+    def headers(self) -> Dict[str, str]:
+        """Extra headers sent with every request (e.g. authentication)"""
+        return {}
+
+    def upstream_model(self, model: str) -> str:
+        """Model name as the backend knows it"""
+        return model
+
+    def encode_request(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        stream: bool,
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Request path and JSON body"""
+        raise NotImplementedError
+
+    def decode_response(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """``content``, ``tokens_used`` and ``completion_tokens`` of a completion"""
+        raise NotImplementedError
+
+    def decode_stream(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+        """Turn the raw response body into ``{"content", "done"}`` chunks.
+
+        Must end with a ``done`` chunk, and raise if the body ends before the
+        backend signalled completion so truncated output is never cached.
+        """
+        raise NotImplementedError
+
+    def _create_client(self, base_url: str) -> httpx.AsyncClient:
+        http2 = settings.LLM_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("LLM_HTTP2 enabled but 'h2' is not installed, using HTTP/1.1")
+                http2 = False
+
+        connect_timeout, read_timeout = self.timeouts
+        return httpx.AsyncClient(
+            base_url=base_url,
+            http2=http2,
+            headers=self.headers(),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=settings.LLM_POOL_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY
+            )
+        )
+
+    def client(self, base_url: Optional[str] = None) -> httpx.AsyncClient:
+        """Shared client for an endpoint, created lazily"""
+        base_url = base_url or self.default_endpoint
+        client = self._clients.get(base_url)
+        if client is None or client.is_closed:
+            client = self._create_client(base_url)
+            self._clients[base_url] = client
+        return client
+
+    async def close(self):
+        """Close all clients and their pooled connections"""
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    @contextmanager
+    def _counted(self, base_url: str) -> Iterator[Dict[str, Any]]:
+        """Count a request as in flight on an endpoint until it is done, and as waiting until it has a connection.
+
+        Yields the extensions to send the request with. httpcore reports each
+        step of a request to the ``trace`` callback, and the first step comes
+        once the pool has handed the request a connection.
+        """
+        self._in_flight[base_url] = self._in_flight.get(base_url, 0) + 1
+        self._waiting[base_url] = self._waiting.get(base_url, 0) + 1
+        waiting = True
+
+        async def trace(event: str, info: Dict[str, Any]):
+            nonlocal waiting
+            if waiting:
+                waiting = False
+                self._waiting[base_url] -= 1
+
+        try:
+            yield {"trace": trace}
+        finally:
+            self._in_flight[base_url] -= 1
+            if waiting:
+                self._waiting[base_url] -= 1
+
+    @staticmethod
+    def _connections(client: httpx.AsyncClient) -> Optional[Dict[str, int]]:
+        """Open and idle connections, read from httpcore internals (best effort).
+
+        httpx has no public view of its pool, so this may stop working with
+        an httpx or httpcore upgrade; it then returns None rather than fail.
+        """
+        try:
+            connections = list(client._transport._pool.connections)
+            idle = sum(1 for connection in connections if connection.is_idle())
+        except Exception:
+            return None
+        return {"connections": len(connections), "idle": idle}
+
+    def pool_stats(self) -> Dict[str, Dict[str, int]]:
+        """Requests per endpoint in flight, holding a connection and waiting for one, plus open and idle connections where they can be read"""
+        stats = {}
+        for base_url, client in self._clients.items():
+            in_flight = self._in_flight.get(base_url, 0)
+            waiting = self._waiting.get(base_url, 0)
+            stats[f"{self.name}:{base_url}"] = {
+                "in_flight": in_flight,
+                "in_use": in_flight - waiting,
+                "waiting": waiting,
+                **(self._connections(client) or {})
+            }
+        return stats
+
+    async def generate(
+        self,
+        model: str,
+        replica,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """One completion from a replica"""
+        path, body = self.encode_request(model, messages, temperature, max_tokens, stream=False, **kwargs)
+        with self._counted(replica.endpoint) as extensions:
+            async with replica.track() as tracked:
+                response = await self.client(replica.endpoint).post(path, json=body, extensions=extensions)
+                response.raise_for_status()
+                result = self.decode_response(response.json())
+                tracked.tokens = result["completion_tokens"]
+
+        return {
+            "content": result["content"],
+            "tokens_used": result["tokens_used"],
+            "model": model
+        }
+
+    async def stream(
+        self,
+        model: str,
+        replica,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        **kwargs
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """One token stream from a replica.
+
+        Closing the stream early (every reader went away) closes the upstream
+        response before its body is read, which drops the connection (or
+        resets the HTTP/2 stream); vLLM and Ollama abort the generation when
+        they see that.
+        """
+        path, body = self.encode_request(model, messages, temperature, max_tokens, stream=True, **kwargs)
+        tokens = 0
+        try:
+            with self._counted(replica.endpoint) as extensions:
+                async with replica.track() as tracked, self.client(replica.endpoint).stream(
+                    "POST", path, json=body, extensions=extensions
+                ) as response:
+                    if response.is_error:
+                        await response.aread()  # the error body explains a rejected request
+                    response.raise_for_status()
+                    async for chunk in self.decode_stream(response.aiter_bytes()):
+                        if chunk["content"]:
+                            tracked.first_token()
+                            tracked.tokens += 1
+                            tokens += 1
+                        yield chunk
+                        if chunk["done"]:
+                            stream_stats.record_completed(tokens)
+                            return
+        except (GeneratorExit, asyncio.CancelledError):
+            logger.info(f"Aborted {self.name} stream for {model} at {replica.endpoint} after {tokens} deltas")
+            stream_stats.record_aborted(tokens, max_tokens)
+            raise
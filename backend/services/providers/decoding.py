@@ -0,0 +1,40 @@
+from typing import Any, AsyncIterator, Dict, List
+
+from core.serialization import loads
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Split a byte stream into lines as it arrives, without decoding it"""
+    buffer = bytearray()
+    async for data in chunks:
+        buffer += data
+        start = 0
+        while (end := buffer.find(b"\n", start)) != -1:
+            line = bytes(buffer[start:end])
+            yield line[:-1] if line.endswith(b"\r") else line
+            start = end + 1
+        del buffer[:start]
+    if buffer:
+        yield bytes(buffer)
+
+async def iter_sse_data(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Data payloads of a server-sent event stream, one per event"""
+    data: List[bytes] = []
+    async for line in iter_lines(chunks):
+        if not line:
+            if data:
+                yield b"\n".join(data)
+                data = []
+            continue
+        if line.startswith(b":"):  # comment / keep-alive
+            continue
+        field, _, value = line.partition(b":")
+        if field == b"data":
+            data.append(value[1:] if value.startswith(b" ") else value)
+    if data:
+        yield b"\n".join(data)
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    """Objects of a newline-delimited JSON stream"""
+    async for line in iter_lines(chunks):
+        if line.strip():
+            yield loads(line)
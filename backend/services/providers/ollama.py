@@ -0,0 +1,65 @@
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+import httpx
+
+from core.config import settings
+from services.providers.base import LLMProvider
+from services.providers.decoding import iter_ndjson
+from services.resilience import LLMBackendError
+from services.streaming import StreamChunk
+
+class OllamaProvider(LLMProvider):
+    """Ollama's native chat API (``/api/chat`` with NDJSON streaming)"""
+
+    name = "ollama"
+    prefix = "ollama/"
+
+    @property
+    def default_endpoint(self) -> str:
+        return settings.OLLAMA_ENDPOINT
+
+    @property
+    def timeouts(self) -> Tuple[float, float]:
+        return settings.OLLAMA_CONNECT_TIMEOUT, settings.OLLAMA_READ_TIMEOUT
+
+    def upstream_model(self, model: str) -> str:
+        return model[len(self.prefix):] if model.startswith(self.prefix) else model
+
+    def encode_request(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        stream: bool,
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any]]:
+        return "/api/chat", {
+            "model": self.upstream_model(model),
+            "messages": messages,
+            "stream": stream,
+            "options": {"temperature": temperature, "num_predict": max_tokens, **kwargs}
+        }
+
+    def _tokens_used(self, data: Dict[str, Any]) -> int:
+        return data.get("prompt_eval_count", 0) + data.get("eval_count", 0)
+
+    def decode_response(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "content": data["message"]["content"],
+            "tokens_used": self._tokens_used(data),
+            "completion_tokens": data.get("eval_count", 0)
+        }
+
+    async def decode_stream(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+        async for data in iter_ndjson(chunks):
+            if "error" in data:
+                raise LLMBackendError(f"{self.name} stream error: {data['error']}")
+            content = (data.get("message") or {}).get("content")
+            if content:
+                yield StreamChunk(content=content, done=False)
+            if data.get("done"):
+                yield StreamChunk(content="", done=True, tokens_used=self._tokens_used(data))
+                return
+
+        raise httpx.RemoteProtocolError(f"{self.name} stream ended before done")
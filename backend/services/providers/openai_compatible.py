@@ -0,0 +1,81 @@
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+import httpx
+
+from core.config import settings
+from core.serialization import loads
+from services.providers.base import LLMProvider
+from services.providers.decoding import iter_sse_data
+from services.resilience import LLMBackendError
+from services.streaming import StreamChunk
+
+class OpenAICompatibleProvider(LLMProvider):
+    """OpenAI chat completions API (``/v1/chat/completions`` with SSE streaming)"""
+
+    name = "openai"
+
+    @property
+    def default_endpoint(self) -> str:
+        return settings.OPENAI_API_BASE
+
+    @property
+    def timeouts(self) -> Tuple[float, float]:
+        return settings.OPENAI_CONNECT_TIMEOUT, settings.OPENAI_READ_TIMEOUT
+
+    def headers(self) -> Dict[str, str]:
+        if settings.OPENAI_API_KEY:
+            return {"Authorization": f"Bearer {settings.OPENAI_API_KEY}"}
+        return {}
+
+    def encode_request(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        stream: bool,
+        **kwargs
+    ) -> Tuple[str, Dict[str, Any]]:
+        body = {
+            "model": self.upstream_model(model),
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            **kwargs
+        }
+        if stream:
+            body["stream"] = True
+            # Ask for a final usage chunk so streamed token counts are exact
+            body["stream_options"] = {"include_usage": True}
+        return "/v1/chat/completions", body
+
+    def decode_response(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        usage = data.get("usage") or {}
+        return {
+            "content": data["choices"][0]["message"]["content"] or "",
+            "tokens_used": usage.get("total_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0)
+        }
+
+    async def decode_stream(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+        tokens_used = None
+        async for payload in iter_sse_data(chunks):
+            if payload.strip() == b"[DONE]":
+                final = StreamChunk(content="", done=True)
+                if tokens_used is not None:
+                    final["tokens_used"] = tokens_used
+                yield final
+                return
+
+            data = loads(payload)
+            if "error" in data:
+                raise LLMBackendError(f"{self.name} stream error: {data['error']}")
+            if data.get("usage"):
+                tokens_used = data["usage"].get("total_tokens")
+            choices = data.get("choices")
+            if choices:
+                content = (choices[0].get("delta") or {}).get("content")
+                if content:
+                    yield StreamChunk(content=content, done=False)
+
+        raise httpx.RemoteProtocolError(f"{self.name} stream ended before [DONE]")
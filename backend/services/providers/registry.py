@@ -0,0 +1,49 @@
+from typing import Dict, Iterable
+import logging
+
+from services.providers.base import LLMProvider
+from services.providers.ollama import OllamaProvider
+from services.providers.openai_compatible import OpenAICompatibleProvider
+from services.providers.vllm import VLLMProvider
+from services.resilience import LLMBackendError
+
+logger = logging.getLogger(__name__)
+
+class ProviderRegistry:
+    """Inference providers by name, as referenced by a model's ``provider`` field"""
+
+    def __init__(self):
+        self._providers: Dict[str, LLMProvider] = {}
+
+    def register(self, provider: LLMProvider) -> LLMProvider:
+        self._providers[provider.name] = provider
+        return provider
+
+    def get(self, name: str) -> LLMProvider:
+        provider = self._providers.get(name)
+        if provider is None:
+            raise LLMBackendError(f"Unknown LLM provider: {name}")
+        return provider
+
+    async def start(self, replicas: Iterable):
+        """Open clients for the given replicas (called from app lifespan)"""
+        endpoints = {(replica.provider, replica.endpoint) for replica in replicas}
+        for provider, endpoint in endpoints:
+            self.get(provider).client(endpoint)
+        logger.info(f"LLM client pools started: {len(endpoints)} endpoints")
+
+    async def close(self):
+        for provider in self._providers.values():
+            await provider.close()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Connection pool metrics for every provider endpoint"""
+        stats = {}
+        for provider in self._providers.values():
+            stats.update(provider.pool_stats())
+        return stats
+
+providers = ProviderRegistry()
+providers.register(VLLMProvider())
+providers.register(OllamaProvider())
+providers.register(OpenAICompatibleProvider())
@@ -0,0 +1,20 @@
+from typing import Dict, Tuple
+
+from core.config import settings
+from services.providers.openai_compatible import OpenAICompatibleProvider
+
+class VLLMProvider(OpenAICompatibleProvider):
+    """vLLM's OpenAI-compatible server"""
+
+    name = "vllm"
+
+    @property
+    def default_endpoint(self) -> str:
+        return settings.VLLM_ENDPOINT
+
+    @property
+    def timeouts(self) -> Tuple[float, float]:
+        return settings.VLLM_CONNECT_TIMEOUT, settings.VLLM_READ_TIMEOUT
+
+    def headers(self) -> Dict[str, str]:
+        return {}
@@ -0,0 +1,270 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import logging
+import math
+import time
+from datetime import datetime, timedelta, timezone
+
+from redis.exceptions import NoScriptError, RedisError
+
+from core.cache import TTLCache
+from core.config import settings
+from core.database import get_async_redis
+from services.runtime_config import runtime_config
+
+logger = logging.getLogger(__name__)
+
+# GCRA request limit plus daily token budget for every scope, all or nothing.
+# KEYS: request key and token key per scope.
+# ARGV: emission interval (ms), burst and token limit per scope (0 disables).
+# Returns {allowed, retry_after_ms, remaining, denied_scope, reset_ms}.
+_ACQUIRE_SCRIPT = """
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local new_tats = {}
+local remaining, reset = -1, 0
+for i = 1, #KEYS / 2 do
+    local interval = tonumber(ARGV[i * 3 - 2])
+    local burst = tonumber(ARGV[i * 3 - 1])
+    local token_limit = tonumber(ARGV[i * 3])
+    if token_limit > 0 and tonumber(redis.call("GET", KEYS[i * 2]) or "0") >= token_limit then
+        return {0, -1, 0, i, 0}
+    end
+    if interval > 0 then
+        local tat = math.max(tonumber(redis.call("GET", KEYS[i * 2 - 1]) or "0"), now)
+        local allow_at = tat + interval - interval * burst
+        if allow_at > now then
+            return {0, allow_at - now, 0, i, tat - now}
+        end
+        new_tats[i] = tat + interval
+        local left = math.floor((now - allow_at) / interval)
+        if remaining < 0 or left < remaining then
+            remaining, reset = left, new_tats[i] - now
+        end
+    end
+end
+for i, new_tat in pairs(new_tats) do
+    redis.call("SET", KEYS[i * 2 - 1], new_tat, "PX", new_tat - now)
+end
+return {1, 0, remaining, 0, reset}
+"""
+
+# Add actual usage to each token key, starting its expiry on first use of the day
+_DEBIT_SCRIPT = """
+local totals = {}
+for i, key in ipairs(KEYS) do
+    totals[i] = redis.call("INCRBY", key, ARGV[1])
+    if totals[i] == tonumber(ARGV[1]) then
+        redis.call("EXPIRE", key, ARGV[2])
+    end
+end
+return totals
+"""
+
+class RateLimit(NamedTuple):
+    requests_per_minute: int
+    tokens_per_day: int
+    burst: int
+
+    @property
+    def interval_ms(self) -> int:
+        return 60000 // self.requests_per_minute if self.requests_per_minute > 0 else 0
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_seconds: float
+    retry_after: float = 0.0
+    reason: str = ""
+
+    def headers(self) -> Dict[str, str]:
+        """``X-RateLimit-*`` (and, when denied, ``Retry-After``) response headers"""
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(max(self.remaining, 0)),
+            "X-RateLimit-Reset": str(int(time.time() + self.reset_seconds))
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(math.ceil(self.retry_after), 1))
+        return headers
+
+def _seconds_until_midnight() -> float:
+    now = datetime.now(timezone.utc)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight - now).total_seconds()
+
+class RateLimiter:
+    """Per-user request rate and daily token limits shared through Redis.
+
+    Requests are limited with GCRA (one timestamp per key, smooth refill
+    with a burst allowance) and tokens with a per-day counter that is
+    debited with each response's actual ``tokens_used``; both run as Lua
+    scripts so every worker sees one atomic count. Models listed in
+    ``RATE_LIMIT_MODEL_OVERRIDES`` get a second, per-user-per-model scope.
+
+    Each worker mirrors the counts it has seen and remembers denials, so a
+    client that is over its limit is rejected without a Redis round trip.
+    If Redis is unavailable the local counts are used alone.
+    """
+
+    prefix = "ratelimit"
+
+    def __init__(self, redis=None):
+        self._redis = redis
+        self._shas: Dict[str, str] = {}
+        self._local_tats = TTLCache(maxsize=settings.RATE_LIMIT_LOCAL_KEYS, ttl=60.0)
+        self._denied = TTLCache(maxsize=settings.RATE_LIMIT_LOCAL_KEYS, ttl=60.0)
+        self.allowed = 0
+        self.local_rejections = 0
+        self.redis_rejections = 0
+        self.redis_errors = 0
+
+    @property
+    def redis(self):
+        return self._redis if self._redis is not None else get_async_redis()
+
+    def limit_for(self, user_id: int, model: Optional[str] = None) -> Optional[RateLimit]:
+        """A user's limit (defaults or their override), or a model's if it has one"""
+        if model is not None:
+            override = settings.RATE_LIMIT_MODEL_OVERRIDES.get(model)
+            if override is None:
+                return None
+        else:
+            override = settings.RATE_LIMIT_USER_OVERRIDES.get(str(user_id), {})
+        defaults = runtime_config.snapshot.rate_limits
+        requests_per_minute = int(override.get("requests_per_minute", defaults["requests_per_minute"]))
+        return RateLimit(
+            requests_per_minute=requests_per_minute,
+            tokens_per_day=int(override.get("tokens_per_day", defaults["tokens_per_day"])),
+            burst=int(override.get("burst", settings.RATE_LIMIT_BURST or requests_per_minute))
+        )
+
+    def _scopes(self, user_id: int, model: str) -> List[Tuple[str, RateLimit]]:
+        scopes = [(f"user:{user_id}", self.limit_for(user_id))]
+        model_limit = self.limit_for(user_id, model)
+        if model_limit is not None:
+            scopes.append((f"user:{user_id}:model:{model}", model_limit))
+        return scopes
+
+    def _token_key(self, scope: str) -> str:
+        return f"{self.prefix}:tokens:{scope}:{datetime.now(timezone.utc):%Y%m%d}"
+
+    def _local_check(self, scopes: List[Tuple[str, RateLimit]]) -> Optional[RateLimitResult]:
+        """Reject locally when a scope was denied recently or this worker alone is over the limit.
+
+        A worker sees a subset of a user's requests, so exceeding the limit
+        locally means the shared count is over it too.
+        """
+        now = time.monotonic() * 1000
+        for scope, limit in scopes:
+            denied = self._denied.get(scope)
+            if denied is not None and denied[0] > now:
+                retry_after = (denied[0] - now) / 1000
+                return RateLimitResult(False, denied[2], 0, retry_after, retry_after, denied[1])
+            if limit.interval_ms:
+                tat = max(self._local_tats.get(scope) or 0, now)
+                allow_at = tat + limit.interval_ms - limit.interval_ms * limit.burst
+                if allow_at > now:
+                    retry_after = (allow_at - now) / 1000
+                    return RateLimitResult(
+                        False, limit.requests_per_minute, 0, retry_after, retry_after, "requests_per_minute"
+                    )
+        return None
+
+    def _local_commit(self, scopes: List[Tuple[str, RateLimit]]) -> RateLimitResult:
+        now = time.monotonic() * 1000
+        remaining, reset, limit_value = -1, 0.0, scopes[0][1].requests_per_minute
+        for scope, limit in scopes:
+            if not limit.interval_ms:
+                continue
+            tat = max(self._local_tats.get(scope) or 0, now) + limit.interval_ms
+            self._local_tats.set(scope, tat, ttl=(tat - now) / 1000)
+            left = int((now - (tat - limit.interval_ms * limit.burst)) // limit.interval_ms)
+            if remaining < 0 or left < remaining:
+                remaining, reset, limit_value = left, (tat - now) / 1000, limit.requests_per_minute
+        return RateLimitResult(True, limit_value, remaining, reset)
+
+    def _deny_locally(self, scope: str, seconds: float, reason: str, limit: int):
+        seconds = min(seconds, settings.RATE_LIMIT_LOCAL_DENY_SECONDS)
+        self._denied.set(scope, (time.monotonic() * 1000 + seconds * 1000, reason, limit), ttl=seconds)
+
+    async def _run(self, script: str, keys: List[str], args: List[Any]):
+        sha = self._shas.get(script)
+        if sha is not None:
+            try:
+                return await self.redis.evalsha(sha, len(keys), *keys, *args)
+            except NoScriptError:
+                pass
+        self._shas[script] = await self.redis.script_load(script)
+        return await self.redis.evalsha(self._shas[script], len(keys), *keys, *args)
+
+    async def acquire(self, user_id: int, model: str) -> RateLimitResult:
+        """Take one request from the user's limits, or say how long to wait"""
+        if not settings.RATE_LIMIT_ENABLED:
+            return RateLimitResult(True, 0, 0, 0.0)
+
+        scopes = self._scopes(user_id, model)
+        denied = self._local_check(scopes)
+        if denied is not None:
+            self.local_rejections += 1
+            return denied
+
+        keys, args = [], []
+        for scope, limit in scopes:
+            keys += [f"{self.prefix}:requests:{scope}", self._token_key(scope)]
+            args += [limit.interval_ms, limit.burst, limit.tokens_per_day]
+        try:
+            allowed, retry_after_ms, remaining, denied_scope, reset_ms = await self._run(_ACQUIRE_SCRIPT, keys, args)
+        except RedisError as e:
+            self.redis_errors += 1
+            logger.warning(f"Rate limit check failed, using local limits: {e}")
+            self.allowed += 1
+            return self._local_commit(scopes)
+
+        if not allowed:
+            self.redis_rejections += 1
+            scope, limit = scopes[denied_scope - 1]
+            if retry_after_ms < 0:
+                # Token budget spent; it resets at midnight UTC
+                retry_after = _seconds_until_midnight()
+                self._deny_locally(scope, retry_after, "tokens_per_day", limit.tokens_per_day)
+                return RateLimitResult(False, limit.tokens_per_day, 0, retry_after, retry_after, "tokens_per_day")
+            self._deny_locally(scope, retry_after_ms / 1000, "requests_per_minute", limit.requests_per_minute)
+            return RateLimitResult(
+                False, limit.requests_per_minute, 0, reset_ms / 1000, retry_after_ms / 1000, "requests_per_minute"
+            )
+
+        self.allowed += 1
+        local = self._local_commit(scopes)
+        return RateLimitResult(True, local.limit, remaining, reset_ms / 1000)
+
+    async def debit(self, user_id: int, model: str, tokens: int):
+        """Charge a finished request's actual token usage to the user's daily budgets"""
+        if not settings.RATE_LIMIT_ENABLED or tokens <= 0:
+            return
+        scopes = self._scopes(user_id, model)
+        try:
+            totals = await self._run(
+                _DEBIT_SCRIPT,
+                [self._token_key(scope) for scope, _ in scopes],
+                [tokens, 2 * 86400]
+            )
+        except RedisError as e:
+            self.redis_errors += 1
+            logger.warning(f"Token budget debit failed for user {user_id}: {e}")
+            return
+        for (scope, limit), total in zip(scopes, totals):
+            if limit.tokens_per_day and total >= limit.tokens_per_day:
+                self._deny_locally(scope, _seconds_until_midnight(), "tokens_per_day", limit.tokens_per_day)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.RATE_LIMIT_ENABLED,
+            "allowed": self.allowed,
+            "local_rejections": self.local_rejections,
+            "redis_rejections": self.redis_rejections,
+            "redis_errors": self.redis_errors,
+            "tracked_keys": len(self._local_tats)
+        }
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,233 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import json
+import logging
+import time
+
+import httpx
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class LLMBackendError(Exception):
+    """No backend in the model's fallback chain could serve the request"""
+
+class BackendRejectedRequest(Exception):
+    """The backend refused the request itself (a 4xx other than 429).
+
+    Another attempt, replica or fallback model would get the same answer,
+    so it is reported to the client instead.
+    """
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"Model backend rejected the request ({status_code}): {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+    @property
+    def client_fault(self) -> bool:
+        """Whether the client's input was at fault (bad parameters, prompt too long)"""
+        return self.status_code in (400, 413, 422)
+
+def rejection(error: BaseException) -> Optional[BackendRejectedRequest]:
+    """The error as a ``BackendRejectedRequest``, None if it is a backend fault or not a backend answer"""
+    if isinstance(error, BackendRejectedRequest):
+        return error
+    if isinstance(error, httpx.HTTPStatusError) and not is_retryable(error):
+        return BackendRejectedRequest(error.response.status_code, error.response.text[:500])
+    return None
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed call is the replica's fault (worth retrying elsewhere)"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status >= 500 or status == 429
+    return isinstance(error, (httpx.TransportError, json.JSONDecodeError, KeyError))
+
+class CircuitBreaker:
+    """Per-replica circuit breaker with half-open probing.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and the
+    replica gets no traffic for ``reset_timeout`` seconds. Then up to
+    ``half_open_probes`` requests are let through; a success closes the
+    circuit, a failure opens it again. Probe slots are reserved with
+    ``acquire`` when the replica is selected, so concurrent requests cannot
+    all slip through a recovering circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, half_open_probes: int = 1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probed_at = 0.0
+        self.probes_in_flight = 0
+        self.times_opened = 0
+
+    def _probes_stale(self, now: float) -> bool:
+        # A probe that never reported back (cancelled before it was sent) frees its slot eventually
+        return now - self.probed_at >= self.reset_timeout
+
+    def available(self) -> bool:
+        """Whether ``acquire`` would succeed now (does not change state)"""
+        now = time.monotonic()
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return now - self.opened_at >= self.reset_timeout
+        return self.probes_in_flight < self.half_open_probes or self._probes_stale(now)
+
+    def acquire(self) -> bool:
+        """Reserve the replica for one request.
+
+        An open circuit whose timeout has passed turns half-open here, and
+        a half-open circuit hands out at most ``half_open_probes`` slots;
+        False means the request must go elsewhere. A reserved probe is
+        settled by ``record_success``/``record_failure`` or given back
+        with ``release``.
+        """
+        now = time.monotonic()
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self.probes_in_flight = 0
+        elif self.probes_in_flight >= self.half_open_probes:
+            if not self._probes_stale(now):
+                return False
+            self.probes_in_flight = 0
+        self.probes_in_flight += 1
+        self.probed_at = now
+        return True
+
+    def release(self):
+        """Give back a reservation that ended without a verdict (e.g. cancelled hedge, never sent)"""
+        if self.state == self.HALF_OPEN and self.probes_in_flight:
+            self.probes_in_flight -= 1
+
+    def record_success(self):
+        self.failures = 0
+        self.probes_in_flight = 0
+        self.state = self.CLOSED
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.probes_in_flight = 0
+
+class RetryBudget:
+    """Caps retries and hedges to a fraction of regular traffic.
+
+    Every request deposits ``ratio`` tokens and every retry or hedge spends
+    one, with a small per-second floor so low-traffic workers can still retry.
+    This keeps retries from multiplying load on a struggling backend.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, max_tokens: float = 100.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._refilled_at = time.monotonic()
+        self.retries = 0
+        self.exhausted = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self._refilled_at) * self.min_per_second)
+        self._refilled_at = now
+
+    def record_request(self):
+        self._refill()
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """Take one retry token if available"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.retries += 1
+            return True
+        self.exhausted += 1
+        return False
+
+class Hedger:
+    """Races a backup request against a slow primary"""
+
+    def __init__(self):
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    async def run(
+        self,
+        primary: Callable[[], Awaitable[Any]],
+        backup: Optional[Callable[[], Optional[Awaitable[Any]]]],
+        delay: Optional[float]
+    ) -> Any:
+        """Start ``primary``; if it is not done after ``delay`` seconds start
+        ``backup`` too. The first successful result wins and the other call is
+        cancelled; if one fails, the other is still awaited.
+
+        ``backup`` is called only when the hedge fires and may return None to
+        skip hedging (no spare target or no retry budget left).
+        """
+        primary_task = asyncio.ensure_future(primary())
+        if backup is None:
+            return await primary_task
+
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=delay)
+        except asyncio.CancelledError:
+            primary_task.cancel()
+            raise
+        if done:
+            return primary_task.result()
+
+        backup_call = backup()
+        if backup_call is None:
+            return await primary_task
+
+        self.hedges += 1
+        backup_task = asyncio.ensure_future(backup_call)
+        pending = {primary_task, backup_task}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup_task:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+                    logger.warning(f"Hedged call failed: {error!r}")
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+retry_budget = RetryBudget(settings.LLM_RETRY_BUDGET_RATIO, settings.LLM_RETRY_MIN_PER_SECOND)
+hedger = Hedger()
+
+def resilience_stats() -> Dict[str, Any]:
+    """Retry budget and hedging counters"""
+    return {
+        "retry_budget_tokens": round(retry_budget.tokens, 2),
+        "retries": retry_budget.retries,
+        "retry_budget_exhausted": retry_budget.exhausted,
+        "hedges": hedger.hedges,
+        "hedge_wins": hedger.hedge_wins
+    }
@@ -0,0 +1,253 @@
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Tuple
+import hashlib
+import json
+import logging
+import math
+import re
+
+from redis.exceptions import RedisError
+
+from core.config import settings
+from core.database import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+Vector = Dict[int, float]
+
+def _normalize_content(content: str) -> str:
+    """Normalize line endings and trailing/leading whitespace"""
+    lines = content.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+def canonicalize_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Canonical form of a chat history for cache keys.
+
+    Only ``role`` and ``content`` are kept, roles are lower-cased, content
+    whitespace is normalized and empty system prompts are dropped.
+    """
+    canonical = []
+    for message in messages:
+        role = str(message.get("role", "")).strip().lower()
+        content = _normalize_content(str(message.get("content") or ""))
+        if role == "system" and not content:
+            continue
+        canonical.append({"role": role, "content": content})
+    return canonical
+
+def canonicalize_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Canonical form of generation parameters (every parameter is part of the key)"""
+    canonical = {}
+    for name, value in sorted(params.items()):
+        if value is None:
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = round(float(value), 6)  # 0 and 0.0 must share a key
+        canonical[name] = value
+    return canonical
+
+def _digest(payload: Any) -> str:
+    data = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+def hashed_embedding(text: str, dimensions: int = 4096) -> Vector:
+    """Cheap local embedding: feature-hashed word unigrams and bigrams"""
+    words = re.findall(r"\w+", text.lower())
+    vector: Vector = {}
+    for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        bucket = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big") % dimensions
+        vector[bucket] = vector.get(bucket, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {k: v / norm for k, v in vector.items()} if norm else {}
+
+def cosine_similarity(a: Vector, b: Vector) -> float:
+    """Cosine similarity of two unit-normalized sparse vectors"""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+class SemanticIndex:
+    """Local vector index of cached prompts.
+
+    Only the final turn of a prompt is embedded. Entries are bucketed by model,
+    generation parameters and the exact conversation before that turn, so a
+    similarity hit never crosses models, settings or contexts. Each bucket is
+    a bounded LRU that is scanned linearly, which is fine for the few thousand
+    entries kept per worker.
+    """
+
+    def __init__(self, embedder: Callable[[str], Vector], threshold: float, max_entries: int):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._buckets: Dict[str, "OrderedDict[str, Vector]"] = {}
+
+    def add(self, bucket: str, text: str, cache_key: str):
+        """Index a cached prompt's final turn"""
+        entries = self._buckets.setdefault(bucket, OrderedDict())
+        entries[cache_key] = self.embedder(text)
+        entries.move_to_end(cache_key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def search(self, bucket: str, text: str) -> Optional[Tuple[str, float]]:
+        """Best cached key above the similarity threshold"""
+        entries = self._buckets.get(bucket)
+        if not entries:
+            return None
+        query = self.embedder(text)
+        best_key, best_score = None, self.threshold
+        for cache_key, vector in entries.items():
+            score = cosine_similarity(query, vector)
+            if score >= best_score:
+                best_key, best_score = cache_key, score
+        return (best_key, best_score) if best_key else None
+
+    def remove(self, bucket: str, cache_key: str):
+        """Forget an entry whose cached response expired"""
+        entries = self._buckets.get(bucket)
+        if entries:
+            entries.pop(cache_key, None)
+
+class ResponseCache:
+    """Completion cache keyed on canonicalized requests.
+
+    Exact matches are stored in Redis (or any client with async ``get`` and
+    ``setex``); an optional in-process semantic tier maps near-identical prompts
+    onto an existing exact entry.
+    """
+
+    prefix = "llm_cache"
+
+    def __init__(self, redis=None, semantic_index: Optional[SemanticIndex] = None):
+        self._redis = redis
+        self.semantic_index = semantic_index
+        self.hits = 0
+        self.similarity_hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.errors = 0
+
+    @property
+    def redis(self):
+        return self._redis if self._redis is not None else get_async_redis()
+
+    def is_cacheable(self, params: Dict[str, Any], cache: Optional[bool] = None) -> bool:
+        """Sampled (temperature > 0) completions are only cached when opted in"""
+        if cache is not None:
+            return cache
+        return (params.get("temperature") or 0) <= 0 or settings.LLM_CACHE_NONZERO_TEMPERATURE
+
+    def ttl_for(self, model: str) -> int:
+        """Per-model TTL policy"""
+        return settings.LLM_CACHE_MODEL_TTLS.get(model, settings.LLM_CACHE_DEFAULT_TTL)
+
+    def key_for(self, model: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+        """Cache key over the model, canonical messages and every generation parameter"""
+        payload = {
+            "model": model,
+            "messages": canonicalize_messages(messages),
+            "params": canonicalize_params(params)
+        }
+        return f"{self.prefix}:{_digest(payload)}"
+
+    def _semantic_key(self, model: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> Tuple[str, str]:
+        """Semantic index bucket and the text to embed: the final turn, with everything before it hashed into the bucket"""
+        canonical = canonicalize_messages(messages)
+        final = canonical[-1] if canonical else {"role": "", "content": ""}
+        bucket = _digest({
+            "model": model,
+            "params": canonicalize_params(params),
+            "context": canonical[:-1],
+            "role": final["role"]
+        })
+        return bucket, final["content"]
+
+    async def get(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        params: Dict[str, Any],
+        cache: Optional[bool] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Look up a cached completion (exact, then semantic)"""
+        if not self.is_cacheable(params, cache):
+            self.skipped += 1
+            return None
+
+        try:
+            cached = await self.redis.get(self.key_for(model, messages, params))
+            if cached:
+                self.hits += 1
+                return json.loads(cached)
+
+            if self.semantic_index is not None:
+                bucket, text = self._semantic_key(model, messages, params)
+                match = self.semantic_index.search(bucket, text)
+                if match:
+                    cache_key, score = match
+                    cached = await self.redis.get(cache_key)
+                    if cached:
+                        self.similarity_hits += 1
+                        logger.debug(f"Semantic cache hit for {model} (similarity {score:.3f})")
+                        return json.loads(cached)
+                    self.semantic_index.remove(bucket, cache_key)
+        except RedisError as e:
+            self.errors += 1
+            logger.warning(f"LLM cache read failed: {e}")
+
+        self.misses += 1
+        return None
+
+    async def peek(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Exact lookup by key, without touching the hit/miss counters"""
+        try:
+            cached = await self.redis.get(cache_key)
+        except RedisError as e:
+            logger.warning(f"LLM cache read failed: {e}")
+            return None
+        return json.loads(cached) if cached else None
+
+    async def set(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        params: Dict[str, Any],
+        response: Dict[str, Any],
+        cache: Optional[bool] = None
+    ):
+        """Store a completion under its canonical key"""
+        if not self.is_cacheable(params, cache):
+            return
+
+        cache_key = self.key_for(model, messages, params)
+        try:
+            await self.redis.setex(cache_key, self.ttl_for(model), json.dumps(response))
+        except RedisError as e:
+            self.errors += 1
+            logger.warning(f"LLM cache write failed: {e}")
+            return
+
+        if self.semantic_index is not None:
+            bucket, text = self._semantic_key(model, messages, params)
+            self.semantic_index.add(bucket, text, cache_key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss/similarity-hit counters"""
+        lookups = self.hits + self.similarity_hits + self.misses
+        return {
+            "hits": self.hits,
+            "similarity_hits": self.similarity_hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "hit_rate": round((self.hits + self.similarity_hits) / lookups, 4) if lookups else 0.0
+        }
+
+response_cache = ResponseCache(
+    semantic_index=SemanticIndex(
+        embedder=hashed_embedding,
+        threshold=settings.LLM_SEMANTIC_CACHE_THRESHOLD,
+        max_entries=settings.LLM_SEMANTIC_CACHE_MAX_ENTRIES
+    ) if settings.LLM_SEMANTIC_CACHE_ENABLED else None
+)
@@ -0,0 +1,230 @@
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, NamedTuple, Optional
+import asyncio
+import logging
+import time
+
+from redis.exceptions import RedisError
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+from core.database import AsyncSessionLocal, get_async_redis
+from core.serialization import dumps, loads
+from models.runtime_config import PageContent, RuntimeConfig
+
+logger = logging.getLogger(__name__)
+
+# SystemConfig.rate_limits keys and the environment settings that provide their defaults
+RATE_LIMIT_SETTINGS = {
+    "requests_per_minute": "RATE_LIMIT_REQUESTS_PER_MINUTE",
+    "tokens_per_day": "RATE_LIMIT_TOKENS_PER_DAY",
+    "backend_concurrency": "SCHEDULER_BACKEND_CONCURRENCY",
+    "max_queue": "SCHEDULER_MAX_QUEUE",
+    "interactive_weight": "SCHEDULER_INTERACTIVE_WEIGHT",
+    "batch_weight": "SCHEDULER_BATCH_WEIGHT",
+    "interactive_max_wait_ms": "SCHEDULER_INTERACTIVE_MAX_WAIT_MS",
+    "batch_max_wait_ms": "SCHEDULER_BATCH_MAX_WAIT_MS"
+}
+
+# Built-in defaults, used until an admin saves the config (rate limits from the environment)
+DEFAULT_CONFIG = {
+    "feature_flags": {
+        "chat_enabled": True,
+        "api_enabled": True,
+        "streaming_enabled": True,
+        "file_upload_enabled": True
+    },
+    "default_model": settings.DEFAULT_MODEL,
+    "rate_limits": {key: getattr(settings, name) for key, name in RATE_LIMIT_SETTINGS.items()},
+    "maintenance_mode": False
+}
+
+class ConfigConflict(Exception):
+    """The config changed since the version the update was based on"""
+
+class ConfigSnapshot(NamedTuple):
+    """One version of the runtime config and CMS content (never modified once built)"""
+    version: int
+    feature_flags: Mapping[str, bool]
+    default_model: str
+    rate_limits: Mapping[str, int]
+    maintenance_mode: bool
+    content: Mapping[str, Mapping[str, Any]]  # page -> section -> content
+
+    @classmethod
+    def build(cls, version: int, data: Optional[Dict[str, Any]], content: Dict[str, Dict[str, Any]]) -> "ConfigSnapshot":
+        data = data or {}
+        return cls(
+            version=version,
+            feature_flags=MappingProxyType({**DEFAULT_CONFIG["feature_flags"], **data.get("feature_flags", {})}),
+            default_model=data.get("default_model", DEFAULT_CONFIG["default_model"]),
+            rate_limits=MappingProxyType({**DEFAULT_CONFIG["rate_limits"], **data.get("rate_limits", {})}),
+            maintenance_mode=data.get("maintenance_mode", DEFAULT_CONFIG["maintenance_mode"]),
+            content=MappingProxyType({page: MappingProxyType(sections) for page, sections in content.items()})
+        )
+
+    def as_dict(self) -> Dict[str, Any]:
+        """The config part as plain data (the SystemConfig shape)"""
+        return {
+            "version": self.version,
+            "feature_flags": dict(self.feature_flags),
+            "default_model": self.default_model,
+            "rate_limits": dict(self.rate_limits),
+            "maintenance_mode": self.maintenance_mode
+        }
+
+class RuntimeConfigStore:
+    """Admin-editable config and CMS content, served from an in-memory snapshot.
+
+    Requests read ``snapshot`` (or the ``maintenance_mode`` and
+    ``default_model`` shortcuts) without any I/O; rate limits and scheduler
+    limits come from ``snapshot.rate_limits``, while ``settings`` keeps the
+    environment defaults. Changes are written to
+    the database under a new version and announced on a Redis channel;
+    every worker then loads the new version and swaps in a fresh snapshot
+    in one assignment. Workers also poll the version every
+    ``CONFIG_POLL_INTERVAL_SECONDS``, so they catch up when a notification
+    is missed or Redis is down.
+    """
+
+    channel = "config:changed"
+
+    def __init__(self, redis=None):
+        self._redis = redis
+        self._lock = asyncio.Lock()
+        self._watcher: Optional[asyncio.Task] = None
+        self._swap(ConfigSnapshot.build(0, None, {}))
+        self.reloads = 0
+        self.notifications = 0
+
+    @property
+    def redis(self):
+        return self._redis if self._redis is not None else get_async_redis()
+
+    def _swap(self, snapshot: ConfigSnapshot):
+        self.snapshot = snapshot
+        self.maintenance_mode = snapshot.maintenance_mode
+        self.default_model = snapshot.default_model
+
+    async def start(self):
+        """Load the current config and start following changes (called on startup)"""
+        await self.refresh()
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+
+    async def refresh(self):
+        """Swap in the stored config if its version is newer than the snapshot's"""
+        async with self._lock:
+            async with AsyncSessionLocal() as db:
+                row = (await db.execute(
+                    select(RuntimeConfig.version, RuntimeConfig.data).where(RuntimeConfig.id == 1)
+                )).first()
+                if row is None or row.version <= self.snapshot.version:
+                    return
+                result = await db.execute(select(PageContent.page, PageContent.section, PageContent.content))
+                content: Dict[str, Dict[str, Any]] = {}
+                for page, section, value in result:
+                    content.setdefault(page, {})[section] = loads(value)
+            self._swap(ConfigSnapshot.build(row.version, loads(row.data) if row.data else None, content))
+            self.reloads += 1
+            logger.info(f"Runtime config version {row.version} loaded")
+
+    async def _watch(self):
+        """Reload on change notifications, and poll the version as a fallback"""
+        pubsub = None
+        polled = time.monotonic()
+        while True:
+            message = None
+            try:
+                if pubsub is None:
+                    pubsub = self.redis.pubsub()
+                    await pubsub.subscribe(self.channel)
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except (RedisError, OSError) as e:
+                logger.warning(f"Config change notifications unavailable, polling instead: {e}")
+                if pubsub is not None:
+                    await pubsub.aclose()
+                    pubsub = None
+                await asyncio.sleep(settings.CONFIG_POLL_INTERVAL_SECONDS)
+
+            if message is not None:
+                self.notifications += 1
+                if int(message["data"]) <= self.snapshot.version:
+                    continue
+            elif time.monotonic() - polled < settings.CONFIG_POLL_INTERVAL_SECONDS:
+                continue
+            polled = time.monotonic()
+            try:
+                await self.refresh()
+            except SQLAlchemyError as e:
+                logger.warning(f"Failed to reload runtime config: {e}")
+
+    async def _bump_version(self, db: AsyncSession, expected: Optional[int] = None, **values) -> int:
+        """Take the next config version (locking the config row until commit)"""
+        query = update(RuntimeConfig).where(RuntimeConfig.id == 1)
+        if expected is not None:
+            query = query.where(RuntimeConfig.version == expected)
+        result = await db.execute(query.values(version=RuntimeConfig.version + 1, **values))
+        if result.rowcount == 0:
+            raise ConfigConflict(f"Configuration changed since version {expected}")
+        return (await db.execute(select(RuntimeConfig.version).where(RuntimeConfig.id == 1))).scalar_one()
+
+    async def update_config(
+        self,
+        db: AsyncSession,
+        config: Dict[str, Any],
+        updated_by: str,
+        expected_version: Optional[int] = None
+    ) -> ConfigSnapshot:
+        """Store a new config; ``expected_version`` rejects the update if someone else changed it first"""
+        version = await self._bump_version(db, expected_version, data=dumps(config).decode(), updated_by=updated_by)
+        await db.commit()
+        return await self._changed(version)
+
+    async def update_content(
+        self,
+        db: AsyncSession,
+        page: str,
+        section: str,
+        content: Dict[str, Any],
+        updated_by: str
+    ) -> ConfigSnapshot:
+        """Store a page section's content under a new config version"""
+        version = await self._bump_version(db)
+        result = await db.execute(
+            update(PageContent)
+            .where(PageContent.page == page, PageContent.section == section)
+            .values(content=dumps(content).decode(), version=version, updated_by=updated_by)
+        )
+        if result.rowcount == 0:
+            db.add(PageContent(
+                page=page, section=section, content=dumps(content).decode(), version=version, updated_by=updated_by
+            ))
+        await db.commit()
+        return await self._changed(version)
+
+    async def _changed(self, version: int) -> ConfigSnapshot:
+        """Apply a committed change here and tell the other workers"""
+        await self.refresh()
+        try:
+            await self.redis.publish(self.channel, version)
+        except RedisError as e:
+            logger.warning(f"Failed to announce config version {version}, workers will poll for it: {e}")
+        return self.snapshot
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.snapshot.version,
+            "reloads": self.reloads,
+            "notifications": self.notifications,
+            "watching": self._watcher is not None and not self._watcher.done()
+        }
+
+runtime_config = RuntimeConfigStore()
@@ -0,0 +1,265 @@
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from core.config import settings
+from core.metrics import WindowedSketch
+from services.model_registry import model_registry
+from services.resilience import LLMBackendError
+from services.runtime_config import runtime_config
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+_sequence = itertools.count()  # FIFO among equal tags
+
+class Overloaded(LLMBackendError):
+    """A request was shed because it could not start before its deadline"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class Ticket(NamedTuple):
+    """Who a backend request is for and how urgent it is"""
+    user_id: Optional[int] = None
+    priority: str = INTERACTIVE
+    deadline: Optional[float] = None  # time.monotonic() by which it must have started
+
+def request_cost(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    """Work a request asks of a backend, in (estimated) tokens"""
+    return max_tokens + sum(len(message["content"]) for message in messages) // 4
+
+class _Waiter:
+    __slots__ = ("future", "cost")
+
+    def __init__(self, future: asyncio.Future, cost: int):
+        self.future = future
+        self.cost = cost
+
+class _FairQueue:
+    """Start-time fair queue with one flow per user"""
+
+    def __init__(self):
+        self.heap: List[Tuple[float, int, _Waiter]] = []
+        self.virtual_time = 0.0
+        self._finish: Dict[Any, float] = {}
+        self._prune_at = 1024
+
+    def start(self, flow: Any) -> float:
+        """Start tag a flow's next request would get"""
+        return max(self.virtual_time, self._finish.get(flow, 0.0))
+
+    def tag(self, flow: Any, cost: int, weight: float) -> float:
+        """Start tag of a flow's next request; its finish tag advances by cost / weight"""
+        start = self.start(flow)
+        self._finish[flow] = start + cost / weight
+        if len(self._finish) > self._prune_at:
+            # Idle flows start at the virtual time anyway
+            self._finish = {flow: finish for flow, finish in self._finish.items() if finish > self.virtual_time}
+            self._prune_at = max(1024, 2 * len(self._finish))
+        return start
+
+    def refund(self, flow: Any, cost: int, weight: float):
+        """Take back the charge of a tagged request that never started"""
+        if flow in self._finish:
+            self._finish[flow] -= cost / weight
+
+    def head(self) -> Optional[_Waiter]:
+        while self.heap and self.heap[0][2].future.done():  # given up waiting
+            heapq.heappop(self.heap)
+        return self.heap[0][2] if self.heap else None
+
+    def ahead_of(self, start: float) -> int:
+        return sum(1 for tag, _, waiter in self.heap if tag <= start and not waiter.future.done())
+
+class _Pool:
+    """Slots and queues for one model's replicas"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.waiting = 0
+        self.queues = {priority: _FairQueue() for priority in PRIORITIES}
+        self.virtual_time = 0.0
+        self._class_finish = {priority: 0.0 for priority in PRIORITIES}
+        self.hold: Optional[float] = None  # moving average of seconds a slot is held
+
+    def charge(self, priority: str, cost: int):
+        """Advance the class-level fair queue for a request of ``priority`` being started"""
+        start = max(self.virtual_time, self._class_finish[priority])
+        self._class_finish[priority] = start + cost / _class_weight(priority)
+        self.virtual_time = start
+
+    def share(self, priority: str) -> float:
+        """Fraction of slots ``priority`` gets while the backlogged classes compete"""
+        backlogged = {p for p, queue in self.queues.items() if queue.head() is not None} | {priority}
+        return _class_weight(priority) / sum(_class_weight(p) for p in backlogged)
+
+    def next(self) -> Optional[_Waiter]:
+        """Pop the waiter to start next: class by weighted share, then user by fair share"""
+        best = None
+        for priority, queue in self.queues.items():
+            if queue.head() is not None:
+                start = max(self.virtual_time, self._class_finish[priority])
+                if best is None or start < best[0]:
+                    best = (start, priority)
+        if best is None:
+            return None
+        queue = self.queues[best[1]]
+        start, _, waiter = heapq.heappop(queue.heap)
+        queue.virtual_time = max(queue.virtual_time, start)
+        self.charge(best[1], waiter.cost)
+        return waiter
+
+    def released(self, held: float):
+        self.in_flight -= 1
+        self.hold = held if self.hold is None else 0.9 * self.hold + 0.1 * held
+
+def _class_weight(priority: str) -> float:
+    limits = runtime_config.snapshot.rate_limits
+    return max(limits["batch_weight"] if priority == BATCH else limits["interactive_weight"], 1)
+
+def _ms(seconds: Optional[float]) -> Optional[int]:
+    return int(seconds * 1000) if seconds is not None else None
+
+class AdmissionScheduler:
+    """Admission control in front of each model's inference replicas.
+
+    At most ``backend_concurrency`` (runtime config) requests per available
+    replica are in flight; the rest wait. Waiting requests are started by
+    weighted fair queuing at two levels: the interactive and batch classes
+    share the slots by their weights, and within a class each user gets a
+    share weighted by their tier, charged by the tokens a request may use.
+    A request that cannot start before its deadline (the class's maximum
+    wait), or is predicted not to from the queue ahead of it, is shed with
+    ``Overloaded`` rather than left to time out on the backend.
+    """
+
+    def __init__(self):
+        self._pools: Dict[str, _Pool] = {}
+        self.admitted = {priority: 0 for priority in PRIORITIES}
+        self.queued = {priority: 0 for priority in PRIORITIES}
+        self.shed = {"queue_full": 0, "predicted": 0, "deadline": 0}
+        self._wait = {priority: WindowedSketch(settings.LLM_LATENCY_WINDOW_SECONDS) for priority in PRIORITIES}
+
+    def tier_for(self, user_id: Optional[int]) -> str:
+        return settings.SCHEDULER_USER_TIERS.get(str(user_id), settings.SCHEDULER_DEFAULT_TIER)
+
+    def capacity(self, model: str) -> int:
+        """Slots for a model: the per-replica limit times its replicas taking traffic"""
+        available = sum(1 for replica in model_registry.get_replicas(model) if replica.breaker.available())
+        return runtime_config.snapshot.rate_limits["backend_concurrency"] * max(available, 1)
+
+    @asynccontextmanager
+    async def slot(self, model: str, ticket: Optional[Ticket], cost: int) -> AsyncIterator[None]:
+        """Hold one of the model's backend slots, waiting for it in fair order"""
+        if runtime_config.snapshot.rate_limits["backend_concurrency"] <= 0:
+            yield
+            return
+        pool = self._pools.get(model)
+        if pool is None:
+            pool = self._pools[model] = _Pool()
+        await self._acquire(model, pool, ticket or Ticket(), max(cost, 1))
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            pool.released(time.monotonic() - started)
+            self._dispatch(model, pool)
+
+    async def _acquire(self, model: str, pool: _Pool, ticket: Ticket, cost: int):
+        priority = ticket.priority if ticket.priority in PRIORITIES else INTERACTIVE
+        queue = pool.queues[priority]
+        weight = max(settings.SCHEDULER_TIER_WEIGHTS.get(self.tier_for(ticket.user_id), 1), 1)
+        enqueued = time.monotonic()
+
+        if not pool.waiting and pool.in_flight < self.capacity(model):
+            queue.virtual_time = queue.tag(ticket.user_id, cost, weight)
+            pool.charge(priority, cost)
+            pool.in_flight += 1
+            self._admit(priority, 0.0)
+            return
+        limits = runtime_config.snapshot.rate_limits
+        if pool.waiting >= limits["max_queue"]:
+            self._shed("queue_full", model, pool.hold or 1.0)
+
+        max_wait = (limits["batch_max_wait_ms"] if priority == BATCH else limits["interactive_max_wait_ms"]) / 1000
+        deadline = enqueued + max_wait
+        if ticket.deadline is not None:
+            deadline = min(deadline, ticket.deadline)
+
+        if pool.hold is not None:
+            # Requests ahead in this class, drained at the class's share of the slots
+            rate = self.capacity(model) * pool.share(priority) / pool.hold
+            expected = (queue.ahead_of(queue.start(ticket.user_id)) + 1) / rate
+            if enqueued + expected > deadline:
+                self._shed("predicted", model, expected)
+        start = queue.tag(ticket.user_id, cost, weight)
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), cost)
+        heapq.heappush(queue.heap, (start, next(_sequence), waiter))
+        pool.waiting += 1
+        self.queued[priority] += 1
+        self._dispatch(model, pool)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), max(deadline - enqueued, 0))
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                waiter.future.cancel()
+                pool.waiting -= 1
+                queue.refund(ticket.user_id, cost, weight)
+                self._shed("deadline", model, pool.hold or max_wait)
+        except asyncio.CancelledError:
+            if waiter.future.done():  # started just as the caller went away
+                pool.in_flight -= 1
+                self._dispatch(model, pool)
+            else:
+                waiter.future.cancel()
+                pool.waiting -= 1
+                queue.refund(ticket.user_id, cost, weight)
+            raise
+        self._admit(priority, time.monotonic() - enqueued)
+
+    def _dispatch(self, model: str, pool: _Pool):
+        """Start waiting requests while the model has free slots"""
+        capacity = self.capacity(model)
+        while pool.in_flight < capacity:
+            waiter = pool.next()
+            if waiter is None:
+                return
+            pool.waiting -= 1
+            pool.in_flight += 1
+            waiter.future.set_result(None)
+
+    def _admit(self, priority: str, waited: float):
+        self.admitted[priority] += 1
+        self._wait[priority].add(waited)
+
+    def _shed(self, reason: str, model: str, retry_after: float):
+        self.shed[reason] += 1
+        logger.warning(f"Shed request for {model}: {reason.replace('_', ' ')}")
+        raise Overloaded(f"Model {model} is overloaded, please retry shortly", retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        """Admission counters, queue times and per-model slot usage"""
+        return {
+            "backend_concurrency": runtime_config.snapshot.rate_limits["backend_concurrency"],
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+            "queue_time_p50_ms": {priority: _ms(sketch.quantile(0.5)) for priority, sketch in self._wait.items()},
+            "queue_time_p99_ms": {priority: _ms(sketch.quantile(0.99)) for priority, sketch in self._wait.items()},
+            "models": {
+                model: {"in_flight": pool.in_flight, "waiting": pool.waiting, "capacity": self.capacity(model)}
+                for model, pool in self._pools.items()
+            }
+        }
+
+admission_scheduler = AdmissionScheduler()
@@ -0,0 +1,352 @@
+from typing import Dict, Any, List, Optional, Callable, Awaitable, AsyncIterator
+import asyncio
+import json
+import logging
+import uuid
+
+from redis.exceptions import RedisError
+
+from core.config import settings
+from core.database import get_async_redis
+from services.streaming import stream_stats
+
+logger = logging.getLogger(__name__)
+
+# Delete the lock only if this caller still owns it
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+class StreamBroadcast:
+    """One upstream token stream fanned out to any number of readers.
+
+    Chunks are kept for the life of the stream so a reader that attaches late
+    replays what it missed before following live chunks. The producer may
+    run at most ``max_lag`` chunks ahead of the slowest reader; beyond that
+    it stops pulling from upstream, so slow readers push back on the
+    inference server instead of growing buffers.
+    """
+
+    def __init__(self, max_lag: int = 256):
+        self.chunks: List[Dict[str, Any]] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.max_lag = max_lag
+        self._changed = asyncio.Event()
+        self._positions: Dict[int, int] = {}
+        self._next_reader = 0
+        self._drained: Optional[asyncio.Event] = None
+
+    def publish(self, chunk: Dict[str, Any]):
+        self.chunks.append(chunk)
+        self._notify()
+
+    async def wait_for_readers(self):
+        """Block the producer while the slowest reader lags ``max_lag`` chunks behind"""
+        while self._positions and len(self.chunks) - min(self._positions.values()) >= self.max_lag:
+            stream_stats.backpressure_waits += 1
+            self._drained = asyncio.Event()
+            await self._drained.wait()
+
+    def _advance(self, reader: int, position: Optional[int]):
+        if position is None:
+            self._positions.pop(reader, None)
+        else:
+            self._positions[reader] = position
+        if self._drained is not None:
+            self._drained.set()
+            self._drained = None
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self) -> AsyncIterator[Dict[str, Any]]:
+        reader = self._next_reader
+        self._next_reader += 1
+        position = 0
+        self._positions[reader] = position
+        try:
+            while True:
+                changed = self._changed
+                while position < len(self.chunks):
+                    yield self.chunks[position]
+                    position += 1
+                    self._advance(reader, position)
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self._advance(reader, None)
+
+class SingleFlight:
+    """Coalesces concurrent identical generations onto one upstream call.
+
+    Within a worker, callers share the leader's future (or token stream). For
+    non-streaming calls across workers, the leader holds a Redis lock and
+    publishes its result on a channel that followers on other workers wait on;
+    if the leader fails or times out, followers generate on their own. Each
+    worker has one pattern subscription for all of these channels (a single
+    Redis connection however many followers wait) and hands messages to the
+    local followers waiting on that key.
+
+    Streams are only shared within a worker: an identical stream on another
+    worker makes its own upstream call.
+    """
+
+    lock_prefix = "llm_flight:lock"
+    channel_prefix = "llm_flight:done"
+
+    def __init__(self, redis=None):
+        self._redis = redis
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, StreamBroadcast] = {}
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._listener_ready: Optional[asyncio.Future] = None
+        self.leaders = 0
+        self.local_followers = 0
+        self.remote_followers = 0
+        self.stream_leaders = 0
+        self.stream_followers = 0
+
+    @property
+    def redis(self):
+        return self._redis if self._redis is not None else get_async_redis()
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Dict[str, Any]]],
+        recheck: Optional[Callable[[], Awaitable[Optional[Dict[str, Any]]]]] = None
+    ) -> Dict[str, Any]:
+        """Run ``fn`` once for all concurrent callers with the same key.
+
+        ``recheck`` looks the result up again (normally in the response cache)
+        and is used by remote followers that may have missed the publish.
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self.local_followers += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    # The leader went away; generate on our own
+                    return await fn()
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        # Followers may not exist to retrieve an exception
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        self.leaders += 1
+        try:
+            if settings.LLM_SINGLE_FLIGHT_DISTRIBUTED:
+                result = await self._do_distributed(key, fn, recheck)
+            else:
+                result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._calls.pop(key, None)
+
+    async def _do_distributed(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Dict[str, Any]]],
+        recheck: Optional[Callable[[], Awaitable[Optional[Dict[str, Any]]]]]
+    ) -> Dict[str, Any]:
+        lock_key = f"{self.lock_prefix}:{key}"
+        channel = f"{self.channel_prefix}:{key}"
+        token = uuid.uuid4().hex
+        timeout = settings.LLM_SINGLE_FLIGHT_TIMEOUT
+        try:
+            acquired = await self.redis.set(lock_key, token, nx=True, px=int(timeout * 1000))
+        except RedisError as e:
+            logger.warning(f"Single-flight lock failed: {e}")
+            return await fn()
+
+        if acquired:
+            return await self._lead(lock_key, channel, token, fn)
+        return await self._follow(channel, fn, recheck, timeout)
+
+    async def _lead(self, lock_key: str, channel: str, token: str, fn) -> Dict[str, Any]:
+        try:
+            result = await fn()
+        except Exception:
+            await self._publish(channel, {"error": True})
+            raise
+        finally:
+            try:
+                await self.redis.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+            except RedisError as e:
+                logger.warning(f"Single-flight unlock failed: {e}")
+        await self._publish(channel, {"result": result})
+        return result
+
+    async def _publish(self, channel: str, message: Dict[str, Any]):
+        try:
+            await self.redis.publish(channel, json.dumps(message))
+        except RedisError as e:
+            logger.warning(f"Single-flight publish failed: {e}")
+
+    async def _subscribed(self):
+        """Start this worker's shared completion subscriber if it is not running"""
+        if self._listener is None or self._listener.done():
+            self._listener_ready = asyncio.get_running_loop().create_future()
+            self._listener_ready.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._listener = asyncio.create_task(self._listen(self._listener_ready))
+        await asyncio.shield(self._listener_ready)
+
+    async def _listen(self, ready: asyncio.Future):
+        """Hand leaders' completion messages to this worker's waiting followers"""
+        pubsub = self.redis.pubsub()
+        try:
+            await pubsub.psubscribe(f"{self.channel_prefix}:*")
+            ready.set_result(None)
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                for waiter in self._waiters.pop(message["channel"], []):
+                    if not waiter.done():
+                        waiter.set_result(message["data"])
+        except (RedisError, OSError) as e:
+            logger.warning(f"Single-flight subscriber stopped: {e}")
+            if not ready.done():
+                ready.set_exception(e)
+        finally:
+            # Whoever is still waiting generates on their own
+            for waiters in self._waiters.values():
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+            self._waiters.clear()
+            if not ready.done():
+                ready.set_exception(RedisError("Single-flight subscriber stopped"))
+            try:
+                await pubsub.punsubscribe()
+                await pubsub.aclose()
+            except (RedisError, OSError):
+                pass
+
+    async def _follow(self, channel: str, fn, recheck, timeout: float) -> Dict[str, Any]:
+        self.remote_followers += 1
+        try:
+            await self._subscribed()
+        except (RedisError, OSError) as e:
+            logger.warning(f"Single-flight subscribe failed: {e}")
+            return await fn()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(channel, []).append(waiter)
+        try:
+            # The leader may have finished before we started waiting
+            if recheck is not None:
+                result = await recheck()
+                if result is not None:
+                    return result
+
+            data = await asyncio.wait_for(waiter, timeout)
+            if data is not None:
+                payload = json.loads(data)
+                if "result" in payload:
+                    return payload["result"]
+            # otherwise the leader failed or the subscriber stopped
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters = self._waiters.get(channel)
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiters[channel]
+
+        return await fn()
+
+    async def stream(
+        self,
+        key: str,
+        factory: Callable[[], AsyncIterator[Dict[str, Any]]]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Attach to an in-flight identical stream, or start one.
+
+        The upstream stream runs in its own task so it is not tied to any one
+        reader; it is cancelled once every reader has gone away.
+        """
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = StreamBroadcast(settings.LLM_STREAM_MAX_LAG_CHUNKS)
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.create_task(self._pump(key, broadcast, factory))
+            self.stream_leaders += 1
+        else:
+            self.stream_followers += 1
+
+        broadcast.subscribers += 1
+        try:
+            async for chunk in broadcast.subscribe():
+                yield chunk
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.done:
+                broadcast.task.cancel()
+
+    async def _pump(self, key: str, broadcast: StreamBroadcast, factory):
+        error = None
+        stream = factory()
+        try:
+            async for chunk in stream:
+                broadcast.publish(chunk)
+                await broadcast.wait_for_readers()
+        except asyncio.CancelledError as e:
+            error = e
+            raise
+        except Exception as e:
+            error = e
+        finally:
+            # Cancelled while waiting for readers, the stream is left suspended until closed
+            await stream.aclose()
+            broadcast.finish(error)
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+    def stats(self) -> Dict[str, int]:
+        """Coalescing counters"""
+        return {
+            "in_flight": len(self._calls),
+            "streams_in_flight": len(self._streams),
+            "leaders": self.leaders,
+            "local_followers": self.local_followers,
+            "remote_followers": self.remote_followers,
+            "remote_waiting": sum(len(waiters) for waiters in self._waiters.values()),
+            "stream_leaders": self.stream_leaders,
+            "stream_followers": self.stream_followers
+        }
+
+single_flight = SingleFlight()
@@ -0,0 +1,198 @@
+from typing import List, Dict, Any, AsyncIterator, Optional
+import asyncio
+import time
+
+from core.serialization import dumps
+
+class StreamChunk(dict):
+    """A stream chunk that encodes its SSE frame at most once.
+
+    Chunks from one upstream stream are shared by every coalesced reader and
+    are never mutated, so the encoded frame is kept on the chunk and reused.
+    """
+
+    __slots__ = ("_frame",)
+
+    def frame(self) -> bytes:
+        try:
+            return self._frame
+        except AttributeError:
+            self._frame = b"data: " + dumps(self) + b"\n\n"
+            return self._frame
+
+class StreamStats:
+    """Counters for upstream streams, including ones aborted because every reader left"""
+
+    def __init__(self):
+        self.completed = 0
+        self.completed_tokens = 0
+        self.aborted = 0
+        self.aborted_tokens = 0
+        self.tokens_saved = 0
+        self.backpressure_waits = 0
+
+    def record_completed(self, tokens: int):
+        self.completed += 1
+        self.completed_tokens += tokens
+
+    def record_aborted(self, tokens: int, max_tokens: int):
+        """Count an aborted generation and the tokens it no longer produces.
+
+        Savings are estimated from the average completed stream length,
+        capped at the request's ``max_tokens``.
+        """
+        typical = self.completed_tokens / self.completed if self.completed else max_tokens
+        self.aborted += 1
+        self.aborted_tokens += tokens
+        self.tokens_saved += max(0, int(min(typical, max_tokens)) - tokens)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "completed": self.completed,
+            "aborted": self.aborted,
+            "aborted_tokens_generated": self.aborted_tokens,
+            "aborted_tokens_saved_estimate": self.tokens_saved,
+            "backpressure_waits": self.backpressure_waits
+        }
+
+stream_stats = StreamStats()
+
+def sse_frame(chunk: Dict[str, Any]) -> bytes:
+    """Server-sent event frame for a chunk"""
+    if isinstance(chunk, StreamChunk):
+        return chunk.frame()
+    return b"data: " + dumps(chunk) + b"\n\n"
+
+def _is_delta(chunk: Dict[str, Any]) -> bool:
+    """A plain content delta (no final, error or metadata fields)"""
+    return len(chunk) == 2 and not chunk.get("done") and bool(chunk.get("content"))
+
+async def coalesce_deltas(
+    stream: AsyncIterator[Dict[str, Any]],
+    interval: float,
+    max_chars: int
+) -> AsyncIterator[Dict[str, Any]]:
+    """Merge runs of small content deltas into fewer, larger chunks.
+
+    The first delta is sent at once so time-to-first-token is unchanged. Later
+    deltas are buffered until ``interval`` seconds after the first buffered
+    one, until ``max_chars`` are buffered, or until any other chunk arrives.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = stream.__aiter__()
+    parts: List[str] = []
+    size = 0
+    flush_at = 0.0
+    sent_first = False
+    next_chunk: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if parts or next_chunk is not None:
+                # Wait for the next chunk only until the buffer is due
+                if next_chunk is None:
+                    next_chunk = asyncio.ensure_future(iterator.__anext__())
+                timeout = max(flush_at - loop.time(), 0) if parts else None
+                done, _ = await asyncio.wait({next_chunk}, timeout=timeout)
+                if not done:
+                    yield StreamChunk(content="".join(parts), done=False)
+                    parts, size = [], 0
+                    continue
+                finished, next_chunk = next_chunk, None
+                try:
+                    chunk = finished.result()
+                except StopAsyncIteration:
+                    break
+            else:
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+
+            if _is_delta(chunk):
+                if not sent_first:
+                    sent_first = True
+                    yield chunk
+                    continue
+                if not parts:
+                    flush_at = loop.time() + interval
+                parts.append(chunk["content"])
+                size += len(chunk["content"])
+                if size < max_chars:
+                    continue
+            if parts:
+                yield StreamChunk(content="".join(parts), done=False)
+                parts, size = [], 0
+            if not _is_delta(chunk):
+                yield chunk
+        if parts:
+            yield StreamChunk(content="".join(parts), done=False)
+    finally:
+        if next_chunk is not None:
+            # The stream cannot be closed while the pending read is still running it
+            next_chunk.cancel()
+            await asyncio.wait({next_chunk})
+        await stream.aclose()
+
+class StreamTee:
+    """Passes a chunk stream through while assembling the full response.
+
+    Content parts are buffered in a list and joined once at the end; the tee
+    only reports ``completed`` when the stream ran to the end without an
+    error chunk, so partial or failed generations are never persisted.
+    """
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.chunks = 0
+        self.reported_tokens: Optional[int] = None
+        self.model: Optional[str] = None
+        self.completed = False
+        self.failed = False
+        self._started = time.monotonic()
+        self.first_chunk_ms: Optional[int] = None
+        self.latency_ms: Optional[int] = None
+
+    async def tee(self, stream: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        try:
+            async for chunk in stream:
+                if chunk.get("error"):
+                    self.failed = True
+                if chunk.get("tokens_used") is not None:
+                    self.reported_tokens = chunk["tokens_used"]
+                if chunk.get("model"):
+                    self.model = chunk["model"]
+                content = chunk.get("content")
+                if content:
+                    if self.first_chunk_ms is None:
+                        self.first_chunk_ms = int((time.monotonic() - self._started) * 1000)
+                    self.parts.append(content)
+                    self.chunks += 1
+                yield chunk
+            self.completed = not self.failed
+        finally:
+            self.latency_ms = int((time.monotonic() - self._started) * 1000)
+            await stream.aclose()
+
+    @property
+    def content(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def tokens_used(self) -> int:
+        """Token count reported by the stream, else one per delta"""
+        return self.reported_tokens if self.reported_tokens is not None else self.chunks
+
+    def as_response(self, model: str) -> Dict[str, Any]:
+        """The assembled stream in the non-streaming response format"""
+        return {
+            "content": self.content,
+            "tokens_used": self.tokens_used,
+            "model": self.model or model
+        }
+
+async def replay_stream(response: Dict[str, Any], chunk_size: int = 64) -> AsyncIterator[Dict[str, Any]]:
+    """Synthetic stream for a cached response"""
+    content = response["content"]
+    for start in range(0, len(content), chunk_size):
+        yield StreamChunk(content=content[start:start + chunk_size], done=False)
+    yield StreamChunk(content="", done=True, tokens_used=response.get("tokens_used", 0))
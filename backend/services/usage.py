@@ -0,0 +1,326 @@
+from collections import deque
+from datetime import date, datetime, timezone
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import logging
+
+from redis.exceptions import RedisError
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.cache import TTLCache
+from core.config import settings
+from core.database import AsyncSessionLocal, get_async_redis
+from core.serialization import dumps, loads
+from models.api_usage import APIUsage, UsageDaily, UsageHourly
+from services.model_registry import model_registry
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FIELDS = ("requests", "errors", "tokens_used", "cost", "latency_ms_total")
+
+_UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+def _add_to_bucket(buckets: Dict[Tuple, Dict[str, Any]], key: Tuple, row: Dict[str, Any]):
+    totals = buckets.get(key)
+    if totals is None:
+        totals = buckets[key] = dict.fromkeys(ROLLUP_FIELDS, 0)
+    totals["requests"] += 1
+    totals["errors"] += (row["status_code"] or 0) >= 400
+    totals["tokens_used"] += row["tokens_used"] or 0
+    totals["cost"] += row["cost"] or 0.0
+    totals["latency_ms_total"] += row["latency_ms"] or 0
+
+def rollup_rows(rows: Iterable[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Sum usage rows into per user/model/hour and per user/model/day increments"""
+    hourly: Dict[Tuple, Dict[str, Any]] = {}
+    daily: Dict[Tuple, Dict[str, Any]] = {}
+    for row in rows:
+        created_at = row["created_at"]
+        model_name = row["model_name"] or ""
+        _add_to_bucket(hourly, (row["user_id"], model_name, created_at.replace(minute=0, second=0, microsecond=0)), row)
+        _add_to_bucket(daily, (row["user_id"], model_name, created_at.date()), row)
+    # Sorted so concurrent flushers lock buckets in the same order
+    return (
+        [{"user_id": u, "model_name": m, "hour": h, **totals} for (u, m, h), totals in sorted(hourly.items())],
+        [{"user_id": u, "model_name": m, "day": d, **totals} for (u, m, d), totals in sorted(daily.items())]
+    )
+
+async def _upsert_rollup(db: AsyncSession, model, bucket: str, rows: List[Dict[str, Any]]):
+    """Add increments to existing buckets, creating missing ones"""
+    table = model.__table__
+    stmt = _UPSERT_INSERTS[db.get_bind().dialect.name](table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "model_name", bucket],
+        set_={field: table.c[field] + stmt.excluded[field] for field in ROLLUP_FIELDS}
+    )
+    await db.execute(stmt, rows)
+
+async def write_usage(db: AsyncSession, rows: List[Dict[str, Any]]):
+    """Insert usage rows and fold them into the rollups in the caller's transaction"""
+    await db.execute(insert(APIUsage), rows)
+    hourly, daily = rollup_rows(rows)
+    await _upsert_rollup(db, UsageHourly, "hour", hourly)
+    await _upsert_rollup(db, UsageDaily, "day", daily)
+
+class UsageRecorder:
+    """Buffers ``APIUsage`` rows in memory and bulk-inserts them in the background.
+
+    ``record`` never touches the database: it appends to a bounded queue
+    that a flusher writes out with one multi-row insert (plus the matching
+    rollup upserts) every ``USAGE_FLUSH_INTERVAL_MS`` or as soon as
+    ``USAGE_FLUSH_BATCH_SIZE`` rows are waiting. When the queue is full, new rows are dropped
+    (``USAGE_OVERFLOW_POLICY=drop``) or spilled to a Redis list (``spill``)
+    that the flusher works off once it has caught up. ``close`` drains the
+    queue on shutdown.
+    """
+
+    spill_key = "usage:spill"
+
+    def __init__(self, redis=None):
+        self._redis = redis
+        self._queue: Deque[Dict[str, Any]] = deque()
+        self._overflow: List[Dict[str, Any]] = []
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        # Rows may have been spilled by a previous process
+        self._spill_pending = True
+        self.recorded = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.failed_flushes = 0
+
+    @property
+    def redis(self):
+        return self._redis if self._redis is not None else get_async_redis()
+
+    def record(
+        self,
+        user_id: int,
+        endpoint: str,
+        model_name: Optional[str],
+        tokens_used: int,
+        latency_ms: Optional[int],
+        status_code: int
+    ):
+        """Queue one usage row, priced from the model registry"""
+        model = model_registry.get_model(model_name) if model_name else None
+        row = {
+            "user_id": user_id,
+            "endpoint": endpoint,
+            "model_name": model_name,
+            "tokens_used": tokens_used,
+            "latency_ms": latency_ms,
+            "status_code": status_code,
+            "cost": tokens_used / 1000 * (model or {}).get("cost_per_1k_tokens", 0.0),
+            "created_at": datetime.now(timezone.utc)
+        }
+        self.recorded += 1
+        if len(self._queue) < settings.USAGE_QUEUE_SIZE:
+            self._queue.append(row)
+            if len(self._queue) >= settings.USAGE_FLUSH_BATCH_SIZE:
+                self._wake.set()
+        elif settings.USAGE_OVERFLOW_POLICY == "spill":
+            self._overflow.append(row)
+            self._wake.set()
+        else:
+            self.dropped += 1
+
+    def start(self):
+        """Start the background flusher (called on startup)"""
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the flusher and write out everything still queued (called on shutdown)"""
+        self._closing = True
+        self._wake.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        # Whatever could not be written goes to the spill list for the next process, if spilling is on
+        self._overflow.extend(self._take(len(self._queue)))
+        if settings.USAGE_OVERFLOW_POLICY == "spill":
+            await self._spill()
+        elif self._overflow:
+            logger.warning(f"Dropping {len(self._overflow)} usage rows that could not be written before shutdown")
+            self.dropped += len(self._overflow)
+            self._overflow = []
+
+    async def _run(self):
+        interval = settings.USAGE_FLUSH_INTERVAL_MS / 1000
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self._flush_pending()
+
+        # Drain on shutdown, stopping at the first failed write
+        while self._queue and await self._flush(self._take(settings.USAGE_FLUSH_BATCH_SIZE)):
+            pass
+
+    async def _flush_pending(self):
+        if self._overflow:
+            await self._spill()
+        while self._queue:
+            if not await self._flush(self._take(settings.USAGE_FLUSH_BATCH_SIZE)):
+                return
+            if len(self._queue) < settings.USAGE_FLUSH_BATCH_SIZE:
+                break
+        if not self._queue and self._spill_pending:
+            await self._reclaim()
+
+    def _take(self, count: int) -> List[Dict[str, Any]]:
+        return [self._queue.popleft() for _ in range(min(count, len(self._queue)))]
+
+    async def _flush(self, rows: List[Dict[str, Any]]) -> bool:
+        """Insert rows in one statement; on failure put them back if there is room"""
+        if not rows:
+            return True
+        try:
+            async with AsyncSessionLocal() as db:
+                await write_usage(db, rows)
+                await db.commit()
+        except Exception as e:
+            self.failed_flushes += 1
+            logger.error(f"Failed to write {len(rows)} usage rows: {e}")
+            room = settings.USAGE_QUEUE_SIZE - len(self._queue)
+            self._queue.extendleft(reversed(rows[:max(room, 0)]))
+            self.dropped += max(len(rows) - room, 0)
+            return False
+        self.flushes += 1
+        self.flushed += len(rows)
+        return True
+
+    async def _spill(self):
+        rows, self._overflow = self._overflow, []
+        if not rows:
+            return
+        try:
+            await self.redis.rpush(
+                self.spill_key,
+                *[dumps({**row, "created_at": row["created_at"].isoformat()}) for row in rows]
+            )
+        except RedisError as e:
+            logger.warning(f"Failed to spill {len(rows)} usage rows: {e}")
+            self.dropped += len(rows)
+            return
+        self.spilled += len(rows)
+        self._spill_pending = True
+
+    async def _reclaim(self):
+        """Move a batch of spilled rows back into the queue"""
+        try:
+            items = await self.redis.lpop(self.spill_key, settings.USAGE_FLUSH_BATCH_SIZE)
+        except RedisError as e:
+            logger.warning(f"Failed to read spilled usage rows: {e}")
+            return
+        if not items:
+            self._spill_pending = False
+            return
+        for item in items:
+            row = loads(item)
+            row["created_at"] = datetime.fromisoformat(row["created_at"])
+            self._queue.append(row)
+        self._wake.set()
+
+    def pending_totals(self, user_id: Optional[int] = None, start: Optional[date] = None) -> Dict[str, Dict[str, Any]]:
+        """Totals per model of rows not yet written (the live tail on top of the rollups)"""
+        buckets: Dict[Tuple, Dict[str, Any]] = {}
+        for row in (*self._queue, *self._overflow):
+            if user_id is not None and row["user_id"] != user_id:
+                continue
+            if start is not None and row["created_at"].date() < start:
+                continue
+            _add_to_bucket(buckets, (row["model_name"] or "",), row)
+        return {key[0]: totals for key, totals in buckets.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self._queue),
+            "recorded": self.recorded,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "failed_flushes": self.failed_flushes
+        }
+
+usage_recorder = UsageRecorder()
+
+_summary_cache = TTLCache(maxsize=settings.USAGE_STATS_CACHE_SIZE, ttl=settings.USAGE_STATS_CACHE_TTL)
+
+def _merge_totals(target: Dict[str, Dict[str, Any]], source: Dict[str, Dict[str, Any]]):
+    for key, totals in source.items():
+        merged = target.setdefault(key, dict.fromkeys(ROLLUP_FIELDS, 0))
+        for field in ROLLUP_FIELDS:
+            merged[field] += totals[field]
+
+async def usage_by_model(
+    db: AsyncSession,
+    user_id: Optional[int] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None
+) -> Dict[str, Dict[str, Any]]:
+    """Usage totals per model over a day range (inclusive), from the daily rollups.
+
+    Rows this worker has not written yet are added on top, so a caller sees
+    its own latest requests. Results are cached for ``USAGE_STATS_CACHE_TTL``.
+    """
+    cache_key = (user_id, start, end)
+    cached = _summary_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    query = select(UsageDaily.model_name, *[func.sum(UsageDaily.__table__.c[field]).label(field) for field in ROLLUP_FIELDS])
+    if user_id is not None:
+        query = query.where(UsageDaily.user_id == user_id)
+    if start is not None:
+        query = query.where(UsageDaily.day >= start)
+    if end is not None:
+        query = query.where(UsageDaily.day <= end)
+    result = await db.execute(query.group_by(UsageDaily.model_name))
+    totals = {row.model_name: {field: row._mapping[field] or 0 for field in ROLLUP_FIELDS} for row in result}
+
+    if end is None or end >= datetime.now(timezone.utc).date():
+        _merge_totals(totals, usage_recorder.pending_totals(user_id, start))
+    _summary_cache.set(cache_key, totals)
+    return totals
+
+def sum_totals(by_model: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Totals across models"""
+    totals = dict.fromkeys(ROLLUP_FIELDS, 0)
+    for model_totals in by_model.values():
+        for field in ROLLUP_FIELDS:
+            totals[field] += model_totals[field]
+    return totals
+
+async def usage_series(
+    db: AsyncSession,
+    user_id: int,
+    granularity: str,
+    start: datetime,
+    end: datetime
+) -> List[Dict[str, Any]]:
+    """Usage totals per hour or per day between two times, oldest first"""
+    model, bucket = (UsageHourly, "hour") if granularity == "hour" else (UsageDaily, "day")
+    column = model.__table__.c[bucket]
+    if bucket == "day":
+        start, end = start.date(), end.date()
+    else:
+        # Buckets are keyed on the top of the hour, so an hour that started before ``start`` still counts
+        start = start.replace(minute=0, second=0, microsecond=0)
+    result = await db.execute(
+        select(column, *[func.sum(model.__table__.c[field]).label(field) for field in ROLLUP_FIELDS])
+        .where(model.user_id == user_id, column >= start, column <= end)
+        .group_by(column)
+        .order_by(column)
+    )
+    return [{bucket: row[0], **{field: row._mapping[field] or 0 for field in ROLLUP_FIELDS}} for row in result]
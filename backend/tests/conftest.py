@@ -0,0 +1,126 @@
+"""Shared fixtures.
+
+The app runs against a throwaway SQLite database (``TEST_DATABASE_URL``
+overrides it) and an in-process fakeredis server, so the suite needs no
+services. Every async test shares one event loop with the app's
+module-level singletons.
+"""
+import os
+import tempfile
+
+_DATA_DIR = tempfile.mkdtemp(prefix="rajora-tests-")
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL", f"sqlite:///{_DATA_DIR}/test.db")
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["DEBUG"] = "False"
+os.environ["BCRYPT_ROUNDS"] = "4"
+
+import uuid
+from typing import Dict, List, Tuple
+
+import fakeredis
+import httpx
+import pytest
+import pytest_asyncio
+from sqlalchemy import update
+
+import core.database as database
+
+database.async_redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+database.redis_client = fakeredis.FakeRedis(decode_responses=True)
+
+from core.config import settings
+
+def pytest_collection_modifyitems(items):
+    marker = pytest.mark.asyncio(loop_scope="session")
+    for item in items:
+        if pytest_asyncio.is_async_test(item):
+            item.add_marker(marker, append=False)
+
+@pytest.fixture
+def redis():
+    return database.async_redis_client
+
+@pytest.fixture(autouse=True)
+async def _reset_redis(redis):
+    await redis.flushall()
+    yield
+
+@pytest.fixture(scope="session")
+async def app():
+    import main
+
+    async with main.lifespan(main.app):
+        yield main.app
+
+@pytest.fixture(scope="session")
+async def client(app):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        yield client
+
+@pytest.fixture
+async def mock_backend(monkeypatch):
+    """Serves a model from in-process replicas: ``mock_backend(model, handler, replicas=1)``.
+
+    ``handler`` is an ``httpx.MockTransport`` handler (sync or async) that
+    receives every request sent to the model's replicas.
+    """
+    from services.model_registry import Replica, model_registry
+    from services.providers import providers
+
+    clients = []
+
+    def install(model: str, handler, replicas: int = 1, provider: str = "vllm") -> List[Replica]:
+        installed = []
+        for index in range(replicas):
+            url = f"http://{model}-{index}.test"
+            client = httpx.AsyncClient(base_url=url, transport=httpx.MockTransport(handler))
+            clients.append(client)
+            monkeypatch.setitem(providers.get(provider)._clients, url, client)
+            installed.append(Replica(provider, url))
+        monkeypatch.setitem(model_registry._replicas, model, installed)
+        return installed
+
+    yield install
+    for client in clients:
+        await client.aclose()
+
+@pytest.fixture(autouse=True)
+def _no_rate_limits(monkeypatch):
+    """Tests that exercise the rate limiter turn it back on"""
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", False)
+
+async def _register_user(client: httpx.AsyncClient, admin: bool = False) -> Dict[str, str]:
+    name = f"user-{uuid.uuid4().hex[:12]}"
+    response = await client.post(
+        "/api/auth/register", json={"email": f"{name}@example.com", "username": name, "password": "secret-pw"}
+    )
+    assert response.status_code == 200, response.text
+    user_id = response.json()["id"]
+    if admin:
+        from core.security import user_cache
+        from models.user import User
+
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(update(User).where(User.id == user_id).values(is_admin=True))
+            await db.commit()
+        await user_cache.invalidate(user_id)
+    response = await client.post("/api/auth/login", data={"username": name, "password": "secret-pw"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}", "id": str(user_id)}
+
+@pytest.fixture
+def make_user(client):
+    """Registers and logs in a fresh user: ``(user_id, auth headers)``"""
+    async def make(admin: bool = False) -> Tuple[int, Dict[str, str]]:
+        headers = await _register_user(client, admin)
+        return int(headers.pop("id")), headers
+    return make
+
+@pytest.fixture
+async def user_headers(make_user):
+    return (await make_user())[1]
+
+@pytest.fixture
+async def admin_headers(make_user):
+    return (await make_user(admin=True))[1]
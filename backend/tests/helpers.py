@@ -0,0 +1,88 @@
+"""Canned inference backend responses for ``httpx.MockTransport`` handlers, and a WebSocket client"""
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+
+import httpx
+
+from core.serialization import dumps, loads
+
+def completion(content: str, prompt_tokens: int = 10, completion_tokens: int = 5) -> httpx.Response:
+    """An OpenAI-compatible (vLLM) chat completion"""
+    return httpx.Response(200, json={
+        "choices": [{"message": {"role": "assistant", "content": content}}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    })
+
+def sse_body(tokens: List[str], total_tokens: int = 20) -> bytes:
+    """An OpenAI-compatible (vLLM) SSE stream of ``tokens``, with a usage chunk and [DONE]"""
+    events = [{"choices": [{"delta": {"content": token}}]} for token in tokens]
+    events.append({"choices": [], "usage": {"total_tokens": total_tokens}})
+    return b"".join(b"data: " + dumps(event) + b"\n\n" for event in events) + b"data: [DONE]\n\n"
+
+def stream_response(tokens: List[str], total_tokens: int = 20) -> httpx.Response:
+    return httpx.Response(200, content=sse_body(tokens, total_tokens), headers={"content-type": "text/event-stream"})
+
+class WebSocketSession:
+    """Talks the ASGI WebSocket protocol to the app directly, on the test's own event loop.
+
+    ``httpx.ASGITransport`` does not do WebSockets and Starlette's
+    ``TestClient`` runs the app on another loop, away from the module-level
+    singletons, so the tests drive the socket by hand.
+    """
+
+    def __init__(self, app, path: str, headers: Optional[Dict[str, str]] = None):
+        self.scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "server": ("testserver", 80),
+            "client": ("127.0.0.1", 50000),
+            "root_path": "",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "headers": [(key.lower().encode(), value.encode()) for key, value in (headers or {}).items()],
+            "subprotocols": []
+        }
+        self._app = app
+        self._incoming: asyncio.Queue = asyncio.Queue()
+        self._outgoing: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def connect(self) -> Dict[str, Any]:
+        """Send the upgrade and return the app's answer (``websocket.accept``, a close or an HTTP response)"""
+        self._task = asyncio.create_task(self._app(self.scope, self._incoming.get, self._outgoing.put))
+        await self._incoming.put({"type": "websocket.connect"})
+        return await self.next_event()
+
+    async def next_event(self, timeout: float = 5.0) -> Dict[str, Any]:
+        return await asyncio.wait_for(self._outgoing.get(), timeout)
+
+    async def send_json(self, message: Any):
+        await self._incoming.put({"type": "websocket.receive", "text": dumps(message).decode()})
+
+    async def send_bytes(self, data: bytes):
+        await self._incoming.put({"type": "websocket.receive", "bytes": data})
+
+    async def receive_json(self, timeout: float = 5.0) -> Dict[str, Any]:
+        event = await self.next_event(timeout)
+        assert event["type"] == "websocket.send", event
+        return loads(event["text"])
+
+    async def receive_until(self, predicate, timeout: float = 5.0) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Messages up to and including the first one matching ``predicate``"""
+        seen = []
+        while True:
+            message = await self.receive_json(timeout)
+            if predicate(message):
+                return seen, message
+            seen.append(message)
+
+    async def close(self):
+        await self._incoming.put({"type": "websocket.disconnect", "code": 1000})
+        if self._task is not None:
+            await asyncio.wait_for(asyncio.gather(self._task, return_exceptions=True), 5)
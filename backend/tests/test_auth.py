@@ -0,0 +1,158 @@
+import asyncio
+import json
+import threading
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from passlib.hash import bcrypt
+from sqlalchemy import select
+
+from core.config import settings
+from core.database import AsyncSessionLocal, async_engine
+from core.migrations import initialize_database
+from core.security import PasswordHasher, api_key_cache, hash_api_key, password_hasher, user_cache
+from models.user import User
+
+SECRET_FIELDS = {"hashed_password", "api_key", "api_key_hash"}
+
+def _new_user() -> dict:
+    name = f"user-{uuid.uuid4().hex[:12]}"
+    return {"email": f"{name}@example.com", "username": name, "password": "secret-pw"}
+
+async def test_register_login_and_me(client):
+    user = _new_user()
+    registered = await client.post("/api/auth/register", json=user)
+    assert registered.status_code == 200
+    assert registered.json()["username"] == user["username"]
+    assert "hashed_password" not in registered.json()
+
+    login = await client.post("/api/auth/login", data={"username": user["username"], "password": user["password"]})
+    assert login.status_code == 200
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    me = await client.get("/api/auth/me", headers=headers)
+    assert me.json()["id"] == registered.json()["id"]
+
+async def test_registration_conflicts_and_bad_logins(client):
+    user = _new_user()
+    await client.post("/api/auth/register", json=user)
+    assert (await client.post("/api/auth/register", json={**user, "username": "other"})).status_code == 400
+    assert (await client.post("/api/auth/register", json={**user, "email": "other@example.com"})).status_code == 400
+
+    wrong = await client.post("/api/auth/login", data={"username": user["username"], "password": "nope"})
+    assert wrong.status_code == 401
+    unknown = await client.post("/api/auth/login", data={"username": "nobody", "password": "nope"})
+    assert unknown.status_code == 401
+    assert (await client.get("/api/auth/me")).status_code == 401
+
+async def test_admin_user_management(client, make_user, admin_headers):
+    user_id, headers = await make_user()
+    assert (await client.get("/api/admin/users", headers=headers)).status_code == 403
+
+    users = (await client.get("/api/admin/users", headers=admin_headers)).json()
+    assert user_id in {user["id"] for user in users}
+    assert not SECRET_FIELDS & set().union(*users)
+
+    response = await client.patch(f"/api/admin/users/{user_id}", headers=admin_headers, json={"is_active": False})
+    assert response.status_code == 200
+    assert response.json()["is_active"] is False
+    assert not SECRET_FIELDS & set(response.json())
+    # Deactivation applies at once, the cached user is dropped
+    assert (await client.get("/api/auth/me", headers=headers)).status_code == 401
+
+    missing = await client.patch("/api/admin/users/999999", headers=admin_headers, json={"is_active": False})
+    assert missing.status_code == 404
+
+async def test_usage_endpoints(client, user_headers):
+    usage = (await client.get("/api/users/usage", headers=user_headers)).json()
+    assert usage["total_requests"] == 0 and usage["recent_usage"] == []
+
+    # Bounds with and without an offset are both accepted
+    for start in ("2026-01-01T00:00:00", "2026-01-01T00:00:00+02:00"):
+        response = await client.get(
+            "/api/users/usage/timeseries", headers=user_headers, params={"start": start, "granularity": "day"}
+        )
+        assert response.status_code == 200, response.text
+
+async def test_api_key_authentication(client, user_headers):
+    me = (await client.get("/api/auth/me", headers=user_headers)).json()
+    api_key = me["api_key"]
+    assert api_key.startswith("raj_")
+    for headers in ({"X-API-Key": api_key}, {"Authorization": f"Bearer {api_key}"}):
+        response = await client.get("/api/auth/me", headers=headers)
+        assert response.status_code == 200 and response.json()["id"] == me["id"]
+    assert api_key_cache.stats()["hits"] >= 1
+
+    assert (await client.get("/api/auth/me", headers={"X-API-Key": api_key + "x"})).status_code == 401
+    rotated = (await client.post("/api/auth/refresh-api-key", headers=user_headers)).json()["api_key"]
+    assert rotated != api_key
+    assert (await client.get("/api/auth/me", headers={"X-API-Key": api_key})).status_code == 401
+    assert (await client.get("/api/auth/me", headers={"X-API-Key": rotated})).status_code == 200
+
+async def test_cached_principals_hold_only_the_api_key_hash(client, make_user, redis, monkeypatch):
+    monkeypatch.setattr(settings, "USER_CACHE_REDIS_ENABLED", True)
+    user_id, headers = await make_user()
+    api_key = (await client.get("/api/auth/me", headers=headers)).json()["api_key"]
+    assert (await client.get("/api/auth/me", headers={"X-API-Key": api_key})).status_code == 200
+    shared = json.loads(await redis.get(user_cache._redis_key(user_id)))
+    for principal in (user_cache.local.get(user_id), shared):
+        assert "api_key" not in principal and principal["api_key_hash"] == hash_api_key(api_key)
+
+    # Rotating the key evicts the principal from both tiers
+    assert (await client.post("/api/auth/refresh-api-key", headers=headers)).status_code == 200
+    assert user_cache.local.get(user_id) is None
+    assert await redis.get(user_cache._redis_key(user_id)) is None
+    assert (await client.get("/api/auth/me", headers={"X-API-Key": api_key})).status_code == 401
+
+async def test_existing_api_keys_are_hashed_on_startup(app, client):
+    async with AsyncSessionLocal() as db:
+        user = User(email="legacy@example.com", username="legacy", hashed_password="x", api_key="raj_legacy-key")
+        db.add(user)
+        await db.commit()
+    async with async_engine.begin() as conn:
+        await conn.run_sync(initialize_database)
+
+    async with AsyncSessionLocal() as db:
+        stored = (await db.execute(select(User.api_key_hash).where(User.id == user.id))).scalar_one()
+    assert stored == hash_api_key("raj_legacy-key")
+    assert (await client.get("/api/auth/me", headers={"X-API-Key": "raj_legacy-key"})).status_code == 200
+
+async def test_password_hasher_rejects_beyond_its_queue():
+    hasher = PasswordHasher(workers=1, max_queue=1)
+    release = threading.Event()
+    try:
+        running = [asyncio.create_task(hasher._run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as rejected:
+            await hasher._run(release.wait)
+        assert rejected.value.status_code == 503 and rejected.value.headers["Retry-After"] == "1"
+        assert hasher.stats()["pending"] == 2 and hasher.stats()["rejected"] == 1
+        release.set()
+        await asyncio.gather(*running)
+        assert hasher.stats()["pending"] == 0 and hasher.stats()["completed"] == 2
+    finally:
+        release.set()
+        hasher.shutdown()
+
+async def test_login_is_shed_while_the_hasher_is_saturated(client, monkeypatch):
+    user = _new_user()
+    await client.post("/api/auth/register", json=user)
+    monkeypatch.setattr(password_hasher, "pending", password_hasher.workers + password_hasher.max_queue)
+    response = await client.post("/api/auth/login", data={"username": user["username"], "password": user["password"]})
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+
+async def test_login_rehashes_passwords_with_an_outdated_cost(client):
+    user = _new_user()
+    async with AsyncSessionLocal() as db:
+        db_user = User(
+            email=user["email"], username=user["username"],
+            hashed_password=bcrypt.using(rounds=5).hash(user["password"])
+        )
+        db.add(db_user)
+        await db.commit()
+
+    response = await client.post("/api/auth/login", data={"username": user["username"], "password": user["password"]})
+    assert response.status_code == 200
+    async with AsyncSessionLocal() as db:
+        stored = (await db.execute(select(User.hashed_password).where(User.id == db_user.id))).scalar_one()
+    assert stored.startswith("$2b$04$") and bcrypt.verify(user["password"], stored)
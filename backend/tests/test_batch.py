@@ -0,0 +1,114 @@
+import asyncio
+from datetime import timedelta
+
+import httpx
+import pytest
+from sqlalchemy import update
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+from core.serialization import dumps, loads
+from models.batch import BatchItem
+from services.batch import BatchWorker, _now
+from tests.helpers import completion
+
+MODEL = "mistral-7b"
+
+@pytest.fixture(autouse=True)
+def _fast_retries(monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_RETRY_BACKOFF_SECONDS", 0)
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 0)
+    monkeypatch.setattr(settings, "MODEL_FALLBACKS", {})
+
+async def _upload(client, headers, count: int) -> int:
+    body = b"\n".join(
+        dumps({"custom_id": f"r{i}", "model": MODEL, "messages": [{"role": "user", "content": f"q{i}"}]})
+        for i in range(count)
+    )
+    response = await client.post("/api/batch", headers=headers, content=body)
+    assert response.status_code == 202, response.text
+    return response.json()["id"]
+
+async def _results(client, headers, job_id: int) -> list:
+    response = await client.get(f"/api/batch/{job_id}/results", headers=headers)
+    return [loads(line) for line in response.text.splitlines()]
+
+async def _run(worker: BatchWorker) -> int:
+    """One claim round, waiting for the claimed requests to finish"""
+    claimed = await worker._fill()
+    await worker._drain()
+    return claimed
+
+async def test_job_runs_to_completion(client, user_headers, mock_backend):
+    mock_backend(MODEL, lambda request: completion(loads(request.content)["messages"][-1]["content"].upper()))
+    job_id = await _upload(client, user_headers, 3)
+
+    assert await _run(BatchWorker("w1")) == 3
+    job = (await client.get(f"/api/batch/{job_id}", headers=user_headers)).json()
+    assert job["status"] == "completed" and job["succeeded"] == 3 and job["tokens_used"] == 45
+
+    results = await _results(client, user_headers, job_id)
+    assert [result["seq"] for result in results] == [1, 2, 3]
+    assert {result["custom_id"]: result["response"]["content"] for result in results} == {
+        "r0": "Q0", "r1": "Q1", "r2": "Q2"
+    }
+    assert await _run(BatchWorker("w2")) == 0
+
+async def test_concurrent_workers_never_share_a_request(client, user_headers, mock_backend):
+    mock_backend(MODEL, lambda request: completion("ok"))
+    job_id = await _upload(client, user_headers, 6)
+    first, second = BatchWorker("w1"), BatchWorker("w2")
+
+    async def claim(worker):
+        async with AsyncSessionLocal() as db:
+            return await worker._claim(db, MODEL, 4)
+
+    claims = await asyncio.gather(claim(first), claim(second))
+    ids = [{item.id for item in items} for items in claims]
+    assert not ids[0] & ids[1]
+    assert len(ids[0] | ids[1]) == 6
+
+    # The claimed requests are leased; nobody else can take them
+    assert await _run(BatchWorker("w3")) == 0
+    for worker, items in zip((first, second), claims):
+        for item in items:
+            await worker._process(item)
+    job = (await client.get(f"/api/batch/{job_id}", headers=user_headers)).json()
+    assert job["status"] == "completed" and job["succeeded"] == 6
+
+async def test_backend_faults_are_retried_and_rejections_are_not(client, user_headers, mock_backend):
+    replies = iter([httpx.Response(503), completion("second try")])
+    mock_backend(MODEL, lambda request: next(replies))
+    job_id = await _upload(client, user_headers, 1)
+    worker = BatchWorker("w1")
+
+    await _run(worker)
+    assert worker.retried == 1
+    await _run(worker)
+    [result] = await _results(client, user_headers, job_id)
+    assert result["status"] == "succeeded" and result["response"]["content"] == "second try"
+
+    mock_backend(MODEL, lambda request: httpx.Response(400, json={"error": "bad request"}))
+    job_id = await _upload(client, user_headers, 1)
+    await _run(worker)
+    [result] = await _results(client, user_headers, job_id)
+    assert result["status"] == "failed" and "bad request" in result["error"]
+    assert worker.retried == 1
+
+async def test_expired_lease_is_taken_over(client, user_headers, mock_backend):
+    mock_backend(MODEL, lambda request: completion("ok"))
+    job_id = await _upload(client, user_headers, 1)
+    crashed, survivor = BatchWorker("crashed"), BatchWorker("survivor")
+
+    async with AsyncSessionLocal() as db:
+        [lost] = await crashed._claim(db, MODEL, 1)
+        await db.execute(
+            update(BatchItem).where(BatchItem.id == lost.id).values(available_at=_now() - timedelta(seconds=1))
+        )
+        await db.commit()
+
+    assert await _run(survivor) == 1
+    await crashed._process(lost)  # finishes late: its result is discarded
+    [result] = await _results(client, user_headers, job_id)
+    assert result["seq"] == 1 and result["status"] == "succeeded"
+    assert crashed.succeeded == 0 and survivor.succeeded == 1
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+import services.llm_service as llm_service
+from core.config import settings
+from core.serialization import loads
+from services.batcher import MicroBatcher
+from services.llm_service import LLMService
+from tests.helpers import completion
+
+def recorder(batches):
+    async def execute(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+    return execute
+
+async def test_concurrent_calls_share_a_batch_flushed_after_the_window():
+    batches = []
+    batcher = MicroBatcher(window_ms=20, max_batch=10)
+    results = await asyncio.gather(*[batcher.submit("model", item, recorder(batches)) for item in range(3)])
+    assert results == [0, 10, 20]
+    assert batches == [[0, 1, 2]]
+    assert batcher.stats()["batches"] == 1 and batcher.stats()["items"] == 3
+
+async def test_a_full_batch_is_flushed_before_the_window():
+    batches = []
+    batcher = MicroBatcher(window_ms=10_000, max_batch=2)
+    results = await asyncio.wait_for(
+        asyncio.gather(*[batcher.submit("model", item, recorder(batches)) for item in range(4)]), timeout=1
+    )
+    assert results == [0, 10, 20, 30]
+    assert batches == [[0, 1], [2, 3]]
+    assert batcher.stats()["largest_batch"] == 2
+
+async def test_keys_are_batched_separately():
+    batches = []
+    batcher = MicroBatcher(window_ms=5, max_batch=10)
+    await asyncio.gather(*[batcher.submit(key, 1, recorder(batches)) for key in ("a", "b", "a")])
+    assert sorted(map(len, batches)) == [1, 2]
+
+async def test_errors_reach_their_callers():
+    async def partial(items):
+        return [ValueError(item) if item == 1 else item for item in items]
+
+    batcher = MicroBatcher(window_ms=5, max_batch=10)
+    results = await asyncio.gather(*[batcher.submit("m", item, partial) for item in range(3)], return_exceptions=True)
+    assert results[0] == 0 and results[2] == 2 and isinstance(results[1], ValueError)
+
+    async def broken(items):
+        raise RuntimeError("backend down")
+
+    results = await asyncio.gather(*[batcher.submit("m", item, broken) for item in range(2)], return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+async def test_a_cancelled_caller_does_not_break_the_batch():
+    batches = []
+    batcher = MicroBatcher(window_ms=20, max_batch=10)
+    gone = asyncio.create_task(batcher.submit("model", 1, recorder(batches)))
+    stays = asyncio.create_task(batcher.submit("model", 2, recorder(batches)))
+    await asyncio.sleep(0)
+    gone.cancel()
+    assert await stays == 20
+    assert batches == [[1, 2]]
+    with pytest.raises(asyncio.CancelledError):
+        await gone
+
+async def test_close_flushes_open_batches():
+    batches = []
+    batcher = MicroBatcher(window_ms=10_000, max_batch=10)
+    waiting = asyncio.create_task(batcher.submit("model", 3, recorder(batches)))
+    await asyncio.sleep(0)
+    await batcher.close()
+    assert await waiting == 30
+    assert batcher.stats()["open_batches"] == 0
+
+async def test_llm_service_batches_concurrent_completions(mock_backend, monkeypatch):
+    batcher = MicroBatcher(window_ms=20, max_batch=8)
+    monkeypatch.setattr(llm_service, "generation_batcher", batcher)
+    monkeypatch.setattr(settings, "LLM_BATCHING_ENABLED", True)
+    mock_backend("llama-3.1-8b", lambda request: completion(loads(request.content)["messages"][0]["content"]))
+
+    service = LLMService(model_name="llama-3.1-8b")
+    prompts = [f"prompt {index}" for index in range(5)]
+    results = await asyncio.gather(*[
+        service.generate([{"role": "user", "content": prompt}], cache=False) for prompt in prompts
+    ])
+    # Each caller gets the answer to its own request back
+    assert [result["content"] for result in results] == prompts
+    assert batcher.stats()["batches"] == 1 and batcher.stats()["items"] == 5
@@ -0,0 +1,62 @@
+from core.database import AsyncSessionLocal
+from models.conversation import Conversation, Message
+
+async def _seed(user_id: int, conversations: int, messages: int) -> int:
+    """Conversations created within the same second (SQLite stores whole seconds)"""
+    async with AsyncSessionLocal() as db:
+        rows = [Conversation(user_id=user_id, model_name="llama-3.1-8b", title=f"c{i}") for i in range(conversations)]
+        db.add_all(rows)
+        await db.flush()
+        for i in range(messages):
+            db.add(Message(conversation_id=rows[0].id, role="user" if i % 2 == 0 else "assistant", content=f"m{i}"))
+        await db.commit()
+        return rows[0].id
+
+async def _walk(client, url: str, headers) -> list:
+    items, cursor = [], None
+    for _ in range(20):
+        response = await client.get(url + (f"&cursor={cursor}" if cursor else ""), headers=headers)
+        assert response.status_code == 200, response.text
+        page = response.json()
+        items += page["items"]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items
+    raise AssertionError(f"Pagination did not end after {len(items)} items")
+
+async def test_message_pages_cover_every_message_in_order(client, make_user):
+    user_id, headers = await make_user()
+    conversation_id = await _seed(user_id, 1, 5)
+
+    url = f"/api/chat/conversations/{conversation_id}/messages?limit=2"
+    ascending = await _walk(client, url + "&order=asc", headers)
+    assert [m["content"] for m in ascending] == ["m0", "m1", "m2", "m3", "m4"]
+    descending = await _walk(client, url + "&order=desc", headers)
+    assert [m["content"] for m in descending] == ["m4", "m3", "m2", "m1", "m0"]
+
+    previews = await _walk(client, url + "&include_content=false", headers)
+    assert [m["preview"] for m in previews] == ["m0", "m1", "m2", "m3", "m4"]
+
+async def test_conversation_pages_with_tied_timestamps(client, make_user):
+    user_id, headers = await make_user()
+    await _seed(user_id, 7, 0)
+
+    conversations = await _walk(client, "/api/chat/conversations?limit=3", headers)
+    ids = [c["id"] for c in conversations]
+    assert len(ids) == 7
+    assert ids == sorted(ids, reverse=True)
+
+async def test_cursor_from_another_users_conversation_yields_nothing(client, make_user):
+    owner_id, owner = await make_user()
+    await _seed(owner_id, 2, 0)
+    page = (await client.get("/api/chat/conversations?limit=1", headers=owner)).json()
+    assert page["next_cursor"] is not None
+
+    other_id, other = await make_user()
+    await _seed(other_id, 2, 0)
+    response = await client.get(f"/api/chat/conversations?cursor={page['next_cursor']}", headers=other)
+    assert response.json() == {"items": [], "next_cursor": None}
+
+async def test_invalid_cursor_is_rejected(client, user_headers):
+    response = await client.get("/api/chat/conversations?cursor=not-a-cursor!", headers=user_headers)
+    assert response.status_code == 400
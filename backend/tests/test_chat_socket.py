@@ -0,0 +1,73 @@
+import pytest
+
+from api.routes import chat
+from tests.helpers import WebSocketSession, stream_response
+
+@pytest.fixture
+async def socket(app, user_headers):
+    """An authenticated chat socket that has received its ``ready`` message"""
+    session = WebSocketSession(app, "/api/chat/ws", user_headers)
+    assert (await session.connect())["type"] == "websocket.accept"
+    assert (await session.receive_json())["type"] == "ready"
+    yield session
+    await session.close()
+
+async def _rejected_auth(app, frame) -> dict:
+    session = WebSocketSession(app, "/api/chat/ws")
+    assert (await session.connect())["type"] == "websocket.accept"
+    await frame(session)
+    event = await session.next_event()
+    await session.close()
+    return event
+
+async def test_auth_message_on_the_socket(app, user_headers):
+    session = WebSocketSession(app, "/api/chat/ws")
+    await session.connect()
+    await session.send_json({"type": "auth", "token": user_headers["Authorization"][7:]})
+    assert (await session.receive_json())["type"] == "ready"
+    await session.close()
+
+@pytest.mark.parametrize("frame", [["auth"], "auth", 42, {"type": "auth"}])
+async def test_malformed_auth_message_closes_the_socket(app, frame):
+    event = await _rejected_auth(app, lambda session: session.send_json(frame))
+    assert event == {"type": "websocket.close", "code": 1008, "reason": "Authentication failed"}
+
+async def test_binary_auth_frame_closes_the_socket(app):
+    event = await _rejected_auth(app, lambda session: session.send_bytes(b'{"type": "auth"}'))
+    assert event["type"] == "websocket.close" and event["code"] == 1008
+
+async def test_binary_frame_is_answered_with_an_error(socket):
+    await socket.send_bytes(b"\x00\x01")
+    message = await socket.receive_json()
+    assert message["type"] == "error" and "text frame" in message["detail"]
+
+    await socket.send_json({"type": "ping"})
+    assert (await socket.receive_json())["type"] == "pong"
+
+@pytest.mark.parametrize("credits", [-1, 0, "8", 2.5, True])
+async def test_invalid_credits_are_rejected_before_rate_limiting(socket, monkeypatch, credits):
+    async def acquire(*args, **kwargs):
+        raise AssertionError("rate limiter should not be reached")
+
+    monkeypatch.setattr(chat.rate_limiter, "acquire", acquire)
+    await socket.send_json({
+        "type": "generate", "id": "g1", "credits": credits, "messages": [{"role": "user", "content": "hi"}]
+    })
+    message = await socket.receive_json()
+    assert message == {"type": "error", "id": "g1", "detail": "credits must be a positive integer"}
+
+async def test_generation_waits_for_credits(socket, mock_backend):
+    mock_backend("llama-3.1-8b", lambda request: stream_response(["a", "b", "c", "d"]))
+    await socket.send_json({
+        "type": "generate", "id": "g1", "credits": 2, "model": "llama-3.1-8b",
+        "messages": [{"role": "user", "content": "hi"}]
+    })
+    first = [await socket.receive_json(), await socket.receive_json()]
+    assert [message["content"] for message in first] == ["a", "b"]
+    with pytest.raises(TimeoutError):
+        await socket.receive_json(timeout=0.1)
+
+    await socket.send_json({"type": "credit", "id": "g1", "credits": 10})
+    rest, done = await socket.receive_until(lambda message: message.get("done"))
+    assert "".join(message["content"] for message in first + rest + [done]) == "abcd"
+    assert done["id"] == "g1" and done["conversation_id"]
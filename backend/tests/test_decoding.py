@@ -0,0 +1,76 @@
+import httpx
+import pytest
+
+from benchmarks.stub_server import StubBackend, serve
+from core.serialization import dumps
+from services.model_registry import Replica
+from services.providers import providers
+from services.providers.decoding import iter_lines, iter_ndjson, iter_sse_data
+from services.resilience import LLMBackendError
+from tests.helpers import sse_body
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+async def chunked(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+async def collect(stream):
+    return [item async for item in stream]
+
+def ndjson_body(tokens, prompt_tokens=3, eval_count=None) -> bytes:
+    lines = [{"message": {"role": "assistant", "content": token}, "done": False} for token in tokens]
+    lines.append({"done": True, "prompt_eval_count": prompt_tokens, "eval_count": eval_count or len(tokens)})
+    return b"".join(dumps(line) + b"\n" for line in lines)
+
+@pytest.mark.parametrize("size", [1, 3, 1024])
+async def test_lines_split_across_chunks(size):
+    lines = await collect(iter_lines(chunked(b"one\r\ntwo\n\nthree", size)))
+    assert lines == [b"one", b"two", b"", b"three"]
+
+async def test_sse_events_join_data_lines_and_skip_comments():
+    body = b": keep-alive\n\ndata: first\ndata:second\nevent: ignored\n\ndata: last"
+    assert await collect(iter_sse_data(chunked(body, 5))) == [b"first\nsecond", b"last"]
+
+async def test_ndjson_skips_blank_lines():
+    assert await collect(iter_ndjson(chunked(b'{"a": 1}\n\n  \n{"b": 2}\n', 4))) == [{"a": 1}, {"b": 2}]
+
+@pytest.mark.parametrize("name", ["vllm", "openai"])
+@pytest.mark.parametrize("size", [1, 7, 4096])
+async def test_sse_provider_stream(name, size):
+    chunks = await collect(providers.get(name).decode_stream(chunked(sse_body(["Hel", "lo"], total_tokens=12), size)))
+    assert [chunk["content"] for chunk in chunks] == ["Hel", "lo", ""]
+    assert chunks[-1]["done"] and chunks[-1]["tokens_used"] == 12
+
+@pytest.mark.parametrize("size", [1, 7, 4096])
+async def test_ndjson_provider_stream(size):
+    chunks = await collect(providers.get("ollama").decode_stream(chunked(ndjson_body(["Hel", "lo"]), size)))
+    assert [chunk["content"] for chunk in chunks] == ["Hel", "lo", ""]
+    assert chunks[-1]["done"] and chunks[-1]["tokens_used"] == 5
+
+async def test_truncated_and_failed_streams_raise():
+    truncated = sse_body(["a", "b"]).replace(b"data: [DONE]\n\n", b"")
+    with pytest.raises(httpx.RemoteProtocolError):
+        await collect(providers.get("vllm").decode_stream(chunked(truncated, 16)))
+    with pytest.raises(httpx.RemoteProtocolError):
+        await collect(providers.get("ollama").decode_stream(chunked(ndjson_body(["a"]).rsplit(b"\n", 2)[0], 16)))
+
+    with pytest.raises(LLMBackendError):
+        await collect(providers.get("vllm").decode_stream(chunked(b'data: {"error": "overloaded"}\n\n', 16)))
+    with pytest.raises(LLMBackendError):
+        await collect(providers.get("ollama").decode_stream(chunked(b'{"error": "model not found"}\n', 16)))
+
+@pytest.mark.parametrize("name,model", [("vllm", "llama-3.1-8b"), ("ollama", "ollama/llama3")])
+async def test_providers_against_a_local_stub_server(name, model):
+    provider = providers.get(name)
+    async with serve(StubBackend(latency_ms=1, token_ms=1, tokens=6)) as base_url:
+        replica = Replica(name, base_url)
+        try:
+            chunks = await collect(provider.stream(model, replica, MESSAGES, 0.7, 16))
+            completion = await provider.generate(model, replica, MESSAGES, 0.7, 16)
+        finally:
+            await provider._clients.pop(base_url).aclose()
+    expected = "".join(f"tok{index} " for index in range(6))
+    assert "".join(chunk["content"] for chunk in chunks) == expected
+    assert len(chunks) == 7 and chunks[-1]["tokens_used"] == 16
+    assert completion == {"content": expected, "tokens_used": 16, "model": model}
@@ -0,0 +1,89 @@
+from collections import Counter
+
+import pytest
+
+from core.config import settings
+from services.hash_ring import HashRing, hash64
+from services.llm_service import prefix_key
+from services.model_registry import Replica, model_registry
+
+KEYS = [f"conversation-{index}" for index in range(5000)]
+MODEL = "ring-model"
+
+def ring(names, vnodes=100):
+    return HashRing(names, lambda name: name, vnodes)
+
+def owners(hash_ring):
+    return {key: next(hash_ring.walk(key)) for key in KEYS}
+
+def test_hash_is_stable_across_processes():
+    # Pinned, so every worker (and every restart) builds the same ring
+    assert hash64("replica-a#0") == 0x776F6428BC76E208
+
+def test_walk_visits_every_node_once():
+    nodes = ["a", "b", "c", "d"]
+    order = list(ring(nodes).walk("some key"))
+    assert sorted(order) == nodes
+    assert list(ring(nodes).walk("some key")) == order
+    assert list(ring([]).walk("some key")) == []
+
+def test_keys_spread_evenly():
+    counts = Counter(owners(ring([f"replica-{index}" for index in range(5)])).values())
+    mean = len(KEYS) / 5
+    assert all(abs(count - mean) < 0.25 * mean for count in counts.values())
+
+def test_adding_a_node_only_moves_keys_to_it():
+    names = [f"replica-{index}" for index in range(5)]
+    before = owners(ring(names))
+    after = owners(ring(names + ["replica-5"]))
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == "replica-5" for key in moved)
+    assert 0.1 < len(moved) / len(KEYS) < 0.25  # about 1/6
+
+def test_removing_a_node_only_moves_its_keys():
+    names = [f"replica-{index}" for index in range(5)]
+    before = owners(ring(names))
+    after = owners(ring(names[1:]))
+    assert all(before[key] == "replica-0" for key in KEYS if before[key] != after[key])
+
+@pytest.fixture
+def replicas(monkeypatch):
+    installed = [Replica("vllm", f"http://ring-{index}.test") for index in range(4)]
+    monkeypatch.setitem(model_registry._replicas, MODEL, installed)
+    monkeypatch.setattr(settings, "LLM_AFFINITY_ROUTING", True)
+    monkeypatch.setattr(settings, "LLM_AFFINITY_LOAD_FACTOR", 1.25)
+    return installed
+
+def select(affinity):
+    replica = model_registry.select_replica(MODEL, affinity=affinity)
+    replica.breaker.release()
+    return replica
+
+def test_turns_of_a_conversation_share_a_replica(replicas):
+    system = {"role": "system", "content": "You are terse."}
+    first_turn = [system, {"role": "user", "content": "hi"}]
+    later_turn = first_turn + [{"role": "assistant", "content": "hello"}, {"role": "user", "content": "more"}]
+    assert prefix_key(first_turn) == prefix_key(later_turn)
+    assert select(prefix_key(first_turn)) is select(prefix_key(later_turn))
+
+    homes = Counter(select(prefix_key([{"role": "user", "content": f"chat {index}"}])) for index in range(400))
+    assert set(homes) == set(replicas)
+
+def test_a_busy_home_replica_spills_to_the_next_on_the_ring(replicas):
+    key = "hot prefix"
+    home, runner_up = list(model_registry._ring(MODEL).walk(key))[:2]
+    routed, spilled = model_registry.affinity_routed, model_registry.affinity_spilled
+    assert select(key) is home
+
+    # Within its fair share (1.25x the average) the home replica keeps the key
+    for replica in replicas:
+        replica.outstanding = 2
+    home.outstanding = 3
+    try:
+        assert select(key) is home
+        home.outstanding = 4
+        assert select(key) is runner_up
+    finally:
+        for replica in replicas:
+            replica.outstanding = 0
+    assert model_registry.affinity_routed - routed == 2 and model_registry.affinity_spilled - spilled == 1
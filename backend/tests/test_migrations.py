@@ -0,0 +1,26 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+
+from core.database import async_engine
+from core.migrations import initialize_database
+from models.runtime_config import RuntimeConfig
+
+async def _config_rows() -> int:
+    async with async_engine.connect() as conn:
+        return (await conn.execute(select(func.count()).select_from(RuntimeConfig))).scalar_one()
+
+async def test_initialize_is_idempotent(app):
+    async with async_engine.begin() as conn:
+        await conn.run_sync(initialize_database)
+    assert await _config_rows() == 1
+
+@pytest.mark.skipif(async_engine.dialect.name != "postgresql", reason="advisory locks are Postgres only")
+async def test_workers_starting_together_migrate_one_at_a_time(app):
+    async def start_worker():
+        async with async_engine.begin() as conn:
+            await conn.run_sync(initialize_database)
+
+    await asyncio.gather(*[start_worker() for _ in range(4)])
+    assert await _config_rows() == 1
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+
+import pytest
+from sqlalchemy import select
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+from models.conversation import Conversation, Message
+from services.model_registry import model_registry
+from services.prompt import PromptTooLarge, TokenCounter, assemble_prompt, token_counter
+
+def word_tokenizer(texts, add_special_tokens=False):
+    """One token per word"""
+    return {"input_ids": [text.split() for text in texts]}
+
+@pytest.fixture
+def word_model(monkeypatch):
+    """mistral-7b counts with a word tokenizer; other models are estimated"""
+    monkeypatch.setattr(settings, "MODEL_TOKENIZERS", {"mistral-7b": "test/words"})
+    monkeypatch.setitem(token_counter._tokenizers, "mistral-7b", word_tokenizer)
+    return "mistral-7b"
+
+async def test_a_cancelled_caller_does_not_restart_the_tokenizer_load(monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_TOKENIZERS", {"mistral-7b": "test/words"})
+    release = threading.Event()
+    loads = []
+
+    def load(name):
+        loads.append(name)
+        release.wait(5)
+        return word_tokenizer
+
+    counter = TokenCounter()
+    monkeypatch.setattr(counter, "_load", load)
+    first = asyncio.create_task(counter.count("mistral-7b", ["one two"]))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    await asyncio.gather(first, return_exceptions=True)
+
+    second = asyncio.create_task(counter.count("mistral-7b", ["one two three"]))
+    await asyncio.sleep(0.01)
+    release.set()
+    assert await second == [3]
+    assert loads == ["test/words"]
+    assert counter._tokenizers["mistral-7b"] is word_tokenizer and not counter._loading
+
+async def _conversation(user_id: int, contents) -> int:
+    async with AsyncSessionLocal() as db:
+        conversation = Conversation(user_id=user_id, model_name="llama-3.1-8b", title="t")
+        db.add(conversation)
+        await db.flush()
+        for i, content in enumerate(contents):
+            db.add(Message(conversation_id=conversation.id, role="user" if i % 2 == 0 else "assistant", content=content))
+        await db.commit()
+        return conversation.id
+
+async def _stored(conversation_id: int):
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Message.content_tokens, Message.content_tokenizer)
+            .where(Message.conversation_id == conversation_id)
+            .order_by(Message.id)
+        )
+        return [tuple(row) for row in result]
+
+async def test_counts_are_kept_per_tokenizer(make_user, word_model):
+    user_id, _ = await make_user()
+    text = "one two three four five six seven eight"  # 8 words, 39 characters
+    conversation_id = await _conversation(user_id, [text, text])
+    ask = [{"role": "user", "content": "next"}]
+
+    async with AsyncSessionLocal() as db:
+        await assemble_prompt(db, "llama-3.1-8b", ask, 16, conversation_id)
+    assert await _stored(conversation_id) == [(10, TokenCounter.ESTIMATE)] * 2
+
+    async with AsyncSessionLocal() as db:
+        await assemble_prompt(db, word_model, ask, 16, conversation_id)
+    assert await _stored(conversation_id) == [(8, "test/words")] * 2
+
+    async with AsyncSessionLocal() as db:
+        await assemble_prompt(db, "llama-3.1-8b", ask, 16, conversation_id)
+    assert await _stored(conversation_id) == [(10, TokenCounter.ESTIMATE)] * 2
+
+async def test_oldest_history_is_dropped_to_fit(make_user, word_model, monkeypatch):
+    user_id, _ = await make_user()
+    conversation_id = await _conversation(user_id, ["a " * 10, "b " * 10, "c " * 10, "d " * 10])
+    monkeypatch.setitem(model_registry.MODELS[word_model], "context_length", 60)
+
+    async with AsyncSessionLocal() as db:
+        prompt = await assemble_prompt(db, word_model, [{"role": "user", "content": "e"}], 16, conversation_id)
+    # 60 - (1 + 4 + 16) leaves 39 tokens: the two newest 14-token messages, then a user turn first
+    assert [message["content"].strip()[:1] for message in prompt] == ["c", "d", "e"]
+
+    with pytest.raises(PromptTooLarge):
+        async with AsyncSessionLocal() as db:
+            await assemble_prompt(db, word_model, [{"role": "user", "content": "x " * 50}], 16, conversation_id)
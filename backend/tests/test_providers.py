@@ -0,0 +1,63 @@
+import asyncio
+
+import httpx
+
+from benchmarks.stub_server import StubBackend, serve
+from core.config import settings
+from core.serialization import loads
+from services.model_registry import Replica
+from services.providers import providers
+from tests.helpers import completion, stream_response
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+async def test_pool_stats_count_requests_in_flight(mock_backend):
+    release = asyncio.Event()
+
+    async def handler(request):
+        await release.wait()
+        return stream_response(["a", "b"]) if loads(request.content).get("stream") else completion("done")
+
+    [replica] = mock_backend("mistral-7b", handler)
+    provider = providers.get("vllm")
+    key = f"vllm:{replica.endpoint}"
+
+    requests = [
+        asyncio.create_task(provider.generate("mistral-7b", replica, MESSAGES, 0.7, 16)) for _ in range(3)
+    ]
+    await asyncio.sleep(0.01)
+    # A mock transport has no connection pool to report on, or to hand out connections
+    assert provider.pool_stats()[key] == {"in_flight": 3, "in_use": 0, "waiting": 3}
+    release.set()
+    await asyncio.gather(*requests)
+    assert provider.pool_stats()[key] == {"in_flight": 0, "in_use": 0, "waiting": 0}
+
+    async for _ in provider.stream("mistral-7b", replica, MESSAGES, 0.7, 16):
+        assert provider.pool_stats()[key]["in_flight"] == 1
+    assert provider.pool_stats()[key]["in_flight"] == 0
+
+async def test_pool_stats_read_httpx_connections_when_available():
+    provider = providers.get("vllm")
+    client = provider._create_client("http://pool.test")
+    try:
+        assert provider._connections(client) == {"connections": 0, "idle": 0}
+    finally:
+        await client.aclose()
+    assert provider._connections(httpx.AsyncClient(transport=httpx.MockTransport(stream_response))) is None
+
+async def test_pool_stats_count_requests_waiting_for_a_connection(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MAX_CONNECTIONS", 1)
+    provider = providers.get("vllm")
+    async with serve(StubBackend(latency_ms=200, tokens=4)) as base_url:
+        replica = Replica("vllm", base_url)
+        key = f"vllm:{base_url}"
+        try:
+            requests = [
+                asyncio.create_task(provider.generate("llama-3.1-8b", replica, MESSAGES, 0.7, 16)) for _ in range(3)
+            ]
+            await asyncio.sleep(0.1)
+            assert provider.pool_stats()[key] == {"in_flight": 3, "in_use": 1, "waiting": 2, "connections": 1, "idle": 0}
+            await asyncio.gather(*requests)
+            assert provider.pool_stats()[key] == {"in_flight": 0, "in_use": 0, "waiting": 0, "connections": 1, "idle": 1}
+        finally:
+            await provider._clients.pop(base_url).aclose()
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from core.config import settings
+from services.rate_limiter import RateLimiter
+from tests.helpers import completion
+
+USER = 42
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    """Rate limiting on, with overrides the tests fill in"""
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(settings, "RATE_LIMIT_USER_OVERRIDES", {})
+    monkeypatch.setattr(settings, "RATE_LIMIT_MODEL_OVERRIDES", {})
+    return settings
+
+def limit_user(requests_per_minute=60, burst=3, tokens_per_day=0, user=USER):
+    settings.RATE_LIMIT_USER_OVERRIDES[str(user)] = {
+        "requests_per_minute": requests_per_minute, "burst": burst, "tokens_per_day": tokens_per_day
+    }
+
+async def test_burst_then_retry_after_one_interval(redis):
+    limit_user(requests_per_minute=60, burst=3)
+    limiter = RateLimiter(redis)
+    results = [await limiter.acquire(USER, "m") for _ in range(4)]
+    assert [result.allowed for result in results] == [True, True, True, False]
+    assert [result.remaining for result in results[:3]] == [2, 1, 0]
+
+    denied = results[-1]
+    assert denied.reason == "requests_per_minute" and 0.9 < denied.retry_after <= 1.0
+    assert denied.headers()["Retry-After"] == "1" and denied.headers()["X-RateLimit-Remaining"] == "0"
+
+async def test_requests_refill_at_the_emission_interval(redis):
+    limit_user(requests_per_minute=600, burst=1)
+    limiter = RateLimiter(redis)
+    assert (await limiter.acquire(USER, "m")).allowed
+    denied = await limiter.acquire(USER, "m")
+    assert not denied.allowed and denied.retry_after <= 0.1
+    await asyncio.sleep(denied.retry_after + 0.02)
+    assert (await limiter.acquire(USER, "m")).allowed
+
+async def test_workers_share_one_count_and_remember_denials(redis):
+    limit_user(requests_per_minute=60, burst=2)
+    first, second = RateLimiter(redis), RateLimiter(redis)
+    assert (await first.acquire(USER, "m")).allowed
+    assert (await second.acquire(USER, "m")).allowed
+    # Neither worker is over the limit on its own; the shared count is
+    assert not (await first.acquire(USER, "m")).allowed
+    assert first.stats()["redis_rejections"] == 1
+
+    # The denial is remembered, so retries are turned away without Redis
+    assert not (await first.acquire(USER, "m")).allowed
+    assert first.stats()["local_rejections"] == 1 and first.stats()["redis_rejections"] == 1
+
+async def test_token_budget_is_debited_with_actual_usage(redis):
+    limit_user(requests_per_minute=6000, burst=100, tokens_per_day=100)
+    first, second = RateLimiter(redis), RateLimiter(redis)
+    assert (await first.acquire(USER, "m")).allowed
+    await first.debit(USER, "m", 60)
+    assert (await second.acquire(USER, "m")).allowed
+    await second.debit(USER, "m", 40)
+
+    denied = await first.acquire(USER, "m")
+    assert not denied.allowed and denied.reason == "tokens_per_day" and denied.limit == 100
+    # Another worker learns it from Redis
+    denied = await RateLimiter(redis).acquire(USER, "m")
+    assert not denied.allowed and denied.reason == "tokens_per_day" and denied.retry_after > 0
+
+async def test_model_override_adds_a_scope_and_denials_take_nothing(redis):
+    limit_user(requests_per_minute=60, burst=10)
+    settings.RATE_LIMIT_MODEL_OVERRIDES["big"] = {"requests_per_minute": 60, "burst": 1}
+    limiter = RateLimiter(redis)
+    assert (await limiter.acquire(USER, "big")).allowed
+    denied = await limiter.acquire(USER, "big")
+    assert not denied.allowed and denied.limit == 60
+    assert (await limiter.acquire(USER, "small")).allowed
+
+    # The denied request did not count against the user's own limit
+    after = await RateLimiter(redis).acquire(USER, "small")
+    assert after.remaining == 7
+    assert (await limiter.acquire(USER + 1, "big")).allowed
+
+async def test_script_is_reloaded_after_a_redis_restart(redis):
+    limit_user(requests_per_minute=60, burst=5)
+    limiter = RateLimiter(redis)
+    await limiter.acquire(USER, "m")
+    await redis.script_flush()
+    result = await limiter.acquire(USER, "m")
+    assert result.allowed and result.remaining == 3
+
+class DownRedis:
+    async def evalsha(self, *args):
+        raise RedisConnectionError("down")
+
+    async def script_load(self, script):
+        raise RedisConnectionError("down")
+
+async def test_local_limits_apply_while_redis_is_down():
+    limit_user(requests_per_minute=60, burst=2)
+    limiter = RateLimiter(DownRedis())
+    results = [(await limiter.acquire(USER, "m")).allowed for _ in range(3)]
+    assert results == [True, True, False]
+    assert limiter.stats()["redis_errors"] == 2
+    await limiter.debit(USER, "m", 10)  # dropped, not raised
+
+async def test_chat_route_returns_429_with_retry_after(client, make_user, mock_backend):
+    user_id, headers = await make_user()
+    limit_user(requests_per_minute=60, burst=1, user=user_id)
+    mock_backend("llama-3.1-8b", lambda request: completion("hi"))
+    request = {"messages": [{"role": "user", "content": "hi"}], "model": "llama-3.1-8b", "cache": False}
+
+    allowed = await client.post("/api/chat/completions", headers=headers, json=request)
+    assert allowed.status_code == 200 and allowed.headers["X-RateLimit-Remaining"] == "0"
+    denied = await client.post("/api/chat/completions", headers=headers, json=request)
+    assert denied.status_code == 429 and denied.headers["Retry-After"] == "1"
@@ -0,0 +1,195 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from core.config import settings
+from services.llm_service import LLMService
+from services.resilience import (
+    BackendRejectedRequest, CircuitBreaker, Hedger, LLMBackendError, RetryBudget, is_retryable
+)
+from tests.helpers import completion, stream_response
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+def _opened(breaker: CircuitBreaker, ago: float) -> CircuitBreaker:
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker.opened_at = time.monotonic() - ago
+    return breaker
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.available()
+    assert not breaker.acquire()
+
+def test_half_open_hands_out_at_most_the_probe_cap():
+    breaker = _opened(CircuitBreaker(failure_threshold=1, reset_timeout=30, half_open_probes=2), ago=31)
+    assert breaker.available()
+    assert breaker.state == CircuitBreaker.OPEN  # checking does not change state
+
+    assert breaker.acquire()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.acquire()
+    assert not breaker.acquire()
+    assert not breaker.available()
+
+    breaker.release()
+    assert breaker.acquire()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.acquire()
+
+    breaker.opened_at -= 31
+    assert breaker.acquire()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.acquire() and breaker.acquire()
+
+def test_probe_that_never_reports_back_frees_its_slot():
+    breaker = _opened(CircuitBreaker(failure_threshold=1, reset_timeout=30), ago=31)
+    assert breaker.acquire()
+    assert not breaker.acquire()
+    breaker.probed_at -= 31
+    assert breaker.acquire()
+
+def test_retry_budget_caps_retries_to_a_share_of_requests():
+    budget = RetryBudget(ratio=0.25, min_per_second=0, max_tokens=2)
+    assert budget.try_spend() and budget.try_spend()
+    assert not budget.try_spend()
+    for _ in range(4):
+        budget.record_request()
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    assert budget.exhausted == 2
+
+async def test_hedge_wins_over_a_slow_primary():
+    hedger = Hedger()
+
+    async def slow():
+        await asyncio.sleep(1)
+        return "primary"
+
+    async def fast():
+        return "backup"
+
+    assert await hedger.run(slow, lambda: fast(), delay=0.01) == "backup"
+    assert hedger.hedges == 1 and hedger.hedge_wins == 1
+    # A backup that declines (no target or budget) leaves the primary to finish
+    assert await hedger.run(lambda: fast(), lambda: None, delay=0) == "backup"
+
+async def test_recovering_replica_gets_only_the_probe_requests(mock_backend, monkeypatch):
+    """With one half-open probe, concurrent requests must not all reach a recovering backend"""
+    monkeypatch.setattr(settings, "MODEL_FALLBACKS", {})
+    calls = 0
+
+    async def handler(request):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return completion("recovered")
+
+    [replica] = mock_backend("mistral-7b", handler)
+    replica.breaker.half_open_probes = 1
+    _opened(replica.breaker, ago=settings.LLM_BREAKER_RESET_SECONDS + 1)
+
+    service = LLMService("mistral-7b")
+    results = await asyncio.gather(
+        *[service.generate(MESSAGES, temperature=0.7, max_tokens=16) for _ in range(20)],
+        return_exceptions=True
+    )
+    assert calls == 1
+    assert sum(1 for result in results if isinstance(result, dict)) == 1
+    assert all(isinstance(result, LLMBackendError) for result in results if not isinstance(result, dict))
+    assert replica.breaker.state == CircuitBreaker.CLOSED
+
+async def test_rejected_request_does_not_fall_back(mock_backend, monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_FALLBACKS", {"llama-3.1-70b": ["llama-3.1-8b"]})
+    calls = []
+
+    def primary(request):
+        calls.append("llama-3.1-70b")
+        return httpx.Response(400, json={"error": {"message": "max_tokens is too large"}})
+
+    def fallback(request):
+        calls.append("llama-3.1-8b")
+        return completion("from fallback")
+
+    mock_backend("llama-3.1-70b", primary)
+    mock_backend("llama-3.1-8b", fallback)
+
+    with pytest.raises(BackendRejectedRequest) as raised:
+        await LLMService("llama-3.1-70b").generate(MESSAGES, temperature=0.7, max_tokens=16)
+    assert calls == ["llama-3.1-70b"]
+    assert raised.value.status_code == 400 and raised.value.client_fault
+    assert "max_tokens is too large" in str(raised.value)
+
+    chunks = [chunk async for chunk in LLMService("llama-3.1-70b").stream_generate(MESSAGES, temperature=0.7)]
+    assert calls == ["llama-3.1-70b", "llama-3.1-70b"]
+    assert chunks[-1]["error"] and "rejected" in chunks[-1]["content"]
+
+async def test_backend_fault_falls_back_to_the_next_model(mock_backend, monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_FALLBACKS", {"llama-3.1-70b": ["llama-3.1-8b"]})
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 0)
+    mock_backend("llama-3.1-70b", lambda request: httpx.Response(503))
+    mock_backend("llama-3.1-8b", lambda request: completion("from fallback"))
+
+    result = await LLMService("llama-3.1-70b").generate(MESSAGES, temperature=0.7, max_tokens=16)
+    assert result["content"] == "from fallback" and result["model"] == "llama-3.1-8b"
+
+    mock_backend("llama-3.1-8b", lambda request: stream_response(["fall", "back"]))
+    chunks = [chunk async for chunk in LLMService("llama-3.1-70b").stream_generate(MESSAGES, temperature=0.7)]
+    assert "".join(chunk["content"] for chunk in chunks) == "fallback"
+    assert chunks[-1]["model"] == "llama-3.1-8b"
+
+async def test_retries_stop_once_every_replica_has_failed(mock_backend, monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_FALLBACKS", {})
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 5)
+    monkeypatch.setattr(settings, "LLM_HEDGING_ENABLED", False)
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.host)
+        return httpx.Response(503)
+
+    replicas = mock_backend("mistral-7b", handler, replicas=2)
+    with pytest.raises(LLMBackendError):
+        await LLMService("mistral-7b").generate(MESSAGES, temperature=0.7, max_tokens=16)
+    # One attempt per replica, not a retry back onto one that already failed
+    assert sorted(calls) == sorted(httpx.URL(replica.endpoint).host for replica in replicas)
+
+    calls.clear()
+    chunks = [chunk async for chunk in LLMService("mistral-7b").stream_generate(MESSAGES, temperature=0.7)]
+    assert chunks[-1]["error"] and len(calls) == 2 and len(set(calls)) == 2
+
+async def test_completion_endpoint_reports_rejections_without_retry_advice(client, user_headers, mock_backend):
+    mock_backend("llama-3.1-70b", lambda request: httpx.Response(400, json={"error": "context too long"}))
+    response = await client.post(
+        "/api/chat/completions", headers=user_headers,
+        json={"messages": MESSAGES, "model": "llama-3.1-70b", "temperature": 0.7}
+    )
+    assert response.status_code == 400
+    assert "context too long" in response.json()["detail"]
+    assert "retry-after" not in response.headers
+
+    mock_backend("llama-3.1-70b", lambda request: httpx.Response(404, json={"error": "model not found"}))
+    response = await client.post(
+        "/api/chat/completions", headers=user_headers,
+        json={"messages": MESSAGES, "model": "llama-3.1-70b", "temperature": 0.7}
+    )
+    assert response.status_code == 502
+    assert "retry-after" not in response.headers
+
+def test_retryable_errors():
+    request = httpx.Request("POST", "http://backend.test")
+    assert is_retryable(httpx.HTTPStatusError("", request=request, response=httpx.Response(503)))
+    assert is_retryable(httpx.HTTPStatusError("", request=request, response=httpx.Response(429)))
+    assert not is_retryable(httpx.HTTPStatusError("", request=request, response=httpx.Response(400)))
+    assert is_retryable(httpx.ConnectError("refused"))
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+import fakeredis
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from services.response_cache import ResponseCache, SemanticIndex, canonicalize_messages, hashed_embedding
+
+MESSAGES = [{"role": "user", "content": "What is the capital of France?"}]
+PARAMS = {"temperature": 0, "max_tokens": 64}
+RESPONSE = {"content": "Paris", "tokens_used": 12, "model": "llama-3.1-8b"}
+
+class SlowRedis:
+    """Async Redis whose reads take ``delay`` seconds (a slow network round trip)"""
+
+    def __init__(self, redis, delay: float):
+        self._redis = redis
+        self.delay = delay
+
+    async def get(self, key):
+        await asyncio.sleep(self.delay)
+        return await self._redis.get(key)
+
+    async def setex(self, key, ttl, value):
+        return await self._redis.setex(key, ttl, value)
+
+class BrokenRedis:
+    async def get(self, key):
+        raise RedisConnectionError("connection refused")
+
+    async def setex(self, key, ttl, value):
+        raise RedisConnectionError("connection refused")
+
+async def test_round_trip_and_canonical_key(redis):
+    cache = ResponseCache(redis=redis)
+    assert await cache.get("llama-3.1-8b", MESSAGES, PARAMS) is None
+    await cache.set("llama-3.1-8b", MESSAGES, PARAMS, RESPONSE)
+
+    # Whitespace, role case and an empty system prompt do not change the key
+    variant = [{"role": "system", "content": " "}, {"role": "USER", "content": "What is the capital of France?  \r\n"}]
+    assert await cache.get("llama-3.1-8b", variant, {"max_tokens": 64, "temperature": 0.0}) == RESPONSE
+    assert await cache.get("llama-3.1-70b", MESSAGES, PARAMS) is None
+    assert await cache.get("llama-3.1-8b", MESSAGES, {**PARAMS, "max_tokens": 65}) is None
+    assert cache.stats()["hits"] == 1
+    assert await redis.ttl(cache.key_for("llama-3.1-8b", MESSAGES, PARAMS)) > 0
+
+async def test_sampled_requests_are_cached_only_on_opt_in(redis):
+    cache = ResponseCache(redis=redis)
+    sampled = {**PARAMS, "temperature": 0.7}
+    await cache.set("llama-3.1-8b", MESSAGES, sampled, RESPONSE)
+    assert await cache.get("llama-3.1-8b", MESSAGES, sampled) is None
+    await cache.set("llama-3.1-8b", MESSAGES, sampled, RESPONSE, cache=True)
+    assert await cache.get("llama-3.1-8b", MESSAGES, sampled, cache=True) == RESPONSE
+
+async def test_redis_errors_fail_open():
+    cache = ResponseCache(redis=BrokenRedis())
+    await cache.set("llama-3.1-8b", MESSAGES, PARAMS, RESPONSE)
+    assert await cache.get("llama-3.1-8b", MESSAGES, PARAMS) is None
+    assert cache.stats()["errors"] == 2
+
+async def test_semantic_tier_maps_near_duplicates(redis):
+    cache = ResponseCache(redis=redis, semantic_index=SemanticIndex(hashed_embedding, 0.8, 100))
+    await cache.set("llama-3.1-8b", MESSAGES, PARAMS, RESPONSE)
+    near = [{"role": "user", "content": "what is the capital of france"}]
+    assert await cache.get("llama-3.1-8b", near, PARAMS) == RESPONSE
+    assert cache.stats()["similarity_hits"] == 1
+    assert canonicalize_messages(near) != canonicalize_messages(MESSAGES)
+
+async def test_semantic_hits_need_the_same_conversation_before_the_final_turn(redis):
+    cache = ResponseCache(redis=redis, semantic_index=SemanticIndex(hashed_embedding, 0.8, 100))
+    history = [
+        {"role": "system", "content": "You are a geography tutor. Answer in one word."},
+        {"role": "user", "content": "Name a large country in Europe, please."},
+        {"role": "assistant", "content": "France"}
+    ]
+    await cache.set("llama-3.1-8b", history + MESSAGES, PARAMS, RESPONSE)
+
+    # A long shared history does not make a different question look similar
+    other_question = [{"role": "user", "content": "What is the population of France?"}]
+    assert await cache.get("llama-3.1-8b", history + other_question, PARAMS) is None
+    # The same question after a different conversation is not the same request
+    assert await cache.get("llama-3.1-8b", history[:1] + MESSAGES, PARAMS) is None
+    assert await cache.get("llama-3.1-8b", MESSAGES, PARAMS) is None
+
+    near = [{"role": "user", "content": "what is the capital of france"}]
+    assert await cache.get("llama-3.1-8b", history + near, PARAMS) == RESPONSE
+    assert cache.stats()["similarity_hits"] == 1
+
+async def test_streams_keep_flowing_while_a_cache_read_is_slow():
+    """A slow Redis round trip must not stall other work on the event loop"""
+    cache = ResponseCache(redis=SlowRedis(fakeredis.FakeAsyncRedis(decode_responses=True), delay=0.5))
+    gaps = []
+
+    async def stream(tokens: int):
+        last = time.monotonic()
+        for _ in range(tokens):
+            await asyncio.sleep(0.01)
+            now = time.monotonic()
+            gaps.append(now - last)
+            last = now
+
+    started = time.monotonic()
+    lookup = asyncio.create_task(cache.get("llama-3.1-8b", MESSAGES, PARAMS))
+    await asyncio.gather(*[stream(40) for _ in range(5)])
+    assert await lookup is None
+    # 40 ticks of 10ms each ran while the lookup was pending
+    assert time.monotonic() - started < 0.6
+    assert max(gaps) < 0.1
@@ -0,0 +1,56 @@
+import pytest
+
+from core.config import settings
+from services.model_registry import model_registry
+from services.rate_limiter import rate_limiter
+from services.runtime_config import runtime_config
+from services.scheduler import admission_scheduler
+from tests.helpers import WebSocketSession
+
+@pytest.fixture
+async def set_config(client, admin_headers):
+    """Saves config changes through the admin API and puts the original config back afterwards"""
+    original = (await client.get("/api/admin/config", headers=admin_headers)).json()
+
+    async def apply(**changes):
+        current = (await client.get("/api/admin/config", headers=admin_headers)).json()
+        changes["rate_limits"] = {**current["rate_limits"], **changes.get("rate_limits", {})}
+        response = await client.post("/api/admin/config", headers=admin_headers, json={**current, **changes})
+        assert response.status_code == 200, response.text
+
+    yield apply
+    current = (await client.get("/api/admin/config", headers=admin_headers)).json()
+    await client.post("/api/admin/config", headers=admin_headers, json={**original, "version": current["version"]})
+
+async def test_limits_come_from_the_snapshot_not_settings(set_config):
+    environment = settings.SCHEDULER_BACKEND_CONCURRENCY
+    await set_config(rate_limits={"backend_concurrency": 3, "requests_per_minute": 7})
+
+    assert runtime_config.snapshot.rate_limits["backend_concurrency"] == 3
+    assert admission_scheduler.capacity("llama-3.1-8b") == 3 * len(model_registry.get_replicas("llama-3.1-8b"))
+    assert rate_limiter.limit_for(1).requests_per_minute == 7
+    assert settings.SCHEDULER_BACKEND_CONCURRENCY == environment
+
+async def test_stale_version_is_rejected(client, admin_headers, set_config):
+    config = (await client.get("/api/admin/config", headers=admin_headers)).json()
+    await set_config(default_model=config["default_model"])
+    response = await client.post("/api/admin/config", headers=admin_headers, json=config)
+    assert response.status_code == 409
+
+async def test_maintenance_mode(app, client, user_headers, set_config):
+    await set_config(maintenance_mode=True)
+    origin = settings.ALLOWED_ORIGINS[0]
+
+    response = await client.get("/api/chat/conversations", headers={**user_headers, "Origin": origin})
+    assert response.status_code == 503
+    assert response.headers["retry-after"]
+    assert response.headers["access-control-allow-origin"] == origin
+    assert (await client.get("/health")).status_code == 200
+
+    socket = WebSocketSession(app, "/api/chat/ws", user_headers)
+    assert (await socket.connect())["type"] == "websocket.accept"
+    assert await socket.next_event() == {"type": "websocket.close", "code": 1013, "reason": "Under maintenance"}
+    await socket.close()
+
+    await set_config(maintenance_mode=False)
+    assert (await client.get("/api/chat/conversations", headers=user_headers)).status_code == 200
@@ -0,0 +1,103 @@
+import asyncio
+import time
+from types import MappingProxyType
+
+import pytest
+
+from services.runtime_config import runtime_config
+from services.scheduler import BATCH, AdmissionScheduler, Overloaded, Ticket
+
+MODEL = "test-model"  # not in the registry, so its capacity is one replica's worth
+
+@pytest.fixture
+def limits(monkeypatch):
+    """Runs the scheduler with the given runtime config limits"""
+    def apply(**values):
+        rate_limits = MappingProxyType({**runtime_config.snapshot.rate_limits, **values})
+        monkeypatch.setattr(runtime_config, "snapshot", runtime_config.snapshot._replace(rate_limits=rate_limits))
+    return apply
+
+class Backend:
+    """Holds admitted requests until released and records the order they started in"""
+
+    def __init__(self, scheduler: AdmissionScheduler):
+        self.scheduler = scheduler
+        self.started = []
+        self.release = asyncio.Event()
+
+    async def request(self, ticket: Ticket, cost: int = 100, label=None):
+        async with self.scheduler.slot(MODEL, ticket, cost):
+            self.started.append(label if label is not None else ticket.user_id)
+            await self.release.wait()
+
+    async def queue(self, *requests) -> list:
+        """Start requests one at a time so they are tagged in order"""
+        tasks = []
+        for request in requests:
+            tasks.append(asyncio.create_task(request))
+            await asyncio.sleep(0)
+        return tasks
+
+async def test_users_share_slots_fairly(limits):
+    limits(backend_concurrency=1)
+    backend = Backend(AdmissionScheduler())
+    tasks = await backend.queue(
+        backend.request(Ticket(0)),  # holds the only slot
+        backend.request(Ticket(1), label="a1"),
+        backend.request(Ticket(1), label="a2"),
+        backend.request(Ticket(1), label="a3"),
+        backend.request(Ticket(2), label="b1")
+    )
+    backend.release.set()
+    await asyncio.gather(*tasks)
+    assert backend.started == [0, "a1", "b1", "a2", "a3"]
+
+async def test_interactive_requests_overtake_batch(limits):
+    limits(backend_concurrency=1, interactive_weight=4, batch_weight=1)
+    backend = Backend(AdmissionScheduler())
+    tasks = await backend.queue(
+        backend.request(Ticket(0)),
+        *[backend.request(Ticket(1, BATCH), label="batch") for _ in range(3)],
+        *[backend.request(Ticket(2), label="chat") for _ in range(3)]
+    )
+    backend.release.set()
+    await asyncio.gather(*tasks)
+    assert backend.started[1:] == ["batch", "chat", "chat", "chat", "batch", "batch"]
+
+async def test_full_queue_sheds(limits):
+    limits(backend_concurrency=1, max_queue=1)
+    scheduler = AdmissionScheduler()
+    backend = Backend(scheduler)
+    tasks = await backend.queue(backend.request(Ticket(0)), backend.request(Ticket(1)))
+    with pytest.raises(Overloaded):
+        await backend.request(Ticket(2))
+    assert scheduler.stats()["shed"]["queue_full"] == 1
+    backend.release.set()
+    await asyncio.gather(*tasks)
+
+async def _give_up(backend: Backend, how: str):
+    """A request from user 1 that is tagged but never starts"""
+    if how == "deadline":
+        with pytest.raises(Overloaded):
+            await backend.request(Ticket(1, deadline=time.monotonic() + 0.02))
+    else:
+        task = asyncio.create_task(backend.request(Ticket(1)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+@pytest.mark.parametrize("how", ["deadline", "cancelled"])
+async def test_request_that_never_started_is_not_charged(limits, how):
+    limits(backend_concurrency=1)
+    scheduler = AdmissionScheduler()
+    backend = Backend(scheduler)
+    [holder] = await backend.queue(backend.request(Ticket(0)))
+    await _give_up(backend, how)
+
+    # User 1 queued first, so it goes first unless the abandoned request was still charged
+    tasks = await backend.queue(backend.request(Ticket(1)), backend.request(Ticket(2)))
+    backend.release.set()
+    await asyncio.gather(holder, *tasks)
+    assert backend.started == [0, 1, 2]
+    stats = scheduler.stats()["models"][MODEL]
+    assert stats["in_flight"] == 0 and stats["waiting"] == 0
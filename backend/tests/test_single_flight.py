@@ -0,0 +1,160 @@
+import asyncio
+
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from core.config import settings
+from services.single_flight import SingleFlight, StreamBroadcast
+
+RESULT = {"content": "shared", "tokens_used": 3}
+
+class BrokenPubSub:
+    async def psubscribe(self, *patterns):
+        raise RedisConnectionError("connection refused")
+
+    async def punsubscribe(self, *patterns):
+        raise RedisConnectionError("connection refused")
+
+    async def aclose(self):
+        pass
+
+class NoPubSubRedis:
+    """Locks work, but subscribing fails"""
+
+    def __init__(self, redis):
+        self._redis = redis
+
+    def __getattr__(self, name):
+        return getattr(self._redis, name)
+
+    def pubsub(self):
+        return BrokenPubSub()
+
+@pytest.fixture
+def distributed(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_SINGLE_FLIGHT_DISTRIBUTED", True)
+    monkeypatch.setattr(settings, "LLM_SINGLE_FLIGHT_TIMEOUT", 2.0)
+
+async def test_local_callers_share_one_call():
+    flight = SingleFlight()
+    calls = 0
+
+    async def generate():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        return RESULT
+
+    results = await asyncio.gather(*[flight.do("key", generate) for _ in range(10)])
+    assert results == [RESULT] * 10
+    assert calls == 1
+    assert flight.stats()["local_followers"] == 9
+
+async def test_followers_on_another_worker_share_one_subscription(redis, distributed):
+    leader_worker, follower_worker = SingleFlight(redis=redis), SingleFlight(redis=redis)
+    release = asyncio.Event()
+    calls = []
+
+    def generate(key):
+        async def fn():
+            calls.append(key)
+            await release.wait()
+            return {**RESULT, "key": key}
+        return fn
+
+    keys = [f"key-{i}" for i in range(30)]
+    leaders = [asyncio.create_task(leader_worker.do(key, generate(key))) for key in keys]
+    await asyncio.sleep(0.01)
+    followers = [asyncio.create_task(follower_worker.do(key, generate(key))) for key in keys]
+    while follower_worker.stats()["remote_waiting"] < len(keys):
+        await asyncio.sleep(0.01)
+
+    # 30 waiting followers, one subscriber connection
+    assert await redis.pubsub_numpat() == 1
+    release.set()
+    results = await asyncio.gather(*followers)
+    assert [result["key"] for result in results] == keys
+    await asyncio.gather(*leaders)
+    assert sorted(calls) == sorted(keys)
+    assert follower_worker.stats()["remote_waiting"] == 0
+
+    await follower_worker.close()
+    assert await redis.pubsub_numpat() == 0
+
+async def test_followers_generate_when_the_leader_fails(redis, distributed):
+    leader_worker, follower_worker = SingleFlight(redis=redis), SingleFlight(redis=redis)
+    started = asyncio.Event()
+
+    async def failing():
+        started.set()
+        await asyncio.sleep(0.05)
+        raise RuntimeError("backend down")
+
+    async def own():
+        return RESULT
+
+    leader = asyncio.create_task(leader_worker.do("key", failing))
+    await started.wait()
+    assert await follower_worker.do("key", own) == RESULT
+    with pytest.raises(RuntimeError):
+        await leader
+    await follower_worker.close()
+
+async def test_follower_uses_a_result_published_before_it_waited(redis, distributed):
+    worker = SingleFlight(redis=redis)
+    await redis.set(f"{SingleFlight.lock_prefix}:key", "someone-else")
+
+    async def recheck():
+        return RESULT
+
+    async def own():
+        raise AssertionError("should have used the cached result")
+
+    assert await worker.do("key", own, recheck=recheck) == RESULT
+    await worker.close()
+
+async def test_follower_generates_when_it_cannot_subscribe(redis, distributed):
+    worker = SingleFlight(redis=NoPubSubRedis(redis))
+    await redis.set(f"{SingleFlight.lock_prefix}:key", "someone-else")
+
+    async def own():
+        return RESULT
+
+    assert await worker.do("key", own) == RESULT
+    assert worker.stats()["remote_followers"] == 1
+
+async def test_stream_followers_replay_and_share_one_upstream():
+    flight = SingleFlight()
+    upstream_calls = 0
+
+    async def factory():
+        nonlocal upstream_calls
+        upstream_calls += 1
+        for i in range(5):
+            await asyncio.sleep(0.005)
+            yield {"content": str(i)}
+
+    async def read():
+        return "".join([chunk["content"] async for chunk in flight.stream("key", factory)])
+
+    first = asyncio.create_task(read())
+    await asyncio.sleep(0.012)
+    assert await asyncio.gather(first, read()) == ["01234", "01234"]
+    assert upstream_calls == 1
+
+async def test_broadcast_producer_waits_for_slow_readers():
+    broadcast = StreamBroadcast(max_lag=2)
+    reader = broadcast.subscribe()
+    broadcast.publish({"content": "a"})
+    assert (await reader.__anext__())["content"] == "a"
+    broadcast.publish({"content": "b"})
+    broadcast.publish({"content": "c"})
+
+    waiting = asyncio.create_task(broadcast.wait_for_readers())
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+    # A reader counts as past a chunk once it asks for the next one
+    assert (await reader.__anext__())["content"] == "b"
+    assert (await reader.__anext__())["content"] == "c"
+    await asyncio.wait_for(waiting, 1)
+    await reader.aclose()
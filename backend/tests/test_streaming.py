@@ -0,0 +1,146 @@
+import asyncio
+
+import httpx
+import pytest
+
+from benchmarks.stub_server import StubBackend, serve
+from core.config import settings
+from core.serialization import dumps, loads
+from services.model_registry import Replica, model_registry
+from services.providers import providers
+from services.streaming import StreamChunk, StreamTee, coalesce_deltas, replay_stream, sse_frame, stream_stats
+from tests.helpers import stream_response
+
+CHAT = {"messages": [{"role": "user", "content": "hi"}], "model": "llama-3.1-8b", "cache": False}
+
+async def timed(items):
+    """Yield each ``(delay, chunk)`` item's chunk after its delay"""
+    for delay, chunk in items:
+        await asyncio.sleep(delay)
+        yield chunk
+
+def delta(content):
+    return StreamChunk(content=content, done=False)
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+def test_chunks_encode_their_frame_once():
+    chunk = StreamChunk(content="hé", done=False)
+    frame = sse_frame(chunk)
+    assert frame == b'data: {"content":"h\xc3\xa9","done":false}\n\n'
+    assert sse_frame(chunk) is frame
+    assert sse_frame({"error": "boom"}) == b'data: {"error":"boom"}\n\n'
+
+async def test_coalescing_sends_the_first_delta_at_once_and_merges_the_rest():
+    chunks = [
+        (0, delta("a")), (0, delta("b")), (0, delta("c")), (0.05, delta("d")), (0, StreamChunk(content="", done=True))
+    ]
+    merged = await collect(coalesce_deltas(timed(chunks), interval=0.02, max_chars=100))
+    assert [chunk["content"] for chunk in merged] == ["a", "bc", "d", ""]
+    assert merged[-1]["done"]
+
+async def test_coalescing_flushes_at_max_chars():
+    chunks = [(0, delta(text)) for text in ("first", "aaa", "bbb", "ccc", "d")]
+    merged = await collect(coalesce_deltas(timed(chunks), interval=10, max_chars=6))
+    assert [chunk["content"] for chunk in merged] == ["first", "aaabbb", "cccd"]
+
+async def test_coalescing_keeps_other_chunks_in_order():
+    chunks = [(0, delta("a")), (0, delta("b")), (0, {"content": "", "done": False, "model": "fallback"}), (0, delta("c"))]
+    merged = await collect(coalesce_deltas(timed(chunks), interval=10, max_chars=100))
+    assert [chunk["content"] for chunk in merged] == ["a", "b", "", "c"]
+    assert merged[2]["model"] == "fallback"
+
+async def test_tee_assembles_only_completed_streams():
+    tee = StreamTee()
+    final = StreamChunk(content="", done=True, tokens_used=7)
+    await collect(tee.tee(timed([(0, delta("Hel")), (0, delta("lo")), (0, final)])))
+    assert tee.completed and tee.content == "Hello" and tee.tokens_used == 7
+    assert tee.as_response("m") == {"content": "Hello", "tokens_used": 7, "model": "m"}
+
+    failed = StreamTee()
+    await collect(failed.tee(timed([(0, delta("x")), (0, {"error": "boom"})])))
+    assert not failed.completed and failed.tokens_used == 1
+
+async def test_replay_stream_rebuilds_a_cached_response():
+    chunks = await collect(replay_stream({"content": "x" * 100, "tokens_used": 9}, chunk_size=64))
+    assert [len(chunk["content"]) for chunk in chunks] == [64, 36, 0]
+    assert chunks[-1]["done"] and chunks[-1]["tokens_used"] == 9
+
+def parse_frames(body: bytes):
+    return [loads(frame[len(b"data: "):]) for frame in body.split(b"\n\n") if frame]
+
+@pytest.mark.parametrize("coalesce_ms", [0, 50])
+async def test_chat_stream_sends_every_token(client, user_headers, mock_backend, monkeypatch, coalesce_ms):
+    monkeypatch.setattr(settings, "LLM_STREAM_COALESCE_MS", coalesce_ms)
+    tokens = [f"t{index} " for index in range(20)]
+    mock_backend("llama-3.1-8b", lambda request: stream_response(tokens))
+    response = await client.post("/api/chat/stream", headers=user_headers, json=CHAT)
+    assert response.status_code == 200
+    frames = parse_frames(response.content)
+    assert "".join(frame["content"] for frame in frames) == "".join(tokens)
+    assert frames[-1]["done"] and frames[-1]["conversation_id"]
+    # A stream read all at once is merged into a few frames when coalescing
+    assert len(frames) == 21 if coalesce_ms == 0 else len(frames) < 21
+
+async def test_chat_stream_reports_backend_errors_as_json(client, user_headers, mock_backend):
+    mock_backend("llama-3.1-8b", lambda request: httpx.Response(200, content=b'data: {"error": "oom"}\n\n'))
+    response = await client.post("/api/chat/stream", headers=user_headers, json=CHAT)
+    assert "error" in parse_frames(response.content)[-1]
+
+def http_scope(path, headers):
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 50000),
+        "root_path": "",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json")] + [
+            (key.lower().encode(), value.encode()) for key, value in headers.items()
+        ]
+    }
+
+async def test_a_client_disconnect_aborts_the_upstream_stream(app, user_headers, monkeypatch):
+    # A long generation on a real socket, so closing the upstream response is seen by the server
+    backend = StubBackend(latency_ms=1, token_ms=20, tokens=500, slots=1)
+    aborted = stream_stats.aborted
+    async with serve(backend) as base_url:
+        monkeypatch.setitem(model_registry._replicas, CHAT["model"], [Replica("vllm", base_url)])
+        requests = iter([{"type": "http.request", "body": dumps(CHAT), "more_body": False}])
+        disconnected = asyncio.Event()
+        frames = []
+
+        async def receive():
+            request = next(requests, None)
+            if request is None:
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            return request
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                frames.append(message["body"])
+                if len(frames) == 3:
+                    # A client that stops reading and then goes away: the send never completes
+                    disconnected.set()
+                    await asyncio.Event().wait()
+
+        try:
+            # Starlette cancels the blocked send, leaving the body generator suspended at a yield;
+            # the response closes it before returning, not whenever it is garbage collected
+            await app(http_scope("/api/chat/stream", user_headers), receive, send)
+            assert stream_stats.aborted == aborted + 1
+            for _ in range(100):
+                if not backend._slots.locked():
+                    break
+                await asyncio.sleep(0.01)
+            assert not backend._slots.locked(), "the stub is still generating"
+            assert backend.requests == 1 and len(frames) < 10
+        finally:
+            await providers.get("vllm")._clients.pop(base_url).aclose()
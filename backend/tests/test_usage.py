@@ -0,0 +1,224 @@
+from datetime import datetime, timedelta, timezone
+import asyncio
+
+import pytest
+from sqlalchemy import delete, func, insert, select
+
+import services.usage as usage
+from core.config import settings
+from core.database import AsyncSessionLocal, async_engine
+from core.migrations import _backfill_usage_rollups
+from models.api_usage import APIUsage, UsageDaily, UsageHourly
+from services.usage import UsageRecorder, usage_by_model, usage_series, write_usage
+
+MODEL = "llama-3.1-8b"
+
+@pytest.fixture
+def config(monkeypatch):
+    """Small queue and batch sizes; a flush interval long enough that only batches and close() flush"""
+    monkeypatch.setattr(settings, "USAGE_QUEUE_SIZE", 4)
+    monkeypatch.setattr(settings, "USAGE_FLUSH_BATCH_SIZE", 3)
+    monkeypatch.setattr(settings, "USAGE_FLUSH_INTERVAL_MS", 60_000)
+    monkeypatch.setattr(settings, "USAGE_OVERFLOW_POLICY", "spill")
+    return settings
+
+@pytest.fixture
+async def user_id(app, make_user):
+    return (await make_user())[0]
+
+@pytest.fixture
+def database_down(monkeypatch):
+    """Usage writes fail while the returned event is set"""
+    down = asyncio.Event()
+    down.set()
+    write_usage = usage.write_usage
+
+    async def failing(db, rows):
+        if down.is_set():
+            raise RuntimeError("database down")
+        await write_usage(db, rows)
+    monkeypatch.setattr(usage, "write_usage", failing)
+    return down
+
+def record(recorder, user_id, count, tokens=10):
+    for _ in range(count):
+        recorder.record(user_id, "/api/chat/completions", MODEL, tokens, 100, 200)
+
+async def stored(user_id):
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(select(func.count()).where(APIUsage.user_id == user_id))).scalar_one()
+        requests = (await db.execute(
+            select(func.coalesce(func.sum(UsageDaily.requests), 0)).where(UsageDaily.user_id == user_id)
+        )).scalar_one()
+    return rows, requests
+
+async def until(predicate, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+async def test_a_full_batch_is_flushed_at_once_and_close_drains_the_rest(config, redis, user_id):
+    recorder = UsageRecorder(redis)
+    recorder._spill_pending = False
+    recorder.start()
+    record(recorder, user_id, 3)
+    await until(lambda: recorder.flushed == 3)
+    assert recorder.flushes == 1 and await stored(user_id) == (3, 3)
+
+    record(recorder, user_id, 2)
+    await asyncio.sleep(0.05)
+    assert recorder.stats()["queued"] == 2
+    await recorder.close()
+    assert recorder.flushed == 5 and recorder.flushes == 2
+    assert await stored(user_id) == (5, 5)
+    assert await redis.llen(UsageRecorder.spill_key) == 0
+
+async def test_drop_policy_discards_rows_beyond_the_queue(config, redis, user_id):
+    config.USAGE_OVERFLOW_POLICY = "drop"
+    recorder = UsageRecorder(redis)
+    record(recorder, user_id, 6)
+    assert recorder.stats()["queued"] == 4 and recorder.dropped == 2
+    assert recorder.recorded == 6
+
+async def test_spilled_rows_are_reclaimed_and_written(config, redis, user_id):
+    recorder = UsageRecorder(redis)
+    record(recorder, user_id, 6)
+    assert recorder.stats()["queued"] == 4 and recorder.dropped == 0
+
+    await recorder._flush_pending()
+    # The overflow went to Redis; once the queue was written, a batch came back
+    assert recorder.spilled == 2 and recorder.flushed == 3
+    await recorder._flush_pending()
+    await recorder._flush_pending()
+    assert recorder.flushed == 6 and await redis.llen(UsageRecorder.spill_key) == 0
+    assert await stored(user_id) == (6, 6)
+
+async def test_rows_left_at_shutdown_are_spilled_for_the_next_process(config, redis, user_id, database_down):
+    recorder = UsageRecorder(redis)
+    recorder._spill_pending = False
+    recorder.start()
+    record(recorder, user_id, 2)
+    await recorder.close()
+    assert recorder.failed_flushes == 1 and await redis.llen(UsageRecorder.spill_key) == 2
+
+    database_down.clear()
+    successor = UsageRecorder(redis)
+    await successor._flush_pending()
+    await successor._flush_pending()
+    assert successor.flushed == 2 and await stored(user_id) == (2, 2)
+
+async def test_drop_policy_is_kept_at_shutdown(config, redis, user_id, database_down):
+    config.USAGE_OVERFLOW_POLICY = "drop"
+    recorder = UsageRecorder(redis)
+    recorder._spill_pending = False
+    recorder.start()
+    record(recorder, user_id, 2)
+    await recorder.close()
+    assert recorder.dropped == 2 and recorder.spilled == 0
+    assert await redis.llen(UsageRecorder.spill_key) == 0
+
+def usage_rows(user_id, day):
+    """A mix of models, statuses and hours over two days, ending on ``day``"""
+    rows = []
+    for index in range(12):
+        rows.append({
+            "user_id": user_id,
+            "endpoint": "/api/chat/completions",
+            "model_name": ["llama-3.1-8b", "mistral-7b", None][index % 3],
+            "tokens_used": 10 * index,
+            "latency_ms": 100 + index,
+            "status_code": 500 if index % 5 == 0 else 200,
+            "cost": 0.001 * index,
+            "created_at": day - timedelta(hours=5 * index, minutes=index)
+        })
+    return rows
+
+async def raw_totals(db, user_id):
+    """Totals per model straight from the usage rows"""
+    result = await db.execute(
+        select(
+            func.coalesce(APIUsage.model_name, ""),
+            func.count(),
+            func.sum(APIUsage.tokens_used),
+            func.sum(APIUsage.latency_ms)
+        ).where(APIUsage.user_id == user_id).group_by(APIUsage.model_name)
+    )
+    return {model: (requests, tokens, latency) for model, requests, tokens, latency in result}
+
+def summarized(by_model):
+    return {
+        model: (totals["requests"], totals["tokens_used"], totals["latency_ms_total"])
+        for model, totals in by_model.items()
+    }
+
+async def test_rollups_match_the_usage_rows(user_id):
+    now = datetime.now(timezone.utc)
+    rows = usage_rows(user_id, now)
+    async with AsyncSessionLocal() as db:
+        # Two writes, so the second one adds to buckets the first created
+        await write_usage(db, rows[:5])
+        await write_usage(db, rows[5:])
+        await db.commit()
+        by_model = await usage_by_model(db, user_id)
+        assert summarized(by_model) == await raw_totals(db, user_id)
+        assert sum(totals["errors"] for totals in by_model.values()) == 3
+
+        hours = await usage_series(db, user_id, "hour", now - timedelta(days=3), now)
+        assert sum(bucket["requests"] for bucket in hours) == 12
+        days = await usage_series(db, user_id, "day", now - timedelta(days=3), now)
+        assert sum(bucket["requests"] for bucket in days) == 12
+        assert sum(bucket["tokens_used"] for bucket in days) == sum(row["tokens_used"] for row in rows)
+
+async def test_an_hour_series_includes_the_hour_start_falls_in(user_id):
+    top = datetime(2026, 3, 2, 10, tzinfo=timezone.utc)
+    rows = usage_rows(user_id, top + timedelta(minutes=10))[:1] + usage_rows(user_id, top + timedelta(hours=1, minutes=20))[:1]
+    async with AsyncSessionLocal() as db:
+        await write_usage(db, rows)
+        await db.commit()
+        series = await usage_series(db, user_id, "hour", top + timedelta(minutes=30), top + timedelta(hours=1, minutes=59))
+    assert [bucket["hour"].replace(tzinfo=timezone.utc) for bucket in series] == [top, top + timedelta(hours=1)]
+
+async def test_unwritten_rows_are_added_to_the_totals(redis, user_id, monkeypatch):
+    recorder = UsageRecorder(redis)
+    monkeypatch.setattr(usage, "usage_recorder", recorder)
+    async with AsyncSessionLocal() as db:
+        await write_usage(db, usage_rows(user_id, datetime.now(timezone.utc))[:1])
+        await db.commit()
+    record(recorder, user_id, 2, tokens=7)
+
+    today = datetime.now(timezone.utc).date()
+    async with AsyncSessionLocal() as db:
+        by_model = await usage_by_model(db, user_id, start=today, end=today)
+        written = await usage_by_model(db, user_id, start=today - timedelta(days=5), end=today - timedelta(days=1))
+    assert by_model[MODEL]["requests"] == 1 + 2 and by_model[MODEL]["tokens_used"] == 0 + 14
+    # A range that ends before today has no live tail
+    assert all(totals["requests"] <= 1 for totals in written.values())
+
+async def test_backfill_builds_rollups_from_existing_usage_rows(user_id):
+    async with async_engine.connect() as conn:
+        transaction = await conn.begin()
+        try:
+            await conn.execute(delete(UsageHourly))
+            await conn.execute(delete(UsageDaily))
+            await conn.execute(insert(APIUsage), usage_rows(user_id, datetime(2026, 3, 2, 23, tzinfo=timezone.utc)))
+            await conn.run_sync(_backfill_usage_rollups)
+
+            daily = await conn.execute(
+                select(UsageDaily.model_name, func.sum(UsageDaily.requests), func.sum(UsageDaily.tokens_used),
+                       func.sum(UsageDaily.latency_ms_total))
+                .where(UsageDaily.user_id == user_id).group_by(UsageDaily.model_name)
+            )
+            assert {model: tuple(totals) for model, *totals in daily} == await raw_totals(conn, user_id)
+            hourly = (await conn.execute(
+                select(func.count(), func.sum(UsageHourly.requests)).where(UsageHourly.user_id == user_id)
+            )).one()
+            assert tuple(hourly) == (12, 12)
+
+            # Already built: a second run leaves the rollups alone
+            total = select(func.sum(UsageDaily.requests))
+            before = (await conn.execute(total)).scalar_one()
+            await conn.run_sync(_backfill_usage_rollups)
+            assert (await conn.execute(total)).scalar_one() == before
+        finally:
+            await transaction.rollback()